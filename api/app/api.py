@@ -1,16 +1,85 @@
+import asyncio
+import json
 import os
+import re
+import uuid
+from contextlib import asynccontextmanager
 from datetime import datetime, timezone
-from fastapi import FastAPI, HTTPException
+from typing import Optional
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
+import numpy as np
 import pandas as pd
 from dotenv import load_dotenv
-from quartz_solar_forecast.forecast import run_forecast
-from quartz_solar_forecast.pydantic_models import PVSite, ForecastRequest, TokenRequest
+from .formats import MEDIA_TYPES, choose_format, compress, encode_forecast, json_predictions
+from quartz_solar_forecast.data import NwpStore, get_nwp_store, set_nwp_store
+from quartz_solar_forecast.forecast import (
+    is_warm,
+    no_live_pv_site,
+    read_sites_csv_async,
+    run_forecast_async,
+    run_forecast_stream,
+    run_forecast_sweep,
+    warm_up,
+)
+from quartz_solar_forecast.metrics import metrics
+from quartz_solar_forecast.prefetch import NwpPrefetcher
+from quartz_solar_forecast.pydantic_models import (
+    ForecastRequest,
+    ForecastsRequest,
+    SweepRequest,
+    TokenRequest,
+)
 from quartz_solar_forecast.inverters.enphase import get_enphase_auth_url, get_enphase_access_token
+from quartz_solar_forecast.weather.client import close_async_session
 
 load_dotenv()
 
-app = FastAPI()
+# uploaded site files, their maximum size, and the number of sites forecast at once by
+# /forecasts/
+SITE_FILE_DIR = os.getenv("QUARTZ_SOLAR_FORECAST_SITE_FILE_DIR", ".site_files")
+MAX_SITE_FILE_BYTES = int(os.getenv("QUARTZ_SOLAR_FORECAST_MAX_SITE_FILE_BYTES", 100_000_000))
+BATCH_CONCURRENCY = int(os.getenv("QUARTZ_SOLAR_FORECAST_BATCH_CONCURRENCY", 8))
+# the largest number of layouts /forecast/sweep/ forecasts in one request
+MAX_SWEEP_CANDIDATES = int(os.getenv("QUARTZ_SOLAR_FORECAST_MAX_SWEEP_CANDIDATES", 1000))
+
+
+# the models loaded and run before the API is ready, see /ready
+WARM_UP_MODELS = [
+    model for model in os.getenv("QUARTZ_SOLAR_FORECAST_WARM_UP_MODELS", "gb").split(",") if model
+]
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # warm up the models in the background, unless it was done before the workers were forked
+    warm_up_task = None
+    if not is_warm():
+        loop = asyncio.get_running_loop()
+        warm_up_task = loop.run_in_executor(None, warm_up, WARM_UP_MODELS)
+
+    # prefetch the weather of known sites, so their forecasts read it from the local nwp store
+    prefetcher = None
+    prefetch_sites = os.getenv("QUARTZ_SOLAR_FORECAST_PREFETCH_SITES")
+    if prefetch_sites:
+        if get_nwp_store() is None:
+            set_nwp_store(NwpStore(".nwp_store"))
+        nwp_sources = os.getenv("QUARTZ_SOLAR_FORECAST_PREFETCH_NWP_SOURCES", "icon").split(",")
+        prefetcher = NwpPrefetcher(pd.read_csv(prefetch_sites), nwp_sources=nwp_sources)
+        prefetcher.start()
+
+    yield
+
+    if prefetcher is not None:
+        prefetcher.stop()
+    if warm_up_task is not None:
+        await warm_up_task
+    await close_async_session()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # CORS middleware setup
 origins = [
@@ -28,30 +97,163 @@ app.add_middleware(
     allow_headers=["*"]
 )
 
+@app.get("/ready")
+def ready():
+    """Readiness check, which fails until the models are warmed up"""
+    if not is_warm():
+        raise HTTPException(status_code=503, detail="Warming up")
+    return {"ready": True}
+
+@app.get("/metrics")
+def get_metrics():
+    """Stage timings, HTTP calls and cache hits of all the workers, in Prometheus text format"""
+    return PlainTextResponse(
+        metrics.aggregate().render_prometheus(), media_type="text/plain; version=0.0.4"
+    )
+
 @app.post("/forecast/")
-def forecast(forecast_request: ForecastRequest):
+async def forecast(forecast_request: ForecastRequest, request: Request, format: Optional[str] = None):
     site = forecast_request.site
     ts = forecast_request.timestamp if forecast_request.timestamp else datetime.now(timezone.utc).isoformat()
 
     timestamp = pd.Timestamp(ts).tz_localize(None)
     formatted_timestamp = timestamp.strftime('%Y-%m-%d %H:%M:%S')
 
-    site_no_live = PVSite(latitude=site.latitude, longitude=site.longitude, capacity_kwp=site.capacity_kwp)
-    predictions_no_live = run_forecast(site=site_no_live, ts=timestamp)
-
+    # the forecast without live pv data is for the site with the default tilt and orientation,
+    # see no_live_pv_site. /forecasts/ does the same, with run_forecast_stream
     if not site.inverter_type:
-        predictions = predictions_no_live
+        predictions = await run_forecast_async(site=no_live_pv_site(site), ts=timestamp)
     else:
-        predictions_with_live = run_forecast(site=site, ts=timestamp)
-        predictions_with_live['power_kw_no_live_pv'] = predictions_no_live['power_kw']
-        predictions = predictions_with_live
+        # the forecasts with and without live pv data are made from one nwp fetch
+        predictions = await run_forecast_async(site=site, ts=timestamp, with_no_live_pv=True)
+
+    # encode the predictions in the format the client asks for, see formats.py
+    response_format = choose_format(format, request.headers.get("accept"))
+    body = encode_forecast(formatted_timestamp, predictions, response_format)
+    body, content_encoding = compress(body, request.headers.get("accept-encoding"))
+
+    headers = {"Vary": "Accept, Accept-Encoding"}
+    if content_encoding is not None:
+        headers["Content-Encoding"] = content_encoding
+
+    return Response(content=body, media_type=MEDIA_TYPES[response_format], headers=headers)
 
-    response = {
+@app.post("/forecast/sweep/")
+def forecast_sweep(sweep_request: SweepRequest):
+    """Forecast many panel layouts at one location, with one weather fetch"""
+    site = sweep_request.site
+    n_candidates = 1
+    for values in [sweep_request.tilts, sweep_request.orientations, sweep_request.capacities_kwp]:
+        n_candidates *= len(values) if values is not None else 1
+    if n_candidates > MAX_SWEEP_CANDIDATES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many candidates ({n_candidates}), the limit is {MAX_SWEEP_CANDIDATES}",
+        )
+
+    ts = sweep_request.timestamp if sweep_request.timestamp else datetime.now(timezone.utc).isoformat()
+    timestamp = pd.Timestamp(ts).tz_localize(None)
+    formatted_timestamp = timestamp.strftime('%Y-%m-%d %H:%M:%S')
+
+    cube = run_forecast_sweep(
+        site,
+        tilts=sweep_request.tilts,
+        orientations=sweep_request.orientations,
+        capacities_kwp=sweep_request.capacities_kwp,
+        ts=timestamp,
+        model=sweep_request.model,
+    )
+    if cube is None:
+        raise HTTPException(status_code=400, detail="No weather data for the timestamp")
+
+    # missing values are null, JSON has no NaN
+    power_kw = cube.values.astype(object)
+    power_kw[np.isnan(cube.values)] = None
+
+    return {
         "timestamp": formatted_timestamp,
-        "predictions": predictions.to_dict(),
+        "candidates": [
+            {"tilt": float(tilt), "orientation": float(orientation), "capacity_kwp": float(capacity_kwp)}
+            for tilt, orientation, capacity_kwp in zip(
+                cube["tilt"].values, cube["orientation"].values, cube["capacity_kwp"].values
+            )
+        ],
+        "times": [time.isoformat() for time in pd.DatetimeIndex(cube["time"].values)],
+        "power_kw": power_kw.tolist(),
     }
 
-    return response
+@app.post("/site_files/")
+async def upload_site_file(request: Request):
+    """Save a csv file of sites, for one call of /forecasts/. The body is written as it arrives"""
+    os.makedirs(SITE_FILE_DIR, exist_ok=True)
+    site_file = uuid.uuid4().hex
+    path = os.path.join(SITE_FILE_DIR, f"{site_file}.csv")
+
+    size = 0
+    with open(path, "wb") as f:
+        async for chunk in request.stream():
+            size += len(chunk)
+            if size > MAX_SITE_FILE_BYTES:
+                break
+            f.write(chunk)
+
+    if size > MAX_SITE_FILE_BYTES:
+        os.remove(path)
+        raise HTTPException(
+            status_code=413, detail=f"Site file larger than {MAX_SITE_FILE_BYTES} bytes"
+        )
+
+    return {"site_file": site_file}
+
+@app.post("/forecasts/")
+async def forecasts(forecasts_request: ForecastsRequest):
+    """Forecast many sites, streaming one json line per site as soon as its forecast is ready"""
+    if (forecasts_request.sites is None) == (forecasts_request.site_file is None):
+        raise HTTPException(status_code=400, detail="Give either sites or site_file")
+
+    if forecasts_request.site_file is not None:
+        if not re.fullmatch("[0-9a-f]{32}", forecasts_request.site_file):
+            raise HTTPException(status_code=400, detail="Invalid site_file")
+        path = os.path.join(SITE_FILE_DIR, f"{forecasts_request.site_file}.csv")
+        if not os.path.exists(path):
+            raise HTTPException(status_code=404, detail="Site file not found")
+        # an invalid row is sent back as an error line, as a failed forecast is
+        sites = read_sites_csv_async(path, errors="return")
+    else:
+        path = None
+        sites = forecasts_request.sites
+
+    ts = forecasts_request.timestamp if forecasts_request.timestamp else datetime.now(timezone.utc).isoformat()
+    timestamp = pd.Timestamp(ts).tz_localize(None)
+    formatted_timestamp = timestamp.strftime('%Y-%m-%d %H:%M:%S')
+
+    async def stream():
+        results = run_forecast_stream(
+            sites, ts=timestamp, max_concurrency=BATCH_CONCURRENCY, with_no_live_pv=True
+        )
+        try:
+            async for i, site, predictions in results:
+                line = {
+                    "index": i,
+                    "site": site.model_dump() if site is not None else None,
+                    "timestamp": formatted_timestamp,
+                }
+                if isinstance(predictions, Exception):
+                    line["error"] = str(predictions)
+                else:
+                    line["predictions"] = json_predictions(predictions)
+                yield json.dumps(jsonable_encoder(line), allow_nan=False) + "\n"
+        finally:
+            # e.g. if the client stops reading, the forecasts left are cancelled and the site
+            # file is closed
+            await results.aclose()
+            # a site file is only used once
+            if path is not None:
+                await sites.aclose()
+                if os.path.exists(path):
+                    os.remove(path)
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
 
 @app.get("/solar_inverters/enphase/auth_url")
 def get_enphase_authorization_url():
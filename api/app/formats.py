@@ -0,0 +1,187 @@
+"""
+Response formats of the forecasts
+
+The /forecast/ endpoint returns its predictions in the format given by the `format` query
+parameter, or else by the Accept header:
+
+- json (application/json): the default, with the predictions as a dictionary keyed by time
+- columnar (application/vnd.quartz.columnar+json): the start time, the frequency and one array
+  of values per column
+- arrow (application/vnd.apache.arrow.stream): an Arrow IPC stream with a time column and
+  float32 value columns
+- msgpack (application/msgpack): the columnar payload, with float32 values
+
+The body is compressed with brotli or gzip if the client accepts it. The arrow, msgpack and
+brotli formats need the pyarrow, msgpack and brotli packages.
+"""
+import gzip
+import json
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+
+MEDIA_TYPES = {
+    "json": "application/json",
+    "columnar": "application/vnd.quartz.columnar+json",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "msgpack": "application/msgpack",
+}
+
+# bodies smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 500
+
+
+def _parse_quality(header: str) -> Dict[str, float]:
+    """
+    Get the values of an Accept or Accept-Encoding header and their quality
+
+    The values with q=0 are not acceptable, and are left out.
+    """
+    values = {}
+    for item in header.split(","):
+        value, *params = [part.strip() for part in item.split(";")]
+        quality = 1.0
+        for param in params:
+            name, _, param_value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(param_value)
+                except ValueError:
+                    quality = 0.0
+        if value and quality > 0:
+            values[value] = quality
+
+    return values
+
+
+def choose_format(response_format: Optional[str], accept: Optional[str]) -> str:
+    """
+    Choose the response format, from the format query parameter or the Accept header
+
+    :param response_format: the format query parameter, e.g. "arrow"
+    :param accept: the Accept header
+    :return: the name of the format in MEDIA_TYPES, json if nothing else is asked for
+    """
+    if response_format is not None:
+        if response_format not in MEDIA_TYPES:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unknown format {response_format}, choose from {list(MEDIA_TYPES)}",
+            )
+        return response_format
+
+    if accept:
+        accepted = _parse_quality(accept)
+        for media_type in sorted(accepted, key=lambda media_type: -accepted[media_type]):
+            for name, format_media_type in MEDIA_TYPES.items():
+                if media_type == format_media_type:
+                    return name
+
+    return "json"
+
+
+def json_predictions(predictions: pd.DataFrame) -> dict:
+    """
+    Get the predictions as a dictionary of columns keyed by time, with null for missing values
+    """
+    # JSON has no NaN
+    return predictions.astype(object).where(predictions.notna(), None).to_dict()
+
+
+def columnar_predictions(predictions: pd.DataFrame) -> dict:
+    """
+    Get the predictions as the start time, the frequency and one list of values per column
+    """
+    index = pd.DatetimeIndex(predictions.index)
+    freq = pd.tseries.frequencies.to_offset(index[1] - index[0]) if len(index) > 1 else None
+
+    return {
+        "start": index[0].isoformat() if len(index) > 0 else None,
+        "freq": freq.freqstr if freq is not None else None,
+        "values": {
+            column: [None if np.isnan(value) else value for value in predictions[column].tolist()]
+            for column in predictions.columns
+        },
+    }
+
+
+def _import(module: str):
+    try:
+        return __import__(module)
+    except ImportError:
+        raise HTTPException(
+            status_code=406, detail=f"This format needs {module}, which is not installed"
+        )
+
+
+def encode_forecast(timestamp: str, predictions: pd.DataFrame, response_format: str) -> bytes:
+    """
+    Encode the response of /forecast/
+
+    :param timestamp: the formatted timestamp of the forecast
+    :param predictions: the predictions, indexed by time
+    :param response_format: the name of the format in MEDIA_TYPES
+    :return: the response body
+    """
+    if response_format == "json":
+        response = {"timestamp": timestamp, "predictions": json_predictions(predictions)}
+        return json.dumps(
+            jsonable_encoder(response), separators=(",", ":"), allow_nan=False
+        ).encode()
+
+    if response_format == "columnar":
+        response = {"timestamp": timestamp, **columnar_predictions(predictions)}
+        return json.dumps(response, separators=(",", ":"), allow_nan=False).encode()
+
+    if response_format == "msgpack":
+        msgpack = _import("msgpack")
+        response = {"timestamp": timestamp, **columnar_predictions(predictions)}
+        return msgpack.packb(response, use_single_float=True)
+
+    if response_format == "arrow":
+        pa = _import("pyarrow")
+        columns = {"time": pa.array(pd.DatetimeIndex(predictions.index), pa.timestamp("ms"))}
+        for column in predictions.columns:
+            columns[column] = pa.array(predictions[column].to_numpy(np.float32))
+        table = pa.table(columns).replace_schema_metadata({"timestamp": timestamp})
+
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+
+    raise ValueError(f"Unknown format {response_format}")
+
+
+def compress(body: bytes, accept_encoding: Optional[str]) -> Tuple[bytes, Optional[str]]:
+    """
+    Compress a response body with brotli or gzip, if the client accepts it
+
+    :param body: the response body
+    :param accept_encoding: the Accept-Encoding header
+    :return: the body, and the Content-Encoding header or None if it was not compressed
+    """
+    if not accept_encoding or len(body) < MIN_COMPRESS_SIZE:
+        return body, None
+
+    # brotli is preferred over gzip, unless the client prefers gzip
+    accepted = _parse_quality(accept_encoding)
+    for encoding in sorted(("br", "gzip"), key=lambda encoding: -accepted.get(encoding, 0)):
+        if encoding not in accepted:
+            continue
+
+        if encoding == "br":
+            try:
+                import brotli
+
+                return brotli.compress(body, quality=5), "br"
+            except ImportError:
+                pass
+
+        if encoding == "gzip":
+            return gzip.compress(body, compresslevel=6), "gzip"
+
+    return body, None
@@ -0,0 +1,128 @@
+"""
+Serve the API with several worker processes
+
+The models are loaded and warmed up once, in this process, which then forks the workers. The
+workers share the memory of the models copy-on-write, and are ready as soon as they start.
+
+    python api/serve.py
+
+The number of workers is set with QUARTZ_SOLAR_FORECAST_WORKERS, and defaults to the number of
+CPUs. Workers which die are restarted.
+
+The workers write their metrics to QUARTZ_SOLAR_FORECAST_METRICS_DIR, or a new temporary
+directory if it is not set, so that /metrics gives the metrics of all of them.
+"""
+import gc
+import logging
+import os
+import signal
+import socket
+import sys
+import tempfile
+
+import uvicorn
+
+from app.api import WARM_UP_MODELS, app
+from quartz_solar_forecast.forecast import warm_up
+from quartz_solar_forecast.metrics import metrics, metrics_dir
+
+log = logging.getLogger(__name__)
+
+HOST = os.getenv("QUARTZ_SOLAR_FORECAST_HOST", "0.0.0.0")
+PORT = int(os.getenv("QUARTZ_SOLAR_FORECAST_PORT", 8000))
+WORKERS = int(os.getenv("QUARTZ_SOLAR_FORECAST_WORKERS", os.cpu_count() or 1))
+
+
+def run_worker(sock: socket.socket, index: int) -> None:
+    """Run one uvicorn server on the shared socket, in a forked process"""
+    # only the first worker prefetches the weather, they all share the nwp store
+    if index > 0:
+        os.environ.pop("QUARTZ_SOLAR_FORECAST_PREFETCH_SITES", None)
+
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    config = uvicorn.Config(app, log_level="info")
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def fork_worker(sock: socket.socket, index: int) -> int:
+    """Fork a worker, and return its pid"""
+    pid = os.fork()
+    if pid == 0:
+        exit_code = 0
+        try:
+            run_worker(sock, index)
+        except Exception:
+            log.exception(f"Worker {index} failed")
+            exit_code = 1
+        finally:
+            os._exit(exit_code)
+    return pid
+
+
+def serve(host: str = HOST, port: int = PORT, workers: int = WORKERS) -> None:
+    """
+    Warm up the models, then fork the workers and restart them if they die
+
+    :param host: the host to listen on
+    :param port: the port to listen on
+    :param workers: the number of worker processes
+    """
+    if metrics_dir() is None:
+        os.environ["QUARTZ_SOLAR_FORECAST_METRICS_DIR"] = tempfile.mkdtemp(prefix="quartz-metrics-")
+
+    warm_up(WARM_UP_MODELS)
+    # e.g. the time to load the models, which the workers do not count again
+    metrics.write_snapshot(metrics_dir())
+
+    # objects made so far are never collected, so the garbage collector of the workers does not
+    # write to, and copy, the pages of the shared models
+    gc.collect()
+    gc.freeze()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    log.info(f"Listening on {host}:{port} with {workers} workers")
+
+    workers_by_pid = {fork_worker(sock, index): index for index in range(workers)}
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers_by_pid:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while workers_by_pid:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+
+        index = workers_by_pid.pop(pid, None)
+        if index is None:
+            continue
+
+        if not stopping:
+            log.warning(f"Worker {index} exited with status {status}, restarting it")
+            workers_by_pid[fork_worker(sock, index)] = index
+
+    sock.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+    serve()
@@ -0,0 +1,11 @@
+"""
+Offline benchmarks of the forecast, replaying recorded Open-Meteo and inverter responses
+
+    python -m benchmarks.run
+
+See benchmarks/README.md.
+"""
+import os
+
+# the benchmarks run offline, so they do not send usage logs
+os.environ.setdefault("QUARTZ_SOLAR_FORECAST_LOGGING", "false")
@@ -0,0 +1,219 @@
+"""
+The benchmark cases
+
+Each case is a context manager, which sets up its inputs and gives the function to time. The
+inputs come from the fixtures, see replay.py, so the cases run without a network.
+"""
+import io
+from contextlib import contextmanager, redirect_stdout
+from datetime import datetime, timedelta
+from typing import Callable, ContextManager, Dict, Iterator, Tuple
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.replay import load_enphase_fixture
+from quartz_solar_forecast.data import format_nwp_data, get_nwp, get_nwp_df, process_pv_data
+from quartz_solar_forecast.forecasts.registry import get_model
+from quartz_solar_forecast.forecasts.v1_tilt_orientation import forecast_v1_tilt_orientation
+from quartz_solar_forecast.inverters.enphase import process_enphase_data
+from quartz_solar_forecast.pydantic_models import PVSite
+
+SITE = PVSite(latitude=51.75, longitude=-1.25, capacity_kwp=4.0)
+
+# the number of sites in the eval test set of the eval benchmark
+N_EVAL_SITES = 5
+# the number of sites in the xgb batch benchmark
+N_BATCH_SITES = 50
+
+
+class SkipBenchmark(Exception):
+    """A benchmark cannot run here, e.g. because its model cannot be downloaded"""
+
+
+def recent_ts() -> pd.Timestamp:
+    """Noon yesterday, so the forecast APIs rather than the archive are used"""
+    return pd.Timestamp(datetime.now().date() - timedelta(days=1)) + pd.Timedelta(hours=12)
+
+
+def historical_ts() -> pd.Timestamp:
+    """A timestamp old enough for the archive API"""
+    return pd.Timestamp("2024-06-01 12:00")
+
+
+@contextmanager
+def bench_get_nwp() -> Iterator[Callable]:
+    ts = recent_ts()
+    yield lambda: get_nwp(SITE, ts, "icon")
+
+
+@contextmanager
+def bench_get_nwp_archive() -> Iterator[Callable]:
+    ts = historical_ts()
+    yield lambda: get_nwp(SITE, ts, "icon")
+
+
+def _nwp_df(ts: pd.Timestamp) -> pd.DataFrame:
+    start = ts.date()
+    return get_nwp_df(SITE, start, start + timedelta(days=7), "icon")
+
+
+@contextmanager
+def bench_format_nwp_data() -> Iterator[Callable]:
+    df = _nwp_df(recent_ts())
+    yield lambda: format_nwp_data(df, "icon", SITE)
+
+
+def _live_generation(ts: pd.Timestamp) -> Tuple[dict, int]:
+    # the inverter response, and the start of the week of data asked for
+    data_json = load_enphase_fixture()
+    # the recorded intervals are moved to end at the timestamp
+    last = max(interval["end_at"] for interval in data_json["intervals"])
+    shift = int(ts.tz_localize("UTC").timestamp()) - last
+    for interval in data_json["intervals"]:
+        interval["end_at"] += shift
+    start_at = int((ts - pd.Timedelta(weeks=1)).tz_localize("UTC").timestamp())
+    return data_json, start_at
+
+
+@contextmanager
+def bench_process_pv_data() -> Iterator[Callable]:
+    ts = recent_ts()
+    data_json, start_at = _live_generation(ts)
+
+    def run():
+        live_generation_kw = process_enphase_data(data_json, start_at)
+        return process_pv_data(live_generation_kw, ts, SITE)
+
+    yield run
+
+
+@contextmanager
+def bench_forecast_v1_tilt_orientation() -> Iterator[Callable]:
+    ts = recent_ts()
+    nwp_xr = get_nwp(SITE, ts, "icon")
+    data_json, start_at = _live_generation(ts)
+    pv_xr = process_pv_data(process_enphase_data(data_json, start_at), ts, SITE)
+    model = get_model("0.4.0")
+    yield lambda: forecast_v1_tilt_orientation("icon", nwp_xr, pv_xr, ts, model=model)
+
+
+def _xgb_predictor():
+    from quartz_solar_forecast.forecasts.v2 import get_predictor
+
+    try:
+        return get_predictor()
+    except Exception as e:
+        raise SkipBenchmark(f"the xgb model could not be loaded: {e}")
+
+
+@contextmanager
+def bench_predict_power_output() -> Iterator[Callable]:
+    predictor = _xgb_predictor()
+
+    start_date = recent_ts().strftime("%Y-%m-%d")
+    yield lambda: predictor.predict_power_output(
+        SITE.latitude, SITE.longitude, start_date, SITE.capacity_kwp, SITE.orientation, SITE.tilt
+    )
+
+
+@contextmanager
+def bench_predict_power_output_batch() -> Iterator[Callable]:
+    predictor = _xgb_predictor()
+
+    # panels of many sizes and directions at the location of the fixtures
+    sites = pd.DataFrame(
+        {
+            "latitude": SITE.latitude,
+            "longitude": SITE.longitude,
+            "kwp": np.linspace(1, 10, N_BATCH_SITES),
+            "orientation": np.linspace(90, 270, N_BATCH_SITES),
+            "tilt": np.linspace(10, 50, N_BATCH_SITES),
+        }
+    )
+    start_date = recent_ts().strftime("%Y-%m-%d")
+    yield lambda: predictor.predict_power_output_sites(sites, start_date)
+
+
+@contextmanager
+def bench_eval() -> Iterator[Callable]:
+    from quartz_solar_forecast.eval.forecast import run_forecast
+    from quartz_solar_forecast.eval.metrics import metrics
+    from quartz_solar_forecast.eval.utils import combine_forecast_ground_truth
+
+    ts = historical_ts()
+    pv_df = pd.DataFrame(
+        {
+            "pv_id": range(N_EVAL_SITES),
+            "timestamp": ts,
+            "latitude": SITE.latitude,
+            "longitude": SITE.longitude,
+            "capacity": np.linspace(1, 5, N_EVAL_SITES),
+        }
+    )
+
+    # the test set nwp data, in the format of the Hugging Face ICON data
+    nwp_site_df = _nwp_df(ts).rename_axis("time").reset_index()
+    nwp_df = pd.concat(
+        [nwp_site_df.assign(pv_id=pv_id, timestamp=ts) for pv_id in pv_df["pv_id"]],
+        ignore_index=True,
+    )
+
+    times = pd.date_range(ts, periods=48, freq="h")
+    ground_truth_df = pd.DataFrame(
+        {
+            "pv_id": np.repeat(pv_df["pv_id"].values, len(times)),
+            "timestamp": np.tile(times, N_EVAL_SITES),
+            "horizon_hour": np.tile(range(len(times)), N_EVAL_SITES),
+            "value": 1.0,
+        }
+    )
+
+    def run():
+        # the eval pipeline prints its progress and metrics
+        with redirect_stdout(io.StringIO()):
+            predictions_df = run_forecast(pv_df=pv_df, nwp_df=nwp_df, nwp_source="ICON")
+            results_df = combine_forecast_ground_truth(predictions_df, ground_truth_df)
+            metrics(results_df, pv_df, include_night=True)
+        return results_df
+
+    yield run
+
+
+@contextmanager
+def bench_api_forecast() -> Iterator[Callable]:
+    from fastapi.testclient import TestClient
+
+    from api.app.api import app
+
+    body = {
+        "site": {
+            "latitude": SITE.latitude,
+            "longitude": SITE.longitude,
+            "capacity_kwp": SITE.capacity_kwp,
+        },
+        "timestamp": recent_ts().isoformat(),
+    }
+
+    # the client runs the startup of the API, and keeps one event loop for all the requests
+    with TestClient(app) as client:
+
+        def run():
+            response = client.post("/forecast/", json=body)
+            response.raise_for_status()
+            return response
+
+        yield run
+
+
+BENCHMARKS: Dict[str, Callable[[], ContextManager[Callable]]] = {
+    "get_nwp": bench_get_nwp,
+    "get_nwp_archive": bench_get_nwp_archive,
+    "format_nwp_data": bench_format_nwp_data,
+    "process_pv_data": bench_process_pv_data,
+    "forecast_v1_tilt_orientation": bench_forecast_v1_tilt_orientation,
+    "predict_power_output": bench_predict_power_output,
+    "predict_power_output_batch": bench_predict_power_output_batch,
+    "eval": bench_eval,
+    "api_forecast": bench_api_forecast,
+}
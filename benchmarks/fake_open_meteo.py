@@ -0,0 +1,201 @@
+"""
+A fake Open-Meteo server, for load testing without a network
+
+    python -m benchmarks.fake_open_meteo --port 8080 --latency-ms 50 --error-rate 0.01
+
+and then point the forecasts at it, e.g. to load test the API:
+
+    QUARTZ_SOLAR_FORECAST_OPEN_METEO_URL=http://localhost:8080 python api/serve.py
+
+The server answers the /v1/<endpoint> requests of the forecasts in the flatbuffers format, from
+the fixtures of the benchmarks, see replay.py, or with synthetic data for the requests which
+have no fixture. Latency, server errors and rate limiting can be injected.
+"""
+import argparse
+import asyncio
+import logging
+import random
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from aiohttp import web
+
+from benchmarks.replay import (
+    OPEN_METEO_DIR,
+    FixtureNotFoundError,
+    load_fixture,
+    move_to_request,
+    request_key,
+    synthesize_response,
+)
+
+log = logging.getLogger(__name__)
+
+# where the responses come from
+SOURCES = ["auto", "fixtures", "synthetic"]
+
+
+class FakeOpenMeteo:
+    """
+    Handler of Open-Meteo requests
+
+    :param source: "fixtures" to only answer requests which have a fixture, "synthetic" to make
+        up all the responses, or "auto" to use a fixture if there is one
+    :param latency_ms: the time taken by each request, in milliseconds
+    :param jitter_ms: the latency varies uniformly by up to this much either way
+    :param error_rate: the fraction of requests which get a 500 error
+    :param rate_limit_rate: the fraction of requests which get a 429 error, as when the daily
+        limit of the API is reached
+    :param directory: the directory of the fixtures
+    :param cache_size: the number of responses kept in memory
+    :param seed: the seed of the injected latency and errors
+    """
+
+    def __init__(
+        self,
+        source: str = "auto",
+        latency_ms: float = 0,
+        jitter_ms: float = 0,
+        error_rate: float = 0,
+        rate_limit_rate: float = 0,
+        directory: str = OPEN_METEO_DIR,
+        cache_size: int = 1024,
+        seed: Optional[int] = None,
+    ):
+        if source not in SOURCES:
+            raise ValueError(f"Unknown source {source}, choose from {SOURCES}")
+
+        self.source = source
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.directory = directory
+        self.cache_size = cache_size
+        self.random = random.Random(seed)
+
+        self._responses: OrderedDict = OrderedDict()
+        self.requests = 0
+        self.errors = 0
+
+    def get_body(self, url: str) -> bytes:
+        """
+        Get the flatbuffers body of a request
+
+        :param url: the url of the request, with its query string
+        :raises FixtureNotFoundError: if the source is "fixtures" and there is no fixture
+        """
+        # responses are kept by the whole url, as the synthetic ones depend on the dates
+        body = self._responses.get(url)
+        if body is not None:
+            self._responses.move_to_end(url)
+            return body
+
+        try:
+            if self.source == "synthetic":
+                raise FixtureNotFoundError(url)
+            body = move_to_request(load_fixture(request_key(url), self.directory), url)
+        except FixtureNotFoundError:
+            if self.source == "fixtures":
+                raise
+            body = synthesize_response(url)
+
+        self._responses[url] = body
+        if len(self._responses) > self.cache_size:
+            self._responses.popitem(last=False)
+        return body
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+
+        latency_ms = self.latency_ms + self.random.uniform(-self.jitter_ms, self.jitter_ms)
+        if latency_ms > 0:
+            await asyncio.sleep(latency_ms / 1000)
+
+        draw = self.random.random()
+        if draw < self.error_rate:
+            self.errors += 1
+            return web.Response(status=500, text="Injected server error")
+        if draw < self.error_rate + self.rate_limit_rate:
+            self.errors += 1
+            return _error(429, "Daily API request limit exceeded. Injected by the fake server.")
+
+        if request.query.get("format") != "flatbuffers":
+            return _error(400, "The fake server only supports format=flatbuffers")
+
+        try:
+            body = self.get_body(str(request.url))
+        except FixtureNotFoundError:
+            return _error(400, f"No fixture for {request.path_qs}")
+        except (KeyError, ValueError) as e:
+            return _error(400, f"Invalid request: {e}")
+
+        return web.Response(body=body, content_type="application/octet-stream")
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/v1/{endpoint}", self.handle)
+        return app
+
+
+def _error(status: int, reason: str) -> web.Response:
+    # the error body of Open-Meteo
+    return web.json_response({"error": True, "reason": reason}, status=status)
+
+
+@contextmanager
+def serve_in_thread(
+    server: Optional[FakeOpenMeteo] = None, host: str = "127.0.0.1", port: int = 0
+) -> Iterator[str]:
+    """
+    Run a fake server in a background thread, e.g. in tests or in-process load tests
+
+    :param server: the fake server, defaults to one with the fixtures and no injected faults
+    :param host: the host to listen on
+    :param port: the port to listen on, by default a free port
+    :return: the url of the server, e.g. "http://127.0.0.1:51234"
+    """
+    server = server or FakeOpenMeteo()
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(server.make_app(), access_log=None)
+
+    loop.run_until_complete(runner.setup())
+    site = web.TCPSite(runner, host, port)
+    loop.run_until_complete(site.start())
+    host, port = runner.addresses[0][:2]
+
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://{host}:{port}"
+    finally:
+        asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a fake Open-Meteo server")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--source", choices=SOURCES, default="auto")
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    fake = FakeOpenMeteo(
+        source=args.source,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        seed=args.seed,
+    )
+    web.run_app(fake.make_app(), host=args.host, port=args.port, access_log=None)
@@ -0,0 +1,57 @@
+"""
+Record the fixtures of the benchmarks
+
+    python -m benchmarks.record              # record the Open-Meteo responses
+    python -m benchmarks.record --synthetic  # make synthetic responses, without a network
+
+Each benchmark is set up and run once, and the Open-Meteo responses it gets are saved in
+benchmarks/fixtures/open_meteo. The Enphase response cannot be recorded without an Enphase
+system, so it is made up unless there is one already.
+"""
+import argparse
+import json
+import logging
+import os
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from benchmarks.cases import BENCHMARKS, SkipBenchmark
+from benchmarks.replay import FIXTURES_DIR, make_enphase_fixture, open_meteo_fixtures
+
+log = logging.getLogger(__name__)
+
+ENPHASE_FIXTURE = os.path.join(FIXTURES_DIR, "enphase_production_micro.json")
+
+
+def record(names: Optional[List[str]] = None, synthetic: bool = False) -> None:
+    """
+    Record the fixtures of benchmarks
+
+    :param names: the names of the benchmarks in BENCHMARKS, defaults to all of them
+    :param synthetic: if True, make up the responses rather than requesting them
+    """
+    if not os.path.exists(ENPHASE_FIXTURE):
+        os.makedirs(FIXTURES_DIR, exist_ok=True)
+        with open(ENPHASE_FIXTURE, "w") as f:
+            json.dump(make_enphase_fixture(datetime.now(timezone.utc)), f)
+
+    with open_meteo_fixtures("synthesize" if synthetic else "record"):
+        for name in names or list(BENCHMARKS):
+            log.info(f"Recording {name}")
+            try:
+                with BENCHMARKS[name]() as func:
+                    func()
+            except SkipBenchmark as e:
+                log.warning(f"Skipping {name}: {e}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Record the fixtures of the benchmarks")
+    parser.add_argument("names", nargs="*", help=f"the benchmarks, from {', '.join(BENCHMARKS)}")
+    parser.add_argument(
+        "--synthetic", action="store_true", help="make up the responses, without a network"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    record(args.names or None, args.synthetic)
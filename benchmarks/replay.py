@@ -0,0 +1,396 @@
+"""
+Record and replay the Open-Meteo responses of the benchmarks
+
+The responses are kept in benchmarks/fixtures/open_meteo, one flatbuffers file per request. A
+request is identified by its endpoint and parameters, without the dates, so the fixtures can be
+replayed for forecasts at any time: the forecast API is only used for recent timestamps, and
+the dates of those move with the clock.
+
+While replaying, the requests of the shared weather session and of the async forecasts are
+answered from the fixtures, and the HTTP cache, the nwp store and the forecast cache are turned
+off, so each call goes through the whole forecast.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import struct
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional
+from urllib.parse import parse_qsl, urlparse
+
+import flatbuffers
+import numpy as np
+import pandas as pd
+import requests
+from openmeteo_sdk.Variable import Variable
+from requests.adapters import HTTPAdapter
+
+import quartz_solar_forecast.data as data
+from quartz_solar_forecast.forecast_cache import get_forecast_cache, set_forecast_cache
+from quartz_solar_forecast.nwp_store import get_nwp_store, set_nwp_store
+from quartz_solar_forecast.weather.client import (
+    decode_weather_api,
+    get_session,
+    open_meteo_url,
+)
+
+log = logging.getLogger(__name__)
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+OPEN_METEO_DIR = os.path.join(FIXTURES_DIR, "open_meteo")
+
+# parameters which do not change the data of a fixture
+IGNORED_PARAMS = {"format", "start_date", "end_date", "timezone"}
+
+
+class FixtureNotFoundError(Exception):
+    """There is no recorded response for a request"""
+
+
+def _query(url: str, params: Optional[dict] = None) -> Dict[str, str]:
+    # the parameters of the url and params, repeated parameters and lists are joined with commas
+    query: Dict[str, List[str]] = {}
+    for key, value in parse_qsl(urlparse(url).query):
+        query.setdefault(key, []).append(value)
+    for key, value in (params or {}).items():
+        query.setdefault(key, []).extend(value if isinstance(value, list) else [str(value)])
+    return {key: ",".join(values) for key, values in query.items()}
+
+
+def request_key(url: str, params: Optional[dict] = None) -> str:
+    """
+    Get the name of the fixture of a request
+
+    :param url: the url, which may include a query string
+    :param params: more request parameters
+    :return: the path and the sorted parameters, e.g.
+        "/v1/gfs?hourly=visibility&latitude=51.75&longitude=-1.25". The host is left out, so
+        the fixtures are the same for any Open-Meteo server
+    """
+    items = sorted(
+        f"{key}={value}" for key, value in _query(url, params).items() if key not in IGNORED_PARAMS
+    )
+    return f"{urlparse(url).path}?{'&'.join(items)}"
+
+
+def fixture_path(key: str, directory: str = OPEN_METEO_DIR) -> str:
+    return os.path.join(directory, hashlib.sha1(key.encode()).hexdigest()[:16] + ".fb")
+
+
+def load_fixture(key: str, directory: str = OPEN_METEO_DIR) -> bytes:
+    """
+    Read the recorded body of a request
+
+    :raises FixtureNotFoundError: if the request has not been recorded
+    """
+    path = fixture_path(key, directory)
+    if not os.path.exists(path):
+        raise FixtureNotFoundError(
+            f"No fixture for {key}, record it with python -m benchmarks.record"
+        )
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def move_to_request(body: bytes, url: str) -> bytes:
+    """
+    Move the times of a recorded response to the start date of a request
+
+    The fixtures are replayed for any dates, and the forecasts put the values at the times of
+    the response, so the times are moved as if the response had been recorded for the request.
+
+    :param body: the recorded body, see `encode_weather_api`
+    :param url: the url of the request, with its query string
+    :return: the body, with the same values from the start date of the request
+    """
+    start_date = _query(url).get("start_date")
+    if start_date is None:
+        return body
+
+    start = int(pd.Timestamp(start_date, tz="UTC").timestamp())
+    data = bytearray(body)
+    for message in decode_weather_api(data):
+        hourly = message.Hourly()
+        if hourly is None:
+            continue
+        shift = start - hourly.Time()
+        # the time and time_end fields of VariablesWithTime, at vtable offsets 4 and 6
+        for vtable_offset in (4, 6):
+            offset = hourly._tab.Offset(vtable_offset)
+            if offset:
+                position = hourly._tab.Pos + offset
+                (value,) = struct.unpack_from("<q", data, position)
+                struct.pack_into("<q", data, position, value + shift)
+    return bytes(data)
+
+
+def save_fixture(key: str, body: bytes, directory: str = OPEN_METEO_DIR) -> None:
+    """
+    Save the body of a request, and add the request to the index of the fixtures
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = fixture_path(key, directory)
+    with open(path, "wb") as f:
+        f.write(body)
+
+    index_path = os.path.join(directory, "index.json")
+    index = {}
+    if os.path.exists(index_path):
+        with open(index_path) as f:
+            index = json.load(f)
+    index[os.path.basename(path)] = key
+    with open(index_path, "w") as f:
+        json.dump(index, f, indent=2, sort_keys=True)
+
+
+def encode_weather_api(
+    latitude: float,
+    longitude: float,
+    time: int,
+    interval: int,
+    hourly: Dict[str, np.ndarray],
+) -> bytes:
+    """
+    Encode the flatbuffers message of one location, as Open-Meteo sends it
+
+    A response for many locations is the messages of each location, one after the other. This
+    is the inverse of `decode_weather_api`, for recording and replaying responses.
+
+    :param latitude: the latitude of the location
+    :param longitude: the longitude of the location
+    :param time: the first time, in seconds since the epoch
+    :param interval: the time between values, in seconds
+    :param hourly: the values of each variable, in the order of the request
+    :return: the size-prefixed message
+    """
+    builder = flatbuffers.Builder(1024)
+
+    n_times = 0
+    variable_offsets = []
+    for name, values in hourly.items():
+        values = np.asarray(values, dtype=np.float32)
+        n_times = len(values)
+        values_offset = builder.CreateNumpyVector(values)
+
+        # e.g. temperature_2m is the temperature variable at an altitude of 2 m
+        match = re.fullmatch(r"(.+)_(\d+)m", name)
+        base, altitude = (match.group(1), int(match.group(2))) if match else (name, 0)
+
+        # VariableWithValues: variable, unit, value, values, values_int64, altitude, ...
+        builder.StartObject(13)
+        builder.PrependUint8Slot(0, getattr(Variable, base, Variable.undefined), 0)
+        builder.PrependUOffsetTRelativeSlot(3, values_offset, 0)
+        builder.PrependInt16Slot(5, altitude, 0)
+        variable_offsets.append(builder.EndObject())
+
+    builder.StartVector(4, len(variable_offsets), 4)
+    for offset in reversed(variable_offsets):
+        builder.PrependUOffsetTRelative(offset)
+    variables_offset = builder.EndVector()
+
+    # VariablesWithTime: time, time_end, interval, variables
+    builder.StartObject(4)
+    builder.PrependInt64Slot(0, time, 0)
+    builder.PrependInt64Slot(1, time + n_times * interval, 0)
+    builder.PrependInt32Slot(2, interval, 0)
+    builder.PrependUOffsetTRelativeSlot(3, variables_offset, 0)
+    hourly_offset = builder.EndObject()
+
+    # WeatherApiResponse: latitude, longitude, ..., hourly is field 11 of 15
+    builder.StartObject(15)
+    builder.PrependFloat32Slot(0, latitude, 0)
+    builder.PrependFloat32Slot(1, longitude, 0)
+    builder.PrependUOffsetTRelativeSlot(11, hourly_offset, 0)
+    builder.FinishSizePrefixed(builder.EndObject())
+
+    return bytes(builder.Output())
+
+
+def synthesize_response(url: str, params: Optional[dict] = None) -> bytes:
+    """
+    Make a plausible response to an Open-Meteo request, for when it cannot be recorded
+
+    The radiation follows the sun over clear skies, and the other variables vary smoothly. The
+    values only depend on the request, so the same request always gets the same response.
+    """
+    query = _query(url, params)
+
+    latitudes = [float(latitude) for latitude in query["latitude"].split(",")]
+    longitudes = [float(longitude) for longitude in query["longitude"].split(",")]
+    variables = query["hourly"].split(",")
+    start = pd.Timestamp(query["start_date"], tz="UTC")
+    end = pd.Timestamp(query["end_date"], tz="UTC") + pd.Timedelta(days=1)
+    times = pd.date_range(start, end, freq="h", inclusive="left")
+
+    seed = int(hashlib.sha1(request_key(url, params).encode()).hexdigest()[:8], 16)
+
+    body = b""
+    for latitude, longitude in zip(latitudes, longitudes):
+        sun = _clear_sky_fraction(times, latitude, longitude)
+        hourly = {}
+        for i, variable in enumerate(variables):
+            noise = _noise(times, seed + i)
+            if "radiation" in variable or "irradiance" in variable:
+                values = 900 * sun * (0.8 + 0.2 * noise)
+            elif variable == "is_day":
+                values = (sun > 0) * 1.0
+            elif variable.startswith("cloud_cover"):
+                # smoothed over the 6 hours around each time, also at the ends of the range
+                padded = pd.date_range(
+                    times[0] - pd.Timedelta(hours=3), periods=len(times) + 5, freq="h"
+                )
+                values = 100 * np.convolve(_noise(padded, seed + i), np.ones(6) / 6, mode="valid")
+            elif variable == "visibility":
+                values = 20000 + 10000 * noise
+            elif variable == "precipitation":
+                values = np.where(noise > 0.9, noise, 0.0)
+            elif variable == "surface_pressure":
+                values = 1000 + 20 * noise
+            elif variable == "relative_humidity_2m":
+                values = 100 - 50 * sun - 10 * noise
+            elif variable == "wind_direction_10m":
+                values = 360 * noise
+            elif variable.startswith("temperature") or variable.startswith("dew_point"):
+                values = 10 + 10 * sun + noise
+            else:
+                values = 10 * noise
+            hourly[variable] = values
+
+        body += encode_weather_api(latitude, longitude, int(start.timestamp()), 3600, hourly)
+
+    return body
+
+
+def _noise(times: pd.DatetimeIndex, seed: int) -> np.ndarray:
+    # uniform noise in [0, 1) which only depends on the hour, like the weather of a real
+    # server, so overlapping requests get the same values
+    hours = (times.asi8 // 3_600_000_000_000).astype(np.float64)
+    x = np.sin(hours * 12.9898 + (seed % 10007) * 78.233) * 43758.5453
+    return x - np.floor(x)
+
+
+def _clear_sky_fraction(times: pd.DatetimeIndex, latitude: float, longitude: float) -> np.ndarray:
+    # the sine of the solar elevation, or 0 at night
+    day_of_year = times.dayofyear.values
+    declination = np.radians(23.44) * np.sin(2 * np.pi * (284 + day_of_year) / 365)
+    solar_time = times.hour.values + times.minute.values / 60 + longitude / 15
+    hour_angle = np.radians(15 * (solar_time - 12))
+    latitude = np.radians(latitude)
+    elevation = np.sin(latitude) * np.sin(declination) + np.cos(latitude) * np.cos(
+        declination
+    ) * np.cos(hour_angle)
+    return np.clip(elevation, 0, None)
+
+
+class FixtureAdapter(HTTPAdapter):
+    """
+    Transport adapter which answers Open-Meteo requests from the fixtures
+
+    :param mode: "replay" to read the fixtures, "record" to make the request and save the
+        response, or "synthesize" to save a synthetic response
+    """
+
+    def __init__(self, mode: str = "replay", directory: str = OPEN_METEO_DIR):
+        super().__init__()
+        self.mode = mode
+        self.directory = directory
+
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        key = request_key(request.url)
+
+        if self.mode == "record":
+            response = super().send(request, **kwargs)
+            if response.status_code == 200:
+                save_fixture(key, response.content, self.directory)
+            return response
+
+        if self.mode == "synthesize":
+            body = synthesize_response(request.url)
+            save_fixture(key, body, self.directory)
+        else:
+            body = move_to_request(load_fixture(key, self.directory), request.url)
+
+        response = requests.Response()
+        response.status_code = 200
+        response._content = body
+        response.headers["Content-Type"] = "application/octet-stream"
+        response.url = request.url
+        response.request = request
+        return response
+
+
+@contextmanager
+def open_meteo_fixtures(mode: str = "replay", directory: str = OPEN_METEO_DIR) -> Iterator[None]:
+    """
+    Answer the Open-Meteo requests of this process from the fixtures
+
+    :param mode: "replay", "record" or "synthesize", see `FixtureAdapter`
+    :param directory: the directory of the fixtures
+    """
+    session = get_session()
+    adapters = dict(session.adapters)
+    adapter = FixtureAdapter(mode, directory)
+    for url in {open_meteo_url(), open_meteo_url(archive=True)}:
+        session.mount(url, adapter)
+
+    async def weather_api_async(session, url, params):
+        # the async forecasts read their responses with aiohttp, outside of the session
+        key = request_key(url, params)
+        if mode == "synthesize":
+            save_fixture(key, synthesize_response(url, params), directory)
+        elif mode == "record":
+            return await weather_api_async_original(session, url, params)
+        return decode_weather_api(load_fixture(key, directory))
+
+    weather_api_async_original = data.weather_api_async
+    data.weather_api_async = weather_api_async
+
+    store, cache = get_nwp_store(), get_forecast_cache()
+    set_nwp_store(None)
+    set_forecast_cache(None)
+
+    try:
+        with session.cache_disabled():
+            yield
+    finally:
+        session.adapters.clear()
+        session.adapters.update(adapters)
+        data.weather_api_async = weather_api_async_original
+        set_nwp_store(store)
+        set_forecast_cache(cache)
+
+
+def load_enphase_fixture(
+    path: str = os.path.join(FIXTURES_DIR, "enphase_production_micro.json"),
+) -> dict:
+    """
+    Read the recorded response of the Enphase production_micro telemetry API
+    """
+    with open(path) as f:
+        return json.load(f)
+
+
+def make_enphase_fixture(end: datetime, weeks: int = 1, capacity_w: float = 4000) -> dict:
+    """
+    Make a week of 5 minute Enphase production intervals, for when they cannot be recorded
+
+    :param end: the end of the last interval
+    :param weeks: how many weeks of intervals
+    :param capacity_w: the peak power of the system
+    :return: the body of a production_micro response
+    """
+    if end.tzinfo is None:
+        end = end.replace(tzinfo=timezone.utc)
+    times = pd.date_range(end=end, periods=weeks * 7 * 24 * 12, freq="5min")
+    sun = _clear_sky_fraction(times, 51.75, -1.25)
+    return {
+        "granularity": "week",
+        "intervals": [
+            {"end_at": int(time.timestamp()), "devices_reporting": 10, "powr": int(power)}
+            for time, power in zip(times, capacity_w * sun)
+        ],
+    }
+
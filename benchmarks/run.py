@@ -0,0 +1,211 @@
+"""
+Run the benchmarks, and compare them with the saved baseline
+
+    python -m benchmarks.run                      # run all the benchmarks
+    python -m benchmarks.run get_nwp eval         # run some of them
+    python -m benchmarks.run --save               # save the results as the baseline
+    python -m benchmarks.run --compare            # fail if slower than the baseline
+
+Each benchmark reports its throughput, p50 and p99 latency and peak memory. The peak memory is
+measured with tracemalloc on a separate call, so it does not slow down the timed calls.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from benchmarks.cases import BENCHMARKS, SkipBenchmark
+from benchmarks.replay import open_meteo_fixtures
+
+log = logging.getLogger(__name__)
+
+# the baseline depends on the machine, so it is saved locally and not committed
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baselines", "baseline.json")
+
+# how much slower, or bigger, than the baseline a benchmark can be before it is a regression
+DEFAULT_TOLERANCE = 0.25
+
+
+def measure(func: Callable, iterations: int = 20, warmup: int = 2) -> Dict[str, float]:
+    """
+    Time a function
+
+    :param func: the function, called without arguments
+    :param iterations: the number of timed calls
+    :param warmup: the number of calls before the timed ones, e.g. to load models
+    :return: dictionary of iterations, throughput (calls per second), p50_ms, p99_ms and
+        peak_memory_mb
+    """
+    for _ in range(warmup):
+        func()
+
+    durations = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    durations = np.array(durations)
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "iterations": iterations,
+        "throughput": iterations / durations.sum(),
+        "p50_ms": 1000 * float(np.percentile(durations, 50)),
+        "p99_ms": 1000 * float(np.percentile(durations, 99)),
+        "peak_memory_mb": peak / 2**20,
+    }
+
+
+def run_benchmarks(
+    names: Optional[List[str]] = None, iterations: int = 20, warmup: int = 2
+) -> Dict[str, dict]:
+    """
+    Run benchmarks on the fixtures
+
+    :param names: the names of the benchmarks in BENCHMARKS, defaults to all of them
+    :param iterations: the number of timed calls of each benchmark
+    :param warmup: the number of untimed calls first
+    :return: dictionary of benchmark name to its results, see `measure`. Benchmarks which
+        cannot run here have a "skipped" reason instead
+    """
+    results = {}
+    with open_meteo_fixtures():
+        for name in names or list(BENCHMARKS):
+            try:
+                with BENCHMARKS[name]() as func:
+                    results[name] = measure(func, iterations, warmup)
+            except SkipBenchmark as e:
+                log.warning(f"Skipping {name}: {e}")
+                results[name] = {"skipped": str(e)}
+
+    return results
+
+
+def compare(
+    results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float = DEFAULT_TOLERANCE
+) -> List[str]:
+    """
+    Compare results with a baseline
+
+    :param results: the results of `run_benchmarks`
+    :param baseline: saved results of `run_benchmarks`
+    :param tolerance: the fraction by which p50, p99 and peak memory can exceed the baseline
+    :return: a description of each regression
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None or "skipped" in result or "skipped" in base:
+            continue
+        for metric in ["p50_ms", "p99_ms", "peak_memory_mb"]:
+            if result[metric] > base[metric] * (1 + tolerance):
+                regressions.append(
+                    f"{name} {metric} {result[metric]:.2f} is more than "
+                    f"{100 * tolerance:.0f}% over the baseline {base[metric]:.2f}"
+                )
+    return regressions
+
+
+def format_results(results: Dict[str, dict], baseline: Optional[Dict[str, dict]] = None) -> str:
+    """
+    Make a table of the results, with the change of p50 from the baseline
+    """
+    lines = [
+        f"{'benchmark':<30} {'calls/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'peak MB':>9} {'p50 vs base':>12}"
+    ]
+    for name, result in results.items():
+        if "skipped" in result:
+            lines.append(f"{name:<30} skipped: {result['skipped']}")
+            continue
+
+        change = ""
+        base = (baseline or {}).get(name)
+        if base is not None and "skipped" not in base:
+            change = f"{100 * (result['p50_ms'] / base['p50_ms'] - 1):+.0f}%"
+
+        lines.append(
+            f"{name:<30} {result['throughput']:>9.1f} {result['p50_ms']:>9.2f} "
+            f"{result['p99_ms']:>9.2f} {result['peak_memory_mb']:>9.2f} {change:>12}"
+        )
+    return "\n".join(lines)
+
+
+def load_baseline(path: str = BASELINE_PATH) -> Optional[Dict[str, dict]]:
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)["results"]
+
+
+def save_baseline(results: Dict[str, dict], path: str = BASELINE_PATH) -> None:
+    """
+    Save results as the baseline, with the machine they were measured on
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(
+            {
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "processor": platform.processor(),
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+
+
+def main(args: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Run the offline benchmarks")
+    parser.add_argument(
+        "names", nargs="*", help=f"the benchmarks to run, from {', '.join(BENCHMARKS)}"
+    )
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--save", action="store_true", help="save the results as the baseline")
+    parser.add_argument(
+        "--compare", action="store_true", help="exit with an error if slower than the baseline"
+    )
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    args = parser.parse_args(args)
+    for name in args.names:
+        if name not in BENCHMARKS:
+            parser.error(f"Unknown benchmark {name}")
+
+    results = run_benchmarks(args.names or None, args.iterations, args.warmup)
+    baseline = load_baseline(args.baseline)
+    print(format_results(results, baseline))
+
+    if args.save:
+        save_baseline(results, args.baseline)
+        print(f"Saved the baseline to {args.baseline}")
+
+    if args.compare:
+        if baseline is None:
+            print(f"There is no baseline at {args.baseline}, save one with --save")
+            return 1
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        return 1 if regressions else 0
+
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    sys.exit(main())
@@ -0,0 +1,152 @@
+""" Backtest the gb model for one site over many forecast init times """
+import logging
+import os
+from datetime import datetime
+from typing import Optional, Union
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from quartz_solar_forecast.data import get_nwp_df, process_pv_data
+from quartz_solar_forecast.forecasts.v1_tilt_orientation import forecast_v1_tilt_orientation_batch
+from quartz_solar_forecast.pydantic_models import PVSite
+
+log = logging.getLogger(__name__)
+
+# each forecast uses 8 days of hourly nwp data, from midnight of the day of the init time,
+# the same as get_nwp
+NWP_WINDOW = pd.Timedelta(days=8)
+
+
+def make_backtest_nwp_data(
+    df: pd.DataFrame, init_dates: pd.DatetimeIndex, nwp_source: str, site: PVSite
+) -> xr.Dataset:
+    """
+    Make one NWP dataset with one "time" entry per init date, from hourly nwp data
+
+    For each init date, the steps are taken from the 8 days of data starting at midnight of
+    that date. This gives each forecast the same data as `get_nwp` would.
+
+    :param df: hourly nwp data covering all the init dates, indexed by time
+    :param init_dates: the days, at midnight, which are used as nwp init times
+    :param nwp_source: the nwp data source
+    :param site: the PV site
+    :return: nwp data in xarray, with dimensions time, step and variable
+    """
+    steps = pd.to_timedelta(np.arange(NWP_WINDOW // pd.Timedelta(hours=1)), unit="h")
+
+    # missing data, e.g. at the end of the range, is left as nan
+    times = init_dates.values[:, None] + steps.values[None, :]
+    values = df.reindex(pd.DatetimeIndex(times.ravel())).values
+    values = values.reshape(len(init_dates), len(steps), len(df.columns))
+
+    data_xr = xr.DataArray(
+        data=values,
+        dims=["time", "step", "variable"],
+        coords=dict(
+            time=("time", init_dates),
+            step=("step", steps),
+            variable=df.columns,
+        ),
+    )
+    data_xr = data_xr.to_dataset(name=nwp_source)
+    data_xr = data_xr.assign_coords({"x": [site.longitude], "y": [site.latitude]})
+    return data_xr
+
+
+def run_backtest(
+    site: PVSite,
+    start: datetime,
+    end: datetime,
+    freq: Union[str, pd.Timedelta] = "6h",
+    nwp_source: str = "icon",
+    output_file: Optional[str] = None,
+    chunk_size: int = 100,
+) -> Optional[pd.DataFrame]:
+    """
+    Run the gb model for one site, for every init time from start to end
+
+    The weather for the whole range is fetched once. Init times more than 3 months in the past
+    use the Historical Weather API, as in `get_nwp`. The model is then run on the init times
+    in chunks.
+
+    :param site: the PV site
+    :param start: the first init time
+    :param end: the last init time, included
+    :param freq: the frequency of the init times, e.g. "6h"
+    :param nwp_source: the nwp data source. Either "gfs", "icon" or "ukmo". Defaults to "icon"
+    :param output_file: if given, each chunk of results is appended to this csv file as soon as
+        it is ready, and nothing is returned
+    :param chunk_size: the number of init times to run the model on at once
+    :return: dataframe with columns datetime, power_kw and forecast_init_time, unless
+        output_file is given
+    """
+    init_times = pd.date_range(start=start, end=end, freq=freq)
+    if len(init_times) == 0:
+        raise ValueError(f"No init times between {start} and {end}")
+
+    # the model is trained on sites with capacity <= 4 kWp, see predict_ocf
+    capacity_kwp_original = site.capacity_kwp
+    if capacity_kwp_original > 4:
+        site = site.model_copy(update={"capacity_kwp": 4})
+    scale = capacity_kwp_original / site.capacity_kwp if capacity_kwp_original > 4 else 1.0
+
+    # fetch the weather once for each data source, historical or not
+    now = datetime.now()
+    historical = np.array([(now - ts).days > 90 for ts in init_times])
+    nwp_xrs = {}
+    for is_historical in [True, False]:
+        group_init_times = init_times[historical == is_historical]
+        if len(group_init_times) == 0:
+            continue
+
+        init_dates = group_init_times.normalize().unique()
+        first_day = init_dates[0].date()
+        last_day = (init_dates[-1] + NWP_WINDOW - pd.Timedelta(days=1)).date()
+
+        log.info(f"Getting nwp data from {first_day} to {last_day}, {is_historical=}")
+        df = get_nwp_df(site, first_day, last_day, nwp_source, historical=is_historical)
+        nwp_xrs[is_historical] = make_backtest_nwp_data(df, init_dates, nwp_source, site)
+
+    # no live pv data is used
+    pv_xr = process_pv_data(
+        pd.DataFrame({"timestamp": init_times, "power_kw": np.nan}), init_times[-1], site
+    )
+
+    if output_file is not None and os.path.exists(output_file):
+        os.remove(output_file)
+
+    all_forecasts = []
+    for i in range(0, len(init_times), chunk_size):
+        chunk = init_times[i:i + chunk_size]
+        chunk_historical = historical[i:i + chunk_size]
+        log.info(f"Running backtest for init times {chunk[0]} to {chunk[-1]}")
+
+        for is_historical in [True, False]:
+            group_init_times = chunk[chunk_historical == is_historical]
+            if len(group_init_times) == 0:
+                continue
+
+            pred_df = forecast_v1_tilt_orientation_batch(
+                nwp_source, {"1": nwp_xrs[is_historical]}, pv_xr, list(group_init_times)
+            )
+            forecasts = pd.DataFrame(
+                {
+                    "datetime": pred_df["time"],
+                    "power_kw": pred_df["power_kw"] * scale,
+                    "forecast_init_time": pred_df["ts"],
+                }
+            )
+
+            if output_file is not None:
+                forecasts.to_csv(
+                    output_file, mode="a", index=False, header=not os.path.exists(output_file)
+                )
+            else:
+                all_forecasts.append(forecasts)
+
+    if output_file is not None:
+        return None
+
+    return pd.concat(all_forecasts, ignore_index=True)
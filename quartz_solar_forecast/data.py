@@ -1,19 +1,63 @@
 """ Function to get NWP data and create fake PV dataset"""
+import asyncio
+import logging
 import ssl
-from datetime import datetime
-from typing import Optional
+from concurrent.futures import Executor, Future
+from datetime import date, datetime, timezone
+from typing import List, Optional, Tuple
 
 import numpy as np
-import openmeteo_requests
 import pandas as pd
-import requests_cache
 import xarray as xr
-from retry_requests import retry
 
+from quartz_solar_forecast.metrics import inc, timed
+from quartz_solar_forecast.nwp_store import NwpStore, get_nwp_store, set_nwp_store  # noqa: F401
 from quartz_solar_forecast.pydantic_models import PVSite
+from quartz_solar_forecast.weather.client import (
+    NWP_RUN_SCHEDULE,
+    get_async_session,
+    get_openmeteo_client,
+    latest_run,
+    open_meteo_url,
+    weather_api_async,
+)
 
 ssl._create_default_https_context = ssl._create_unverified_context
 
+log = logging.getLogger(__name__)
+
+
+# the Open-Meteo hourly variables, and the names they are given in the nwp data
+NWP_VARIABLES = {
+    "temperature_2m": "t",
+    "precipitation": "prate",
+    "cloud_cover_low": "lcc",
+    "cloud_cover_mid": "mcc",
+    "cloud_cover_high": "hcc",
+    "wind_speed_10m": "si10",
+    "shortwave_radiation": "dswrf",
+    "direct_radiation": "dlwrf",
+    "visibility": "vis",
+}
+
+# keep the urls of multi-location requests well within the API limits
+MAX_LOCATIONS_PER_REQUEST = 100
+
+# the spacing, in degrees, of the regular latitude/longitude grid that sites are snapped to
+# when `get_nwp_batch` is asked to, roughly the resolution of the finest model behind each
+# source. The models are not all on such a grid (HRRR is on a Lambert grid), so snapped sites
+# can get slightly different weather than their own location would
+NWP_GRID_SPACING = {
+    # ICON-D2, 2 km
+    "icon": 0.02,
+    # HRRR over the US is 3 km. Elsewhere GFS is 0.11 or 0.25 degrees
+    "gfs": 0.03,
+    # UKMO UK 2 km
+    "ukmo": 0.02,
+    # ERA5-Land, 0.1 degrees
+    "archive": 0.1,
+}
+
 
 def get_nwp(site: PVSite, ts: datetime, nwp_source: str = "icon") -> xr.Dataset:
     """
@@ -24,100 +68,423 @@ def get_nwp(site: PVSite, ts: datetime, nwp_source: str = "icon") -> xr.Dataset:
     :param nwp_source: the nwp data source. Either "gfs", "icon" or "ukmo". Defaults to "icon"
     :return: nwp forecast in xarray
     """
-    now = datetime.now()
+    return get_nwp_batch([site], ts, nwp_source)[0]
 
-    # Setup the Open-Meteo API client with cache and retry on error
-    cache_session = requests_cache.CachedSession('.cache', expire_after = -1)
-    retry_session = retry(cache_session, retries = 5, backoff_factor = 0.2)
-    openmeteo = openmeteo_requests.Client(session = retry_session)
-
-    # Define the variables we want. Visibility is handled separately after the main request
-    variables = [
-        "temperature_2m",
-        "precipitation",
-        "cloud_cover_low",
-        "cloud_cover_mid",
-        "cloud_cover_high",
-        "wind_speed_10m",
-        "shortwave_radiation",
-        "direct_radiation"
-    ]
+
+def get_nwp_batch(
+    sites: List[PVSite],
+    ts: datetime,
+    nwp_source: str = "icon",
+    chunk_size: int = MAX_LOCATIONS_PER_REQUEST,
+    snap_to_grid: bool = False,
+) -> List[xr.Dataset]:
+    """
+    Get NWP data for many sites, with one request per chunk of sites
+
+    The weather is fetched once per distinct location, so each site gets the same data as from
+    `get_nwp`.
+
+    :param sites: the PV sites
+    :param ts: the timestamp for when you want the forecast for
+    :param nwp_source: the nwp data source. Either "gfs", "icon" or "ukmo". Defaults to "icon"
+    :param chunk_size: the maximum number of locations in one request
+    :param snap_to_grid: if True, the weather is fetched once per cell of a regular grid with
+        the spacing in NWP_GRID_SPACING, at the centre of the cell, and shared by all the sites
+        in that cell. This makes fewer requests for dense fleets, but the weather can differ
+        from the one at each site's own location
+    :return: list of nwp forecasts in xarray, one per site, as made by `format_nwp_data`
+    """
+    start, end, historical = _nwp_days(ts)
+
+    locations = [(site.latitude, site.longitude) for site in sites]
+    spacing = None
+    if snap_to_grid:
+        spacing = NWP_GRID_SPACING.get("archive" if historical else nwp_source)
+    cells, site_cells = get_grid_cells(locations, spacing)
+
+    if len(sites) > 0:
+        log.info(
+            f"Getting nwp data for {len(sites)} sites in {len(cells)} grid cells, "
+            f"dedup ratio {len(sites) / len(cells):.1f}"
+        )
+
+    times, values = get_nwp_values(
+        cells, start, end, nwp_source, historical=historical, chunk_size=chunk_size
+    )
+
+    # convert data into xarray, each site gets the data of its grid cell.
+    # Sites at the same location share the same dataset
+    nwp_by_location = {}
+    for site, cell in zip(sites, site_cells):
+        location = (site.latitude, site.longitude)
+        if location not in nwp_by_location:
+            df = pd.DataFrame(values[cell], index=times, columns=list(NWP_VARIABLES.values()))
+            nwp_by_location[location] = format_nwp_data(df, nwp_source, site)
+
+    return [nwp_by_location[location] for location in locations]
+
+
+async def get_nwp_async(
+    site: PVSite, ts: datetime, nwp_source: str = "icon", session=None
+) -> xr.Dataset:
+    """
+    Get NWP data for a site, without blocking the event loop
+
+    This is the same as `get_nwp`, but the requests are made on an aiohttp session.
+
+    :param site: the PV site
+    :param ts: the timestamp for when you want the forecast for
+    :param nwp_source: the nwp data source. Either "gfs", "icon" or "ukmo". Defaults to "icon"
+    :param session: the aiohttp session, defaults to the shared session of the event loop
+    :return: nwp forecast in xarray
+    """
+    start, end, historical = _nwp_days(ts)
+
+    times, values = await get_nwp_values_async(
+        [(site.latitude, site.longitude)], start, end, nwp_source, historical, session=session
+    )
+    df = pd.DataFrame(values[0], index=times, columns=list(NWP_VARIABLES.values()))
+
+    return format_nwp_data(df, nwp_source, site)
+
+
+def _nwp_days(ts: datetime) -> Tuple[date, date, bool]:
+    """
+    Get the days of nwp data needed for a forecast, and whether they are historical
+
+    :return: the first day, the last day (included) and if the data is more than 3 months old
+    """
+    now = datetime.now()
 
     start = ts.date()
     end = start + pd.Timedelta(days=7)
 
-    url = ""
-
     # check whether the time stamp is more than 3 months in the past
-    if (now - ts).days > 90:
+    historical = (now - ts).days > 90
+    if historical:
         print("Warning: The requested timestamp is more than 3 months in the past. The weather data are provided by a reanalyse model and not ICON or GFS.")
 
+    return start, end, historical
+
+
+def get_grid_cells(
+    locations: List[Tuple[float, float]], spacing: Optional[float] = None
+) -> Tuple[List[Tuple[float, float]], np.ndarray]:
+    """
+    Map locations to the grid cells of an nwp model
+
+    The cells are approximated by a regular latitude/longitude grid with the given spacing,
+    which is enough to group sites that get the same weather.
+
+    :param locations: list of (latitude, longitude)
+    :param spacing: the grid spacing in degrees. If None, each distinct location is its own cell
+    :return: the (latitude, longitude) of the centre of each distinct cell, and the index of the
+        cell of each location
+    """
+    if len(locations) == 0:
+        return [], np.zeros(0, dtype=int)
+
+    coords = np.array(locations, dtype=float)
+    if spacing is not None:
+        # rounding again removes the floating point noise, so the cells make clean urls
+        coords = np.round(np.round(coords / spacing) * spacing, 6)
+
+    cells, site_cells = np.unique(coords, axis=0, return_inverse=True)
+    return [tuple(cell) for cell in cells.tolist()], site_cells.reshape(-1)
+
+
+def get_nwp_df(
+    site: PVSite, start, end, nwp_source: str = "icon", historical: bool = False
+) -> pd.DataFrame:
+    """
+    Get hourly NWP data for a site, for all the days from start to end
+
+    :param site: the PV site
+    :param start: the first day of data
+    :param end: the last day of data, included
+    :param nwp_source: the nwp data source. Either "gfs", "icon" or "ukmo". Defaults to "icon"
+    :param historical: if True, use the reanalysis data from the Historical Weather API rather
+        than the nwp_source, for data more than 3 months in the past
+    :return: dataframe of the nwp variables, indexed by time
+    """
+    times, values = get_nwp_values(
+        [(site.latitude, site.longitude)], start, end, nwp_source, historical=historical
+    )
+    return pd.DataFrame(values[0], index=times, columns=list(NWP_VARIABLES.values()))
+
+
+def get_nwp_values(
+    locations: List[Tuple[float, float]],
+    start,
+    end,
+    nwp_source: str = "icon",
+    historical: bool = False,
+    chunk_size: int = MAX_LOCATIONS_PER_REQUEST,
+) -> Tuple[pd.DatetimeIndex, np.ndarray]:
+    """
+    Get hourly NWP data for many locations, for all the days from start to end
+
+    Open-Meteo takes lists of latitudes and longitudes, and returns one response per location,
+    so the locations are fetched in chunks of up to `chunk_size` per request.
+
+    If a local nwp store is set up, see `quartz_solar_forecast.nwp_store`, the locations are read
+    from the store first, for the run the data comes from, see `_store_run`, and only the missing
+    ones are fetched and added to it.
+
+    :param locations: list of (latitude, longitude)
+    :param start: the first day of data
+    :param end: the last day of data, included
+    :param nwp_source: the nwp data source. Either "gfs", "icon" or "ukmo". Defaults to "icon"
+    :param historical: if True, use the reanalysis data from the Historical Weather API rather
+        than the nwp_source, for data more than 3 months in the past
+    :param chunk_size: the maximum number of locations in one request
+    :return: the times, and an array of shape (locations, times, variables), with the variables
+        in the order of NWP_VARIABLES
+    """
+
+    times, values, missing = _read_nwp_store(locations, start, end, nwp_source, historical)
+
+    # The shared Open-Meteo API client, with cache and retry on error
+    openmeteo = get_openmeteo_client()
+
+    for url, params, chunk in _nwp_requests(
+        locations, missing, start, end, nwp_source, historical, chunk_size
+    ):
+        # Make API call to URL, there is one response per location
+        with timed(_nwp_stage(params)):
+            responses = openmeteo.weather_api(url, params=params)
+        _set_nwp_values(values, times, chunk, params, responses)
+
+    _write_nwp_store(locations, missing, times, values, nwp_source, historical)
+
+    return times, values
+
+
+async def get_nwp_values_async(
+    locations: List[Tuple[float, float]],
+    start,
+    end,
+    nwp_source: str = "icon",
+    historical: bool = False,
+    chunk_size: int = MAX_LOCATIONS_PER_REQUEST,
+    session=None,
+) -> Tuple[pd.DatetimeIndex, np.ndarray]:
+    """
+    Get hourly NWP data for many locations, without blocking the event loop
+
+    This is the same as `get_nwp_values`, but the requests are made at the same time on an
+    aiohttp session.
+
+    :param session: the aiohttp session, defaults to the shared session of the event loop
+    :return: the times, and an array of shape (locations, times, variables)
+    """
+    if session is None:
+        session = await get_async_session()
+
+    times, values, missing = _read_nwp_store(locations, start, end, nwp_source, historical)
+
+    async def weather_api(url, params):
+        with timed(_nwp_stage(params)):
+            return await weather_api_async(session, url, params)
+
+    requests = _nwp_requests(locations, missing, start, end, nwp_source, historical, chunk_size)
+    responses = await asyncio.gather(*[weather_api(url, params) for url, params, _ in requests])
+    for (_, params, chunk), chunk_responses in zip(requests, responses):
+        _set_nwp_values(values, times, chunk, params, chunk_responses)
+
+    _write_nwp_store(locations, missing, times, values, nwp_source, historical)
+
+    return times, values
+
+
+def _nwp_stage(params: dict) -> str:
+    # the name of the stage in the metrics, the visibility has its own request
+    return "visibility_http" if params["hourly"] == "visibility" else "nwp_http"
+
+
+def _nwp_url(nwp_source: str, historical: bool) -> str:
+    if historical:
         # load data from open-meteo Historical Weather API
-        url = "https://archive-api.open-meteo.com/v1/archive"
+        return f"{open_meteo_url(archive=True)}/v1/archive"
+
+    # Getting NWP from open meteo weather forecast API by ICON, GFS, or UKMO within the last 3 months
+    url_nwp_source = {
+        "icon": "dwd-icon",
+        "gfs": "gfs",
+        "ukmo": "ukmo_seamless"
+    }.get(nwp_source)
+    if not url_nwp_source:
+        raise Exception(f'Source ({nwp_source}) must be either "icon", "gfs", or "ukmo"')
+    return f"{open_meteo_url()}/v1/{url_nwp_source if nwp_source != 'ukmo' else 'forecast'}"
+
+
+def _nwp_requests(
+    locations: List[Tuple[float, float]],
+    missing: List[int],
+    start,
+    end,
+    nwp_source: str,
+    historical: bool,
+    chunk_size: int,
+) -> List[Tuple[str, dict, List[int]]]:
+    """
+    Make the Open-Meteo requests for the missing locations
 
-    else:
-        # Getting NWP from open meteo weather forecast API by ICON, GFS, or UKMO within the last 3 months
-        url_nwp_source = {
-            "icon": "dwd-icon",
-            "gfs": "gfs",
-            "ukmo": "ukmo_seamless"
-        }.get(nwp_source)
-        if not url_nwp_source:
-            raise Exception(f'Source ({nwp_source}) must be either "icon", "gfs", or "ukmo"')
-        url = f"https://api.open-meteo.com/v1/{url_nwp_source if nwp_source != 'ukmo' else 'forecast'}"
-
-    params = {
-        "latitude": site.latitude,
-        "longitude": site.longitude,
-        "start_date": f"{start}",
-        "end_date": f"{end}",
-        "hourly": variables
-    }
-
-    # Add the "models" parameter if using "ukmo"
-    if nwp_source == "ukmo":
-        params["models"] = "ukmo_seamless"
-
-    # Make API call to URL
-    response = openmeteo.weather_api(url, params=params)
-    hourly = response[0].Hourly()
-
-    hourly_data = {"time": pd.date_range(
-    	start = pd.to_datetime(hourly.Time(), unit = "s", utc = False),
-    	end = pd.to_datetime(hourly.TimeEnd(), unit = "s", utc = False),
-    	freq = pd.Timedelta(seconds = hourly.Interval()),
-    	inclusive = "left"
-    )}
+    :return: list of (url, params, indexes of the locations in the request)
+    """
+    url = _nwp_url(nwp_source, historical)
 
+    # Define the variables we want. Visibility is handled separately after the main request,
+    # unless it comes from the same model
+    variables = [variable for variable in NWP_VARIABLES if variable != "visibility"]
+    if nwp_source == "gfs" and not historical:
+        variables.append("visibility")
 
-    # variables index as in the variables array of the request
-    for idx, var in enumerate(["t", "prate", "lcc", "mcc", "hcc", "si10", "dswrf", "dlwrf"]):
-        hourly_data[var] = hourly.Variables(idx).ValuesAsNumpy()
+    requests = []
+    for i in range(0, len(missing), chunk_size):
+        chunk = missing[i:i + chunk_size]
 
-    # handle visibility
-    if (now - ts).days <= 90:
-        # load data from open-meteo gfs model
         params = {
-        	"latitude": site.latitude,
-        	"longitude": site.longitude,
-        	"start_date": f"{start}",
-        	"end_date": f"{end}",
-        	"hourly": "visibility"
+            "latitude": ",".join(str(locations[k][0]) for k in chunk),
+            "longitude": ",".join(str(locations[k][1]) for k in chunk),
+            "start_date": f"{start}",
+            "end_date": f"{end}",
+            "hourly": variables
         }
-        data_vis_gfs = openmeteo.weather_api("https://api.open-meteo.com/v1/gfs", params=params)[0].Hourly().Variables(0).ValuesAsNumpy()
-        hourly_data["vis"] = data_vis_gfs
-    else:
+
+        # Add the "models" parameter if using "ukmo"
+        if nwp_source == "ukmo":
+            params["models"] = "ukmo_seamless"
+
+        requests.append((url, params, chunk))
+
+        # handle visibility, load data from open-meteo gfs model
+        if nwp_source != "gfs" and not historical:
+            params = {
+                "latitude": params["latitude"],
+                "longitude": params["longitude"],
+                "start_date": f"{start}",
+                "end_date": f"{end}",
+                "hourly": "visibility"
+            }
+            requests.append((f"{open_meteo_url()}/v1/gfs", params, chunk))
+
+    return requests
+
+
+def _set_nwp_values(
+    values: np.ndarray, times: pd.DatetimeIndex, chunk: List[int], params: dict, responses
+) -> None:
+    """
+    Copy the values of each response, one per location in the chunk, into the values array
+
+    The values are put at the times of the response, from its Time(), TimeEnd() and
+    Interval(), so a response which does not cover all the times leaves the others as nans.
+    """
+    if len(responses) != len(chunk):
+        raise ValueError(
+            f"Open-Meteo returned {len(responses)} responses for {len(chunk)} locations"
+        )
+
+    variables = params["hourly"]
+    if isinstance(variables, str):
+        variables = [variables]
+
+    # variables index as in the variables array of the request
+    for k, response in zip(chunk, responses):
+        hourly = response.Hourly()
+        response_times = pd.date_range(
+            start=pd.to_datetime(hourly.Time(), unit="s"),
+            end=pd.to_datetime(hourly.TimeEnd(), unit="s"),
+            freq=pd.Timedelta(seconds=hourly.Interval()),
+            inclusive="left",
+        )
+        positions = times.get_indexer(response_times)
+        found = positions >= 0
+        for idx, variable in enumerate(variables):
+            response_values = hourly.Variables(idx).ValuesAsNumpy()
+            values[k, positions[found], _variable_index(variable)] = response_values[found]
+
+
+def _read_nwp_store(
+    locations: List[Tuple[float, float]], start, end, nwp_source: str, historical: bool
+) -> Tuple[pd.DatetimeIndex, np.ndarray, List[int]]:
+    """
+    Make the array of nwp values, and fill it from the local nwp store if there is one
+
+    :return: the times, the values, and the indexes of the locations which still need fetching
+    """
+    # the hourly times from the start of the first day to the end of the last day
+    times = pd.date_range(
+        pd.Timestamp(start), pd.Timestamp(end) + pd.Timedelta(days=1), freq="h", inclusive="left"
+    )
+    values = np.full((len(locations), len(times), len(NWP_VARIABLES)), np.nan)
+
+    # read what we can from the local nwp store, for the run the data comes from
+    store = get_nwp_store()
+    missing = list(range(len(locations)))
+    if store is not None:
+        store_source = "archive" if historical else nwp_source
+        run = _store_run(store_source, times)
+        missing = []
+        for i, location in enumerate(locations):
+            stored = store.read(store_source, run, location, times[0], times[-1])
+            if stored is None:
+                missing.append(i)
+            else:
+                values[i] = stored
+        log.debug(f"Read {len(locations) - len(missing)} locations from the nwp store")
+        inc("cache_hits_total", len(locations) - len(missing), cache="nwp_store")
+        inc("cache_misses_total", len(missing), cache="nwp_store")
+
+    if historical:
         # set to maximum visibility possible
-        hourly_data["vis"] = 24000.0
+        values[missing, :, _variable_index("visibility")] = 24000.0
+
+    return times, values, missing
+
 
-    df = pd.DataFrame(data=hourly_data).set_index("time").astype('float64')
+def _write_nwp_store(
+    locations: List[Tuple[float, float]],
+    fetched: List[int],
+    times: pd.DatetimeIndex,
+    values: np.ndarray,
+    nwp_source: str,
+    historical: bool,
+) -> None:
+    """
+    Add the fetched locations to the local nwp store, if there is one
+    """
+    store = get_nwp_store()
+    if store is None:
+        return
 
+    store_source = "archive" if historical else nwp_source
+    run = _store_run(store_source, times)
+    for k in fetched:
+        store.write(store_source, run, locations[k], times, values[k])
 
-    # convert data into xarray
-    data_xr = format_nwp_data(df, nwp_source, site)
 
-    return data_xr
+def _store_run(store_source: str, times: pd.DatetimeIndex) -> datetime:
+    """
+    Get the init time of the run nwp data comes from, which it is kept under in the nwp store
+
+    Open-Meteo serves the latest published run, but the data of past hours comes from the runs
+    before them and does not change. So data which ends in the past is kept under the run that
+    was published when it ends, and is not fetched again after each new run. For the archive,
+    which is updated daily, this is the last day of the data.
 
+    :param store_source: the nwp source, or "archive"
+    :param times: the hourly times of the data, in UTC
+    """
+    end = times[-1].tz_localize("UTC").to_pydatetime() + NWP_RUN_SCHEDULE[store_source].delay
+    return latest_run(store_source, min(end, datetime.now(timezone.utc)))
+
+
+def _variable_index(variable: str) -> int:
+    return list(NWP_VARIABLES).index(variable)
+
+@timed("xarray")
 def format_nwp_data(df: pd.DataFrame, nwp_source:str, site: PVSite):
     data_xr = xr.DataArray(
         data=df.values,
@@ -134,6 +501,7 @@ def format_nwp_data(df: pd.DataFrame, nwp_source:str, site: PVSite):
     return data_xr
 
 
+@timed("xarray")
 def process_pv_data(live_generation_kw: Optional[pd.DataFrame], ts: pd.Timestamp, site: 'PVSite') -> xr.Dataset:
     """
     Process PV data and create an xarray Dataset.
@@ -170,6 +538,33 @@ def process_pv_data(live_generation_kw: Optional[pd.DataFrame], ts: pd.Timestamp
 
     return da
 
+def get_live_generation(site: PVSite, ts: pd.Timestamp) -> Optional[pd.DataFrame]:
+    """
+    Get the live generation data of a site from its inverter
+
+    :param site: the PV site
+    :param ts: the timestamp of the site
+    :return: dataframe with timestamp and power_kw columns, or None
+    """
+    with timed("inverter_fetch"):
+        return site.get_inverter().get_data(ts)
+
+
+async def get_live_generation_async(
+    site: PVSite, ts: pd.Timestamp, session=None
+) -> Optional[pd.DataFrame]:
+    """
+    Get the live generation data of a site from its inverter, without blocking the event loop
+
+    :param site: the PV site
+    :param ts: the timestamp of the site
+    :param session: the aiohttp session, for the inverters which use one
+    :return: dataframe with timestamp and power_kw columns, or None
+    """
+    with timed("inverter_fetch"):
+        return await site.get_inverter().get_data_async(ts, session=session)
+
+
 def make_pv_data(site: PVSite, ts: pd.Timestamp) -> xr.Dataset:
     """
     Make PV data by combining live data from various inverters.
@@ -178,8 +573,124 @@ def make_pv_data(site: PVSite, ts: pd.Timestamp) -> xr.Dataset:
     :param ts: the timestamp of the site
     :return: The combined PV dataset in xarray form
     """
-    live_generation_kw = site.get_inverter().get_data(ts)
+    live_generation_kw = get_live_generation(site, ts)
     # Process the PV data
     da = process_pv_data(live_generation_kw, ts, site)
 
     return da
+
+
+async def make_pv_data_async(site: PVSite, ts: pd.Timestamp, session=None) -> xr.Dataset:
+    """
+    Make PV data by combining live data from various inverters, without blocking the event loop
+
+    :param site: the PV site
+    :param ts: the timestamp of the site
+    :param session: the aiohttp session, for the inverters which use one
+    :return: The combined PV dataset in xarray form
+    """
+    live_generation_kw = await get_live_generation_async(site, ts, session=session)
+    # Process the PV data
+    da = process_pv_data(live_generation_kw, ts, site)
+
+    return da
+
+
+@timed("xarray")
+def process_pv_data_batch(
+    live_generation_kw: List[Optional[pd.DataFrame]],
+    ts: pd.Timestamp,
+    sites: List[PVSite],
+    pv_ids: List[str],
+) -> xr.Dataset:
+    """
+    Process PV data for many sites into one xarray Dataset, with one entry per pv_id.
+
+    :param live_generation_kw: live generation data for each site, or None
+    :param ts: Current timestamp
+    :param sites: the PV sites
+    :param pv_ids: the pv_id to use for each site
+    :return: xarray Dataset containing processed PV data for all the sites
+    """
+    recent_pv_data = {}
+    for i, live in enumerate(live_generation_kw):
+        if live is not None and not live.empty:
+            live = live[live["timestamp"] <= ts]
+            recent_pv_data[i] = live.drop_duplicates(subset="timestamp", keep="last").set_index(
+                "timestamp"
+            )["power_kw"]
+
+    if len(recent_pv_data) > 0:
+        timestamp = pd.DatetimeIndex(
+            sorted(set().union(*[data.index for data in recent_pv_data.values()]))
+        )
+    else:
+        timestamp = pd.DatetimeIndex([ts])
+
+    # sites without live data are left as nans
+    power_kw = np.full((len(sites), len(timestamp)), np.nan)
+    for i, data in recent_pv_data.items():
+        power_kw[i] = data.reindex(timestamp).values
+
+    da = xr.DataArray(
+        data=power_kw,
+        dims=["pv_id", "timestamp"],
+        coords=dict(
+            longitude=(["pv_id"], [site.longitude for site in sites]),
+            latitude=(["pv_id"], [site.latitude for site in sites]),
+            timestamp=timestamp,
+            pv_id=list(pv_ids),
+            kwp=(["pv_id"], [site.capacity_kwp for site in sites]),
+            tilt=(["pv_id"], [site.tilt for site in sites]),
+            orientation=(["pv_id"], [site.orientation for site in sites]),
+        ),
+    )
+    da = da.to_dataset(name="generation_kw")
+
+    return da
+
+
+def submit_live_generation(
+    sites: List[PVSite], ts: pd.Timestamp, executor: Executor
+) -> List[Optional[Future]]:
+    """
+    Start getting the live generation of the sites with an inverter, concurrently
+
+    :param sites: the PV sites
+    :param ts: the timestamp of the sites
+    :param executor: the pool to fetch the data in
+    :return: the future of the live generation of each site, None for sites without an inverter
+    """
+    return [
+        executor.submit(get_live_generation, site, ts) if site.inverter_type else None
+        for site in sites
+    ]
+
+
+def make_pv_data_batch(
+    sites: List[PVSite],
+    ts: pd.Timestamp,
+    pv_ids: List[str],
+    live_generation_futures: Optional[List[Optional[Future]]] = None,
+) -> xr.Dataset:
+    """
+    Make PV data for many sites. Live data is only fetched for sites with an inverter.
+
+    :param sites: the PV sites
+    :param ts: the timestamp of the sites
+    :param pv_ids: the pv_id to use for each site
+    :param live_generation_futures: the live generation of the sites, from
+        `submit_live_generation`. If None, it is fetched here, one site after the other.
+    :return: The combined PV dataset in xarray form, with one entry per pv_id
+    """
+    if live_generation_futures is None:
+        live_generation_kw = [
+            get_live_generation(site, ts) if site.inverter_type else None for site in sites
+        ]
+    else:
+        live_generation_kw = [
+            future.result() if future is not None else None for future in live_generation_futures
+        ]
+    da = process_pv_data_batch(live_generation_kw, ts, sites, pv_ids)
+
+    return da
@@ -3,12 +3,12 @@ import pandas as pd
 import xarray as xr
 from psp.data_sources.nwp import NwpDataSource
 from psp.data_sources.pv import NetcdfPvDataSource
-from psp.serialization import load_model
 from psp.typings import X
 
 from quartz_solar_forecast.data import get_nwp, make_pv_data
 from quartz_solar_forecast.pydantic_models import PVSite
 from quartz_solar_forecast.forecasts.v1 import forecast_v1
+from quartz_solar_forecast.forecasts.registry import get_model
 from quartz_solar_forecast.data import format_nwp_data
 
 from datetime import datetime
@@ -34,7 +34,7 @@ def run_forecast(pv_df: pd.DataFrame, nwp_df: pd.DataFrame, nwp_source="ICON") -
     """
 
     # load model only once
-    model = load_model(f"{dir_path}/../models/model-0.3.0.pkl")
+    model = get_model("0.3.0")
 
     all_predictions = []
     for i in range(len(pv_df)):
@@ -1,17 +1,168 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from datetime import datetime, timedelta
 import logging
+import os
+import time
+from typing import (
+    AsyncIterable,
+    AsyncIterator,
+    Callable,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
 
+import numpy as np
 import pandas as pd
+import xarray as xr
 
-from quartz_solar_forecast.data import get_nwp, make_pv_data
-from quartz_solar_forecast.forecasts import forecast_v1_tilt_orientation, TryolabsSolarPowerPredictor
+from quartz_solar_forecast.data import (
+    NWP_VARIABLES,
+    format_nwp_data,
+    get_nwp,
+    get_nwp_async,
+    get_live_generation,
+    get_live_generation_async,
+    get_nwp_batch,
+    make_pv_data,
+    make_pv_data_async,
+    make_pv_data_batch,
+    submit_live_generation,
+    process_pv_data,
+    process_pv_data_batch,
+)
+from quartz_solar_forecast.forecast_cache import (
+    ForecastCache,
+    forecast_bucket,
+    forecast_expiry,
+    get_forecast_cache,
+)
+from quartz_solar_forecast.forecasts import forecast_v1_tilt_orientation, get_predictor
+from quartz_solar_forecast.forecasts.v1_tilt_orientation import forecast_v1_tilt_orientation_batch
+from quartz_solar_forecast.metrics import timed
 from quartz_solar_forecast.pydantic_models import PVSite
 from quartz_solar_forecast.utils.sentry_logging import write_sentry
+from quartz_solar_forecast.weather.client import get_async_session
 
 log = logging.getLogger(__name__)
 
+# how long to wait for the nwp and the live pv data. Without live pv data the forecast still
+# runs, so it has a shorter timeout
+NWP_TIMEOUT_S = float(os.getenv("QUARTZ_SOLAR_FORECAST_NWP_TIMEOUT", 60))
+PV_TIMEOUT_S = float(os.getenv("QUARTZ_SOLAR_FORECAST_PV_TIMEOUT", 20))
+
+# the nwp and live pv data are fetched at the same time, in this pool. A fetch which times out
+# is cancelled if it has not started yet. One which has started cannot be stopped, and keeps its
+# thread until its request returns; as the pool is bounded, the fetches after it wait in the
+# queue instead of starting more threads, and are cancelled if they time out there
+_io_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("QUARTZ_SOLAR_FORECAST_IO_WORKERS", 32)),
+    thread_name_prefix="quartz-io",
+)
+
+
+def fetch_nwp_and_pv(
+    get_nwp_data: Callable[[], xr.Dataset],
+    get_pv_data: Callable[[], xr.Dataset],
+    get_no_pv_data: Callable[[], xr.Dataset],
+) -> Tuple[xr.Dataset, xr.Dataset]:
+    """
+    Fetch the nwp and the live pv data concurrently, so the wait is the longest of the two
+
+    :param get_nwp_data: function which gets the nwp data
+    :param get_pv_data: function which gets the live pv data
+    :param get_no_pv_data: function which makes the pv data without any live data, used if
+        the live data takes longer than PV_TIMEOUT_S
+    :return: the nwp data and the pv data
+    """
+    start = time.monotonic()
+    nwp_future = _io_executor.submit(get_nwp_data)
+    pv_future = _io_executor.submit(get_pv_data)
+
+    try:
+        nwp_xr = nwp_future.result(timeout=NWP_TIMEOUT_S)
+    except FutureTimeoutError:
+        nwp_future.cancel()
+        pv_future.cancel()
+        raise TimeoutError(f"Getting the nwp data took more than {NWP_TIMEOUT_S} seconds")
+
+    try:
+        pv_xr = pv_future.result(timeout=max(0.0, PV_TIMEOUT_S - (time.monotonic() - start)))
+    except FutureTimeoutError:
+        pv_future.cancel()
+        log.warning(
+            f"Getting the live pv data took more than {PV_TIMEOUT_S} seconds, "
+            "running the forecast without it"
+        )
+        pv_xr = get_no_pv_data()
+
+    return nwp_xr, pv_xr
+
+
+def no_live_pv_site(site: PVSite) -> PVSite:
+    """
+    Get the site the forecast without live PV data is made for
+
+    This is the site's location and capacity, with the default tilt and orientation and no
+    inverter, as the /forecast/ API has always used.
+
+    :param site: the PV site
+    :return: the site without live PV data
+    """
+    return PVSite(latitude=site.latitude, longitude=site.longitude, capacity_kwp=site.capacity_kwp)
+
+
+def make_live_and_no_live_pv_data(
+    live_generation_kw: pd.DataFrame | None, ts: pd.Timestamp, site: PVSite
+) -> xr.Dataset:
+    """
+    Make PV data for a site as pv_id "1" with the live data, and for `no_live_pv_site` as
+    pv_id "2" without it
+
+    :param live_generation_kw: the live generation data of the site, or None
+    :param ts: the timestamp of the site
+    :param site: the PV site
+    :return: PV data with both pv_ids in it
+    """
+    return process_pv_data_batch(
+        [live_generation_kw, None], ts, [site, no_live_pv_site(site)], ["1", "2"]
+    )
+
+
+def forecast_live_and_no_live(
+    nwp_source: str, nwp_xr: xr.Dataset, pv_xr: xr.Dataset, ts: pd.Timestamp, model=None
+) -> pd.DataFrame:
+    """
+    Run the gb model with and without live PV data, from the same nwp data and in one call
+
+    :param nwp_source: the nwp data source
+    :param nwp_xr: the nwp data of the site
+    :param pv_xr: the PV data from `make_live_and_no_live_pv_data`
+    :param ts: the timestamp of the site
+    :param model: the model to use, defaults to the shared 0.4.0 model
+    :return: dataframe with columns power_kw and power_kw_no_live_pv, indexed by time
+    """
+    pred_df = forecast_v1_tilt_orientation_batch(
+        nwp_source, {"1": nwp_xr, "2": nwp_xr}, pv_xr, ts, model=model
+    )
+    pred_df = pred_df.pivot(index="time", columns="pv_id", values="power_kw")
+
+    return pd.DataFrame(
+        {"power_kw": pred_df["1"].values, "power_kw_no_live_pv": pred_df["2"].values},
+        index=pd.DatetimeIndex(pred_df.index.values),
+    )
+
+
 def predict_ocf(
-    site: PVSite, model=None, ts: datetime | str = None, nwp_source: str = "icon"
+    site: PVSite,
+    model=None,
+    ts: datetime | str = None,
+    nwp_source: str = "icon",
+    with_no_live_pv: bool = False,
 ):
     """
     Run the forecast with the gb model, which can take tilt and orientation as inputs
@@ -20,6 +171,9 @@ def predict_ocf(
     :param model: the model to use for prediction
     :param ts: the timestamp of the site. If None, defaults to the current timestamp rounded down to 15 minutes.
     :param nwp_source: the nwp data source. Either "gfs", "icon" or "ukmo". Defaults to "icon" 
+    :param with_no_live_pv: if True, the forecast of `no_live_pv_site` without live PV data is
+                            also made, from the same nwp data and in the same model call, and
+                            returned in the power_kw_no_live_pv column
     :return: The PV forecast of the site for time (ts) for 48 hours
     """
     if ts is None:
@@ -38,16 +192,32 @@ def predict_ocf(
     else:
         capacity_kwp_original = site.capacity_kwp
 
-    # make pv and nwp data from nwp_source
-    nwp_xr = get_nwp(site=site, ts=ts, nwp_source=nwp_source)
-    pv_xr = make_pv_data(site=site, ts=ts)
+    if with_no_live_pv:
+        # make pv and nwp data from nwp_source, at the same time
+        nwp_xr, pv_xr = fetch_nwp_and_pv(
+            lambda: get_nwp(site=site, ts=ts, nwp_source=nwp_source),
+            lambda: make_live_and_no_live_pv_data(get_live_generation(site, ts), ts, site),
+            lambda: make_live_and_no_live_pv_data(None, ts, site),
+        )
 
-    # load and run models
-    pred_df = forecast_v1_tilt_orientation(nwp_source, nwp_xr, pv_xr, ts, model=model)
+        # load and run models, with and without the live pv data
+        pred_df = forecast_live_and_no_live(nwp_source, nwp_xr, pv_xr, ts, model=model)
+
+    else:
+        # make pv and nwp data from nwp_source, at the same time
+        nwp_xr, pv_xr = fetch_nwp_and_pv(
+            lambda: get_nwp(site=site, ts=ts, nwp_source=nwp_source),
+            lambda: make_pv_data(site=site, ts=ts),
+            lambda: process_pv_data(None, ts, site),
+        )
+
+        # load and run models
+        pred_df = forecast_v1_tilt_orientation(nwp_source, nwp_xr, pv_xr, ts, model=model)
 
     # scale the results if the capacity is different
     if capacity_kwp_original != site.capacity_kwp:
-        pred_df["power_kw"] = pred_df["power_kw"] * capacity_kwp_original / site.capacity_kwp
+        with timed("postprocess"):
+            pred_df = pred_df * capacity_kwp_original / site.capacity_kwp
 
     return pred_df
 
@@ -62,56 +232,148 @@ def predict_tryolabs(
     :return: The PV forecast of the site for time (ts) for 48 hours
     """
 
-    # instantiate class to make predictions
-    solar_power_predictor = TryolabsSolarPowerPredictor()
-    
-    # set start and end time, if no time is given use current time
-    if ts is None:
-        start_date = pd.Timestamp.now().strftime("%Y-%m-%d")
-        start_time = pd.Timestamp.now().round(freq='h')
+    # set start time, if no time is given use current time
+    start_time = pd.Timestamp(ts if ts is not None else pd.Timestamp.now()).round(freq="h")
+
+    predictions = predict_tryolabs_range(site, start=start_time)
+    if predictions is not None:
+        log.info("Predictions finished.")
+    return predictions
+
+
+def predict_tryolabs_with_no_live_pv(
+    site: PVSite, ts: datetime | str = None, with_no_live_pv: bool = True
+) -> pd.DataFrame:
+    """
+    Run the forecast with the xgb model, and for `no_live_pv_site` if with_no_live_pv
+
+    The xgb model does not use live PV data, so the forecast without it is the same unless the
+    site's tilt or orientation is not the default.
+
+    :param site: the PV site
+    :param ts: the timestamp of the site, see `predict_tryolabs`
+    :param with_no_live_pv: if True, the forecast of `no_live_pv_site` is in the
+                            power_kw_no_live_pv column
+    :return: The PV forecast of the site for time (ts) for 48 hours
+    """
+    predictions = predict_tryolabs(site, ts)
+    if not with_no_live_pv or predictions is None:
+        return predictions
+
+    site_no_live = no_live_pv_site(site)
+    if (site.tilt, site.orientation) == (site_no_live.tilt, site_no_live.orientation):
+        predictions["power_kw_no_live_pv"] = predictions["power_kw"]
     else:
-        start_date = pd.Timestamp(ts).strftime("%Y-%m-%d")
-        start_time = pd.Timestamp(ts).round(freq='h')
+        predictions["power_kw_no_live_pv"] = predict_tryolabs(site_no_live, ts)["power_kw"]
+    return predictions
 
-    end_time = start_time + pd.Timedelta(hours=48)
-    start_date_datetime = datetime.strptime(start_date, "%Y-%m-%d")
+
+def predict_tryolabs_range(
+    site: PVSite,
+    start: datetime | str = None,
+    end: datetime | str = None,
+    init_times: Optional[Iterable[datetime | str]] = None,
+    horizon: pd.Timedelta = pd.Timedelta(hours=48),
+) -> Optional[pd.DataFrame]:
+    """
+    Run the xgb model over a time range, with one weather request and one call to the model
+
+    The model only uses the weather, so the forecasts of all the init times are taken from the
+    same predictions, made once for the whole range.
+
+    :param site: the PV site
+    :param start: the start of the range, rounded to the hour. Defaults to the first init time.
+    :param end: the end of the range, excluded. Defaults to `horizon` after start, or after the
+        last init time
+    :param init_times: the init times of the forecasts, each forecast being for `horizon` after
+        its init time, within the range
+    :param horizon: how long the forecasts are for
+    :return: The PV forecast indexed by date, or by init_time and date if init_times are given.
+        None if the range starts more than 3 months ago.
+    """
+    if init_times is not None:
+        init_times = pd.DatetimeIndex(init_times).round(freq="h")
+        if start is None:
+            start = init_times.min()
+        if end is None:
+            end = init_times.max() + horizon
+
+    if start is None:
+        raise ValueError("Either start or init_times must be given")
+
+    start_time = pd.Timestamp(start).round(freq="h")
+    end_time = start_time + horizon if end is None else pd.Timestamp(end).round(freq="h")
+    if end_time <= start_time:
+        raise ValueError(f"The end of the range ({end_time}) must be after its start ({start_time})")
 
     # Check if the start date is more than 3 months ago
     three_months_ago = datetime.today() - timedelta(days=3 * 30)
 
-    if start_date_datetime < three_months_ago:
-        print(
-            f"Start date ({start_date}) is more than 3 months ago, no",
-            "forecast data available.",
-        )
-    else:
-        # download the model from google drive and decompress if necessary
-        solar_power_predictor.load_model()
-        # make predictions
-        predictions = solar_power_predictor.predict_power_output(
-            latitude=site.latitude,
-            longitude=site.longitude,
-            start_date=start_date,
-            kwp=site.capacity_kwp,
-            orientation=site.orientation,
-            tilt=site.tilt,
+    if start_time.normalize() < three_months_ago:
+        log.warning(
+            f"Start date ({start_time.strftime('%Y-%m-%d')}) is more than 3 months ago, no "
+            "forecast data available."
         )
+        return None
 
-        # postprocessing of the dataframe
-        predictions = predictions[
-            (predictions["date"] >= start_time) & (predictions["date"] < end_time)
-        ]
-        predictions = predictions.reset_index(drop=True)
-        predictions.set_index("date", inplace=True)
-        print("Predictions finished.")
-        return predictions
+    # the predictor and its model are shared by all the forecasts
+    solar_power_predictor = get_predictor()
+    predictions = solar_power_predictor.predict_power_output(
+        latitude=site.latitude,
+        longitude=site.longitude,
+        start_date=start_time.strftime("%Y-%m-%d"),
+        kwp=site.capacity_kwp,
+        orientation=site.orientation,
+        tilt=site.tilt,
+        end_date=(end_time - pd.Timedelta(hours=1)).strftime("%Y-%m-%d"),
+    )
+
+    # postprocessing of the dataframe
+    with timed("postprocess"):
+        dates = predictions["date"].values
+        power_kw = predictions["power_kw"].values
+        in_range = (dates >= start_time.to_datetime64()) & (dates < end_time.to_datetime64())
 
+        if init_times is None:
+            predictions = pd.DataFrame(
+                {"power_kw": power_kw[in_range]}, index=pd.DatetimeIndex(dates[in_range], name="date")
+            )
+        else:
+            # the rows of each init time, without looping over them
+            init = init_times.values[:, np.newaxis]
+            in_window = (dates >= init) & (dates < init + horizon.to_timedelta64()) & in_range
+            init_index, date_index = np.nonzero(in_window)
+            predictions = pd.DataFrame(
+                {
+                    "init_time": init_times.values[init_index],
+                    "date": dates[date_index],
+                    "power_kw": power_kw[date_index],
+                }
+            ).set_index(["init_time", "date"])
 
+    return predictions
+
+
+def _site_cache(site: PVSite, cache: Optional[ForecastCache]) -> Optional[ForecastCache]:
+    """
+    Get the forecast cache for a site, or None if its forecasts are not cached
+
+    The forecasts of a site with an inverter use its live data, which changes well before the
+    cached forecast would expire, so they are not cached.
+    """
+    if site.inverter_type:
+        return None
+    return cache if cache is not None else get_forecast_cache()
+
+
+@timed("run_forecast")
 def run_forecast(
     site: PVSite,
     model: str = "gb",
     ts: datetime | str = None,
     nwp_source: str = "icon",
+    cache: Optional[ForecastCache] = None,
+    with_no_live_pv: bool = False,
 ) -> pd.DataFrame:
     """
     Predict solar power output for a given site using a specified model.
@@ -119,9 +381,16 @@ def run_forecast(
     :param site: the PV site
     :param model: the model to use for prediction, choose between "ocf" and "tryolabs",
                     by default "ocf" is used
-    :param ts: the timestamp of the site. If None, defaults to the current timestamp rounded down to 15 minutes.
+    :param ts: the timestamp of the site, rounded down to 15 minutes (or to the hour for the xgb
+               model, see `forecast_bucket`). If None, defaults to the current timestamp.
     :param nwp_source: the nwp data source. Either "gfs", "icon" or "ukmo". Defaults to "icon" 
                        (only relevant if model=="gb")
+    :param cache: the forecast cache, defaults to the one from `get_forecast_cache`. The cache
+                  does not change the forecast. Sites with an inverter are not cached
+    :param with_no_live_pv: if True, the forecast of `no_live_pv_site` without live PV data is
+                            also returned, in the power_kw_no_live_pv column. With the gb model
+                            both are made from one nwp fetch and one model call. The xgb model
+                            does not use live PV data
     :return: The PV forecast of the site for time (ts) for 48 hours
     """
 
@@ -130,11 +399,681 @@ def run_forecast(
     # 2. comment out this line
     write_sentry({"site": site.copy(), "model": model, "ts": ts, "nwp_source": nwp_source})
 
+    if model not in ["gb", "xgb"]:
+        raise ValueError(f"Unsupported model: {model}. Choose between 'xgb' and 'gb'")
+
+    # the model is run on the time of the cache key, so a cached forecast is the one it makes
+    ts = forecast_bucket(model, ts)
+
+    cache = _site_cache(site, cache)
+    if cache is not None:
+        key = cache.make_key(site, model, ts, nwp_source, with_no_live_pv)
+        predictions = cache.get(key)
+        if predictions is not None:
+            return predictions
+
+    if model == "gb":
+        predictions = predict_ocf(site, None, ts, nwp_source, with_no_live_pv=with_no_live_pv)
+    else:
+        predictions = predict_tryolabs_with_no_live_pv(site, ts, with_no_live_pv)
+
+    if cache is not None and predictions is not None:
+        cache.put(key, predictions, forecast_expiry(model, nwp_source))
+
+    return predictions
+
+
+
+_warm = False
+
+
+def warm_up(models: Iterable[str] = ("gb",), nwp_source: str = "icon") -> None:
+    """
+    Load the models and run them once, so the first forecast is as fast as the others
+
+    The gb model is run on made up weather data, so no requests are made. The xgb model is
+    only loaded, as it needs live weather data to run.
+
+    :param models: the models to warm up, "gb" and/or "xgb"
+    :param nwp_source: the nwp data source the gb model is run with
+    """
+    global _warm
+
+    start = time.perf_counter()
+    for model in models:
+        if model == "gb":
+            site = PVSite(latitude=51.75, longitude=-1.25, capacity_kwp=1)
+            ts = pd.Timestamp.now().floor("15min")
+            times = pd.date_range(ts.normalize(), periods=8 * 24, freq="h")
+            df = pd.DataFrame(
+                {variable: np.zeros(len(times)) for variable in NWP_VARIABLES.values()},
+                index=times,
+            )
+
+            nwp_xr = format_nwp_data(df, nwp_source, site)
+            pv_xr = process_pv_data(None, ts, site)
+            forecast_v1_tilt_orientation(nwp_source, nwp_xr, pv_xr, ts)
+
+        elif model == "xgb":
+            get_predictor()
+
+        else:
+            raise ValueError(f"Unsupported model: {model}. Choose between 'xgb' and 'gb'")
+
+    log.info(f"Warmed up models {list(models)} in {time.perf_counter() - start:.2f} seconds")
+    _warm = True
+
+
+def is_warm() -> bool:
+    """
+    Whether `warm_up` has finished in this process, or in the process it was forked from
+    """
+    return _warm
+
+async def predict_ocf_async(
+    site: PVSite,
+    model=None,
+    ts: datetime | str = None,
+    nwp_source: str = "icon",
+    session=None,
+    with_no_live_pv: bool = False,
+):
+    """
+    Run the forecast with the gb model, without blocking the event loop
+
+    The nwp and live pv data are fetched at the same time on an aiohttp session, and the model
+    is run in the default executor.
+
+    :param site: the PV site
+    :param model: the model to use for prediction
+    :param ts: the timestamp of the site. If None, defaults to the current timestamp rounded down to 15 minutes.
+    :param nwp_source: the nwp data source. Either "gfs", "icon" or "ukmo". Defaults to "icon"
+    :param session: the aiohttp session, defaults to the shared session of the event loop
+    :param with_no_live_pv: if True, the forecast without live PV data is also returned, see
+                            `predict_ocf`
+    :return: The PV forecast of the site for time (ts) for 48 hours
+    """
+    if ts is None:
+        ts = pd.Timestamp.now().round("15min")
+
+    if isinstance(ts, str):
+        ts = datetime.fromisoformat(ts)
+
+    if site.capacity_kwp > 4:
+        log.warning("Your site capacity is greater than 4kWp, "
+                    "however the model is trained on sites with capacity <= 4kWp."
+                    "We therefore will run the model with a capacity of 4 kWp, "
+                    "and we'll scale the results afterwards.")
+        capacity_kwp_original = site.capacity_kwp
+        site.capacity_kwp = 4
+    else:
+        capacity_kwp_original = site.capacity_kwp
+
+    if session is None:
+        session = await get_async_session()
+
+    async def get_nwp_data():
+        try:
+            return await asyncio.wait_for(
+                get_nwp_async(site=site, ts=ts, nwp_source=nwp_source, session=session),
+                NWP_TIMEOUT_S,
+            )
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"Getting the nwp data took more than {NWP_TIMEOUT_S} seconds")
+
+    async def get_live_data():
+        live_generation_kw = await get_live_generation_async(site, ts, session=session)
+        return make_live_and_no_live_pv_data(live_generation_kw, ts, site)
+
+    async def get_pv_data():
+        try:
+            if with_no_live_pv:
+                return await asyncio.wait_for(get_live_data(), PV_TIMEOUT_S)
+            return await asyncio.wait_for(
+                make_pv_data_async(site=site, ts=ts, session=session), PV_TIMEOUT_S
+            )
+        except asyncio.TimeoutError:
+            log.warning(
+                f"Getting the live pv data took more than {PV_TIMEOUT_S} seconds, "
+                "running the forecast without it"
+            )
+            if with_no_live_pv:
+                return make_live_and_no_live_pv_data(None, ts, site)
+            return process_pv_data(None, ts, site)
+
+    # make pv and nwp data from nwp_source, at the same time
+    nwp_xr, pv_xr = await asyncio.gather(get_nwp_data(), get_pv_data())
+
+    # load and run models, away from the event loop
+    loop = asyncio.get_running_loop()
+    predict = forecast_live_and_no_live if with_no_live_pv else forecast_v1_tilt_orientation
+    pred_df = await loop.run_in_executor(None, predict, nwp_source, nwp_xr, pv_xr, ts, model)
+
+    # scale the results if the capacity is different
+    if capacity_kwp_original != site.capacity_kwp:
+        with timed("postprocess"):
+            pred_df = pred_df * capacity_kwp_original / site.capacity_kwp
+
+    return pred_df
+
+
+async def run_forecast_async(
+    site: PVSite,
+    model: str = "gb",
+    ts: datetime | str = None,
+    nwp_source: str = "icon",
+    session=None,
+    cache: Optional[ForecastCache] = None,
+    with_no_live_pv: bool = False,
+) -> pd.DataFrame:
+    """
+    Predict solar power output for a given site, without blocking the event loop
+
+    This is the same as `run_forecast`, for use in async code such as the API. With the gb
+    model all the network requests are made on an aiohttp session. The xgb model is run in the
+    default executor.
+
+    :param site: the PV site
+    :param model: the model to use for prediction, choose between "gb" and "xgb"
+    :param ts: the timestamp of the site, see `run_forecast`
+    :param nwp_source: the nwp data source. Either "gfs", "icon" or "ukmo". Defaults to "icon"
+                       (only relevant if model=="gb")
+    :param session: the aiohttp session, defaults to the shared session of the event loop
+    :param cache: the forecast cache, see `run_forecast`
+    :param with_no_live_pv: if True, the forecast without live PV data is also returned, see
+                            `run_forecast`
+    :return: The PV forecast of the site for time (ts) for 48 hours
+    """
+
+    # log usage to sentry, see run_forecast
+    write_sentry({"site": site.copy(), "model": model, "ts": ts, "nwp_source": nwp_source})
+
+    if model not in ["gb", "xgb"]:
+        raise ValueError(f"Unsupported model: {model}. Choose between 'xgb' and 'gb'")
+
+    with timed("run_forecast"):
+        # the model is run on the time of the cache key, see run_forecast
+        ts = forecast_bucket(model, ts)
+
+        cache = _site_cache(site, cache)
+        if cache is not None:
+            key = cache.make_key(site, model, ts, nwp_source, with_no_live_pv)
+            predictions = cache.get(key)
+            if predictions is not None:
+                return predictions
+
+        if model == "gb":
+            predictions = await predict_ocf_async(
+                site, None, ts, nwp_source, session=session, with_no_live_pv=with_no_live_pv
+            )
+        else:
+            loop = asyncio.get_running_loop()
+            predictions = await loop.run_in_executor(
+                None, predict_tryolabs_with_no_live_pv, site, ts, with_no_live_pv
+            )
+
+        if cache is not None and predictions is not None:
+            cache.put(key, predictions, forecast_expiry(model, nwp_source))
+
+        return predictions
+
+
+def _sites_from_dataframe(
+    sites: pd.DataFrame, errors: str = "raise"
+) -> List[Union[PVSite, Exception]]:
+    """
+    Make PV sites from a dataframe with one row per site
+
+    The dataframe needs columns latitude, longitude and capacity_kwp, and can have columns tilt,
+    orientation and inverter_type. Empty values are left as the defaults.
+
+    :param sites: the dataframe
+    :param errors: if "raise", an invalid row raises a ValueError. If "return", the ValueError is
+        returned in place of the site
+    """
+    fields = [field for field in PVSite.model_fields if field in sites.columns]
+    result = []
+    for row in zip(*[sites[field] for field in fields]):
+        try:
+            result.append(
+                PVSite(**{field: value for field, value in zip(fields, row) if not pd.isna(value)})
+            )
+        except ValueError as e:
+            if errors == "raise":
+                raise
+            result.append(e)
+    return result
+
+
+def read_sites_csv(
+    path: str, chunk_size: int = 1000, errors: str = "raise"
+) -> Iterator[Union[PVSite, Exception]]:
+    """
+    Read PV sites from a csv file, a chunk of rows at a time
+
+    :param path: the csv file, with the columns described in `_sites_from_dataframe`
+    :param chunk_size: the number of rows read at once
+    :param errors: if "raise", an invalid row raises a ValueError. If "return", the error is
+        given in place of the site, and an unreadable file ends with its error
+    :return: iterator over the sites, so a large file is never all in memory
+    """
+    with pd.read_csv(path, chunksize=chunk_size) as reader:
+        while True:
+            try:
+                chunk = next(reader, None)
+            except (ValueError, pd.errors.ParserError) as e:
+                if errors == "raise":
+                    raise
+                yield e
+                return
+            if chunk is None:
+                return
+            yield from _sites_from_dataframe(chunk, errors)
+
+
+async def read_sites_csv_async(
+    path: str, chunk_size: int = 1000, errors: str = "raise"
+) -> AsyncIterator[Union[PVSite, Exception]]:
+    """
+    Read PV sites from a csv file, a chunk of rows at a time, without blocking the event loop
+
+    This is the same as `read_sites_csv`, but each chunk is read in the default executor. The
+    file is closed when all the sites are read, or when the iterator is closed with aclose().
+    """
+    loop = asyncio.get_running_loop()
+    sites = read_sites_csv(path, chunk_size, errors)
+    try:
+        while True:
+            # the sites of a chunk are made in the executor too
+            chunk = await loop.run_in_executor(
+                None, lambda: [site for _, site in zip(range(chunk_size), sites)]
+            )
+            for site in chunk:
+                yield site
+            if len(chunk) < chunk_size:
+                return
+    finally:
+        sites.close()
+
+
+def _empty_batch_predictions() -> pd.DataFrame:
+    """The predictions of a batch without any sites"""
+    return pd.DataFrame(
+        {"site_id": [], "time": pd.DatetimeIndex([]), "power_kw": np.array([], dtype=float)}
+    ).set_index(["site_id", "time"])
+
+
+def predict_ocf_batch(
+    sites: List[PVSite],
+    site_ids: list,
+    ts: datetime | str = None,
+    nwp_source: str = "icon",
+    snap_to_grid: bool = False,
+) -> pd.DataFrame:
+    """
+    Run the gb model for many sites at once
+
+    The NWP data is fetched once per location, in multi-location requests, and the model is run
+    on all the sites together.
+
+    :param sites: the PV sites
+    :param site_ids: the id of each site, used to key the results
+    :param ts: the timestamp of the sites. If None, defaults to the current timestamp rounded down to 15 minutes.
+    :param nwp_source: the nwp data source. Either "gfs", "icon" or "ukmo". Defaults to "icon"
+    :param snap_to_grid: if True, sites close together share the weather of a grid cell, see
+                         `get_nwp_batch`
+    :return: The PV forecast of the sites, indexed by site_id and time
+    """
+    if len(sites) == 0:
+        return _empty_batch_predictions()
+
+    if ts is None:
+        ts = pd.Timestamp.now().round("15min")
+
+    if isinstance(ts, str):
+        ts = datetime.fromisoformat(ts)
+
+    # the model is trained on sites with capacity <= 4 kWp, so we run those sites with 4 kWp
+    # and scale the results afterwards, as in predict_ocf
+    capacity_kwp_original = np.array([site.capacity_kwp for site in sites])
+    n_large = int((capacity_kwp_original > 4).sum())
+    if n_large > 0:
+        log.warning(f"{n_large} sites have a capacity greater than 4kWp, "
+                    "however the model is trained on sites with capacity <= 4kWp."
+                    "We therefore will run the model with a capacity of 4 kWp for these sites, "
+                    "and we'll scale the results afterwards.")
+        sites = [
+            site.model_copy(update={"capacity_kwp": 4}) if site.capacity_kwp > 4 else site
+            for site in sites
+        ]
+    scale = np.where(capacity_kwp_original > 4, capacity_kwp_original / 4, 1.0)
+
+    # fetch the nwp data once per location, with many locations per request, and the live pv
+    # data of all the inverters at the same time. The inverter fetches are queued before the
+    # task which waits for them, so they cannot be stuck behind it in the bounded pool
+    pv_ids = [str(i) for i in range(len(sites))]
+    live_generation_futures = submit_live_generation(sites, ts, _io_executor)
+    try:
+        nwp_list, pv_xr = fetch_nwp_and_pv(
+            lambda: get_nwp_batch(sites, ts=ts, nwp_source=nwp_source, snap_to_grid=snap_to_grid),
+            lambda: make_pv_data_batch(
+                sites=sites, ts=ts, pv_ids=pv_ids, live_generation_futures=live_generation_futures
+            ),
+            lambda: process_pv_data_batch([None] * len(sites), ts, sites, pv_ids),
+        )
+    finally:
+        # the fetches not started yet if the nwp or the pv data timed out
+        for future in live_generation_futures:
+            if future is not None:
+                future.cancel()
+    nwp_xrs = dict(zip(pv_ids, nwp_list))
+
+    # load and run models
+    pred_df = forecast_v1_tilt_orientation_batch(nwp_source, nwp_xrs, pv_xr, ts)
+
+    position = pred_df["pv_id"].astype(int).values
+    pred_df = pd.DataFrame(
+        {
+            "site_id": np.asarray(site_ids, dtype=object)[position],
+            "time": pred_df["time"].values,
+            "power_kw": pred_df["power_kw"].values * scale[position],
+        }
+    )
+
+    return pred_df.set_index(["site_id", "time"])
+
+
+def predict_tryolabs_batch(
+    sites: List[PVSite], site_ids: list, ts: datetime | str = None
+) -> pd.DataFrame:
+    """
+    Run the xgb model for many sites with one call to the model
+
+    :param sites: the PV sites
+    :param site_ids: the id of each site, used to key the results
+    :param ts: the timestamp of the sites. If None, defaults to the current timestamp rounded down to 15 minutes.
+    :return: The PV forecast of the sites, indexed by site_id and time
+    """
+    if len(sites) == 0:
+        return _empty_batch_predictions()
+
+    if ts is None:
+        start_date = pd.Timestamp.now().strftime("%Y-%m-%d")
+        start_time = pd.Timestamp.now().round(freq='h')
+    else:
+        start_date = pd.Timestamp(ts).strftime("%Y-%m-%d")
+        start_time = pd.Timestamp(ts).round(freq='h')
+
+    end_time = start_time + pd.Timedelta(hours=48)
+    start_date_datetime = datetime.strptime(start_date, "%Y-%m-%d")
+
+    # Check if the start date is more than 3 months ago
+    three_months_ago = datetime.today() - timedelta(days=3 * 30)
+
+    if start_date_datetime < three_months_ago:
+        log.warning(
+            f"Start date ({start_date}) is more than 3 months ago, no forecast data available."
+        )
+        return None
+
+    solar_power_predictor = get_predictor()
+    sites_df = pd.DataFrame(
+        {
+            "latitude": [site.latitude for site in sites],
+            "longitude": [site.longitude for site in sites],
+            "kwp": [site.capacity_kwp for site in sites],
+            "orientation": [site.orientation for site in sites],
+            "tilt": [site.tilt for site in sites],
+        }
+    )
+    predictions = solar_power_predictor.predict_power_output_batch(sites_df, start_date)
+
+    predictions = predictions[
+        (predictions["date"] >= start_time) & (predictions["date"] < end_time)
+    ]
+    pred_df = pd.DataFrame(
+        {
+            "site_id": np.asarray(site_ids, dtype=object)[predictions["site"].values],
+            "time": predictions["date"].values,
+            "power_kw": predictions["power_kw"].values,
+        }
+    )
+
+    return pred_df.set_index(["site_id", "time"])
+
+
+def run_forecast_batch(
+    sites: Union[List[PVSite], pd.DataFrame],
+    ts: datetime | str = None,
+    model: str = "gb",
+    nwp_source: str = "icon",
+    snap_to_grid: bool = False,
+) -> pd.DataFrame:
+    """
+    Predict solar power output for many sites at once.
+
+    This gives the same results as calling `run_forecast` for each site, but fetches the NWP
+    data once per location and runs the model on all the sites together. With snap_to_grid,
+    the gb model fetches it once per grid cell instead, and the results can differ slightly.
+
+    :param sites: the PV sites, either as a list or as a dataframe with one row per site.
+        The dataframe needs columns latitude, longitude and capacity_kwp, and can have columns
+        tilt, orientation, inverter_type and site_id. If there is no site_id column, the index
+        of the dataframe is used. For a list, the position of the site in the list is used.
+    :param ts: the timestamp of the sites. If None, defaults to the current timestamp rounded down to 15 minutes.
+    :param model: the model to use for prediction, choose between "gb" and "xgb"
+    :param nwp_source: the nwp data source. Either "gfs", "icon" or "ukmo". Defaults to "icon"
+                       (only relevant if model=="gb")
+    :param snap_to_grid: if True, sites close together share the weather of a grid cell, see
+                         `get_nwp_batch` (only relevant if model=="gb")
+    :return: The PV forecast of all the sites, in long format with a (site_id, time) index and a
+        power_kw column
+    """
+    if isinstance(sites, pd.DataFrame):
+        site_ids = list(sites["site_id"]) if "site_id" in sites.columns else list(sites.index)
+        sites = _sites_from_dataframe(sites)
+    else:
+        site_ids = list(range(len(sites)))
+
+    write_sentry({"n_sites": len(sites), "model": model, "ts": ts, "nwp_source": nwp_source})
+
+    # the default time is set as in run_forecast
+    if ts is None:
+        ts = pd.Timestamp.now().floor("15min")
+
     if model == "gb":
-        return predict_ocf(site, None, ts, nwp_source)
-              
+        return predict_ocf_batch(sites, site_ids, ts, nwp_source, snap_to_grid=snap_to_grid)
+
     elif model == "xgb":
-        return predict_tryolabs(site, ts)
-    
-    else:  
+        return predict_tryolabs_batch(sites, site_ids, ts)
+
+    else:
         raise ValueError(f"Unsupported model: {model}. Choose between 'xgb' and 'gb'")
+
+
+def run_forecast_sweep(
+    site: PVSite,
+    tilts: Optional[Iterable[float]] = None,
+    orientations: Optional[Iterable[float]] = None,
+    capacities_kwp: Optional[Iterable[float]] = None,
+    candidates: Optional[pd.DataFrame] = None,
+    ts: datetime | str = None,
+    model: str = "gb",
+    nwp_source: str = "icon",
+) -> Optional[xr.DataArray]:
+    """
+    Forecast many panel layouts at one location, e.g. to compare designs
+
+    The weather is fetched once, and all the candidate layouts are run through the model as one
+    batch. The forecasts are made without live PV data, so the inverter of the site is not used.
+
+    :param site: the PV site, giving the location and the default tilt, orientation and capacity
+    :param tilts: the tilts to try. Defaults to the tilt of the site.
+    :param orientations: the orientations to try. Defaults to the orientation of the site.
+    :param capacities_kwp: the capacities to try. Defaults to the capacity of the site.
+    :param candidates: the layouts to try, with columns tilt, orientation and capacity_kwp,
+        instead of every combination of tilts, orientations and capacities_kwp. Missing
+        columns are taken from the site.
+    :param ts: the timestamp of the forecast, rounded as in `run_forecast`. If None, defaults to
+               the current timestamp.
+    :param model: the model to use for prediction, choose between "gb" and "xgb"
+    :param nwp_source: the nwp data source. Either "gfs", "icon" or "ukmo". Defaults to "icon"
+                       (only relevant if model=="gb")
+    :return: The power_kw forecast, with dimensions candidate and time, and the tilt,
+        orientation and capacity_kwp of each candidate as coordinates. None if the xgb model
+        has no weather data for the timestamp.
+    """
+    if candidates is None:
+        tilt, orientation, capacity_kwp = np.meshgrid(
+            list(tilts) if tilts is not None else [site.tilt],
+            list(orientations) if orientations is not None else [site.orientation],
+            list(capacities_kwp) if capacities_kwp is not None else [site.capacity_kwp],
+            indexing="ij",
+        )
+        candidates = pd.DataFrame(
+            {
+                "tilt": tilt.ravel(),
+                "orientation": orientation.ravel(),
+                "capacity_kwp": capacity_kwp.ravel(),
+            }
+        )
+    else:
+        candidates = pd.DataFrame(
+            {
+                field: candidates[field] if field in candidates.columns else getattr(site, field)
+                for field in ["tilt", "orientation", "capacity_kwp"]
+            }
+        ).reset_index(drop=True)
+
+    sites = [
+        PVSite(
+            latitude=site.latitude,
+            longitude=site.longitude,
+            tilt=tilt,
+            orientation=orientation,
+            capacity_kwp=capacity_kwp,
+        )
+        for tilt, orientation, capacity_kwp in zip(
+            candidates["tilt"], candidates["orientation"], candidates["capacity_kwp"]
+        )
+    ]
+    site_ids = list(range(len(sites)))
+    if len(sites) == 0:
+        raise ValueError("There are no candidates to forecast")
+
+    # the same time as run_forecast uses, so a candidate has the same forecast as its site
+    ts = forecast_bucket(model, ts)
+
+    write_sentry({"n_candidates": len(sites), "model": model, "ts": ts, "nwp_source": nwp_source})
+
+    # the candidates are at the same location, so the batch forecasts fetch the weather once
+    if model == "gb":
+        predictions = predict_ocf_batch(sites, site_ids, ts, nwp_source)
+    elif model == "xgb":
+        predictions = predict_tryolabs_batch(sites, site_ids, ts)
+    else:
+        raise ValueError(f"Unsupported model: {model}. Choose between 'xgb' and 'gb'")
+
+    if predictions is None:
+        return None
+
+    with timed("postprocess"):
+        power_kw = predictions["power_kw"].unstack("time").reindex(site_ids)
+        cube = xr.DataArray(
+            power_kw.values,
+            dims=["candidate", "time"],
+            coords={
+                "candidate": site_ids,
+                "time": power_kw.columns.values,
+                "tilt": ("candidate", candidates["tilt"].values),
+                "orientation": ("candidate", candidates["orientation"].values),
+                "capacity_kwp": ("candidate", candidates["capacity_kwp"].values),
+            },
+            name="power_kw",
+        )
+
+    return cube
+
+
+async def run_forecast_stream(
+    sites: Union[Iterable[Union[PVSite, Exception]], AsyncIterable[Union[PVSite, Exception]]],
+    model: str = "gb",
+    ts: datetime | str = None,
+    nwp_source: str = "icon",
+    max_concurrency: int = 8,
+    with_no_live_pv: bool = False,
+) -> AsyncIterator[Tuple[int, PVSite, Union[pd.DataFrame, Exception]]]:
+    """
+    Run `run_forecast_async` for many sites, and yield each forecast as soon as it is ready
+
+    At most max_concurrency forecasts are run at once, and the sites are only taken from the
+    iterable as they are needed, so the memory used does not depend on the number of sites.
+
+    :param sites: the PV sites, e.g. from `read_sites_csv_async`. An exception in place of a
+                  site, e.g. for an invalid row of a site file, is given back as its result
+    :param model: the model to use for prediction, choose between "gb" and "xgb"
+    :param ts: the timestamp of the sites. If None, defaults to the current timestamp rounded down to 15 minutes.
+    :param nwp_source: the nwp data source. Either "gfs", "icon" or "ukmo". Defaults to "icon"
+                       (only relevant if model=="gb")
+    :param max_concurrency: the maximum number of forecasts run at once
+    :param with_no_live_pv: if True, the forecast without live PV data is also returned for the
+                            sites with an inverter, see `run_forecast`, and the sites without one
+                            are forecast as `no_live_pv_site`, as /forecast/ does
+    :return: async iterator of (position of the site, site, forecast), in the order the forecasts
+        finish. If a forecast fails, the exception is given instead of the forecast, and for an
+        exception in place of a site, the site is None
+    """
+    session = await get_async_session()
+
+    async def forecast_site(i: int, site: Union[PVSite, Exception]):
+        if isinstance(site, Exception):
+            return i, None, site
+        try:
+            if with_no_live_pv and not site.inverter_type:
+                # a site without an inverter has no live data, so only the forecast without
+                # it is made
+                predictions = await run_forecast_async(
+                    no_live_pv_site(site), model, ts, nwp_source, session=session
+                )
+            else:
+                predictions = await run_forecast_async(
+                    site, model, ts, nwp_source, session=session, with_no_live_pv=with_no_live_pv
+                )
+            return i, site, predictions
+        except Exception as e:
+            log.error(f"Forecast for site {i} failed: {e}")
+            return i, site, e
+
+    if not isinstance(sites, AsyncIterable):
+        sites = _as_async_iterable(sites)
+    sites = sites.__aiter__()
+
+    i = 0
+    exhausted = False
+    pending = set()
+    try:
+        while True:
+            while not exhausted and len(pending) < max_concurrency:
+                try:
+                    site = await sites.__anext__()
+                except StopAsyncIteration:
+                    exhausted = True
+                    break
+                pending.add(asyncio.ensure_future(forecast_site(i, site)))
+                i += 1
+
+            if len(pending) == 0:
+                return
+
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        # e.g. if the client stops reading
+        for task in pending:
+            task.cancel()
+
+
+async def _as_async_iterable(items: Iterable) -> AsyncIterator:
+    for item in items:
+        yield item
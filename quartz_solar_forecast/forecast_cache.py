@@ -0,0 +1,307 @@
+"""
+Cache of forecast results
+
+Forecasts for the same site in the same time bucket are the same, so `run_forecast` can keep
+them in a ForecastCache rather than running the model again. The key is made of:
+
+- the latitude and longitude, rounded
+- the capacity, tilt, orientation and inverter type of the site
+- the model and nwp source
+- the time the forecast starts from, see `forecast_bucket`. The xgb model rounds the forecast
+  time to the hour, so its forecasts within the same hour are shared
+
+Results are kept in memory, with the least recently used removed first, and optionally on
+disk, so they are shared between processes. Each result expires when the next run of the NWP
+model it was made from is available.
+
+The cache is used by `run_forecast` when it is passed one, when the
+QUARTZ_SOLAR_FORECAST_RESULT_CACHE_SIZE or QUARTZ_SOLAR_FORECAST_RESULT_CACHE_DIR environment
+variables are set, or after `set_forecast_cache` is called.
+"""
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Optional, Tuple
+
+import pandas as pd
+
+from quartz_solar_forecast.metrics import inc
+from quartz_solar_forecast.pydantic_models import PVSite
+from quartz_solar_forecast.weather.client import NWP_RUN_SCHEDULE, next_run
+
+log = logging.getLogger(__name__)
+
+DEFAULT_MAX_SIZE = 1024
+DEFAULT_MAX_DISK_SIZE = 100_000
+# how many results are written to disk between checks of the disk size
+DISK_PRUNE_INTERVAL = 100
+
+
+def forecast_bucket(model: str, ts: Optional[datetime] = None) -> pd.Timestamp:
+    """
+    Get the time a forecast starts from, as the model sees it
+
+    `run_forecast` makes the cache key from it and runs the model on it, so a cached forecast is
+    the one the model would make, and requests a few seconds apart share a forecast.
+
+    :param model: the model, "gb" or "xgb"
+    :param ts: the forecast time, defaults to now
+    :return: the time rounded down to 15 minutes for the gb model, or rounded to the hour for
+        the xgb model, as `predict_tryolabs` does
+    """
+    ts = pd.Timestamp(ts) if ts is not None else pd.Timestamp.now()
+    return ts.round("h") if model == "xgb" else ts.floor("15min")
+
+
+def forecast_expiry(model: str, nwp_source: str, now: Optional[datetime] = None) -> datetime:
+    """
+    Get the time, in UTC, when the next NWP run used by a model is available
+    """
+    # the xgb model uses the default Open-Meteo forecast
+    name = nwp_source if model == "gb" and nwp_source in NWP_RUN_SCHEDULE else "best_match"
+    return next_run(name, now)
+
+
+class ForecastCache:
+    """
+    Forecast results, in memory with least recently used eviction, and optionally on disk
+    """
+
+    def __init__(
+        self,
+        max_size: int = DEFAULT_MAX_SIZE,
+        path: Optional[str] = None,
+        max_disk_size: int = DEFAULT_MAX_DISK_SIZE,
+        location_decimals: int = 3,
+    ):
+        """
+        :param max_size: the maximum number of results in memory
+        :param path: the directory of the disk cache, it is made if it does not exist.
+            If None, results are only kept in memory
+        :param max_disk_size: the maximum number of results on disk. The oldest results are
+            removed every DISK_PRUNE_INTERVAL writes
+        :param location_decimals: the number of decimals the latitude and longitude are rounded
+            to. 3 decimals is about 100m
+        """
+        self.max_size = max_size
+        self.path = path
+        self.max_disk_size = max_disk_size
+        self.location_decimals = location_decimals
+
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+
+        # key -> (expiry time, forecast)
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+
+    def make_key(
+        self,
+        site: PVSite,
+        model: str,
+        ts: pd.Timestamp,
+        nwp_source: str,
+        with_no_live_pv: bool = False,
+    ) -> Tuple:
+        """
+        Make the key of a forecast
+
+        :param site: the PV site
+        :param model: the model, "gb" or "xgb"
+        :param ts: the forecast time bucket, see `forecast_bucket`
+        :param nwp_source: the nwp source, only used by the gb model
+        :param with_no_live_pv: whether the forecast without live PV data is included
+        :return: the key
+        """
+        return (
+            round(site.latitude, self.location_decimals),
+            round(site.longitude, self.location_decimals),
+            round(site.capacity_kwp, 3),
+            round(site.tilt, 1),
+            round(site.orientation, 1),
+            site.inverter_type,
+            model,
+            nwp_source if model == "gb" else None,
+            pd.Timestamp(ts).isoformat(),
+            with_no_live_pv,
+        )
+
+    def _file(self, key: Tuple) -> str:
+        name = hashlib.sha1(repr(key).encode()).hexdigest()
+        return os.path.join(self.path, f"{name}.pkl")
+
+    def get(self, key: Tuple, now: Optional[datetime] = None) -> Optional[pd.DataFrame]:
+        """
+        Get a forecast from the cache
+
+        :param key: the key, see `make_key`
+        :param now: the current time, defaults to now
+        :return: a copy of the forecast, or None if it is not in the cache or has expired
+        """
+        if now is None:
+            now = datetime.now(timezone.utc)
+        elif now.tzinfo is None:
+            now = now.replace(tzinfo=timezone.utc)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    inc("cache_hits_total", cache="forecast")
+                    return entry[1].copy()
+                del self._entries[key]
+
+        entry = self._read(key, now)
+        with self._lock:
+            if entry is not None and entry[0] > now:
+                self._add(key, entry)
+                self.hits += 1
+                inc("cache_hits_total", cache="forecast")
+                return entry[1].copy()
+            self.misses += 1
+        inc("cache_misses_total", cache="forecast")
+        return None
+
+    def put(self, key: Tuple, forecast: pd.DataFrame, expires_at: datetime) -> None:
+        """
+        Add a forecast to the cache
+
+        :param key: the key, see `make_key`
+        :param forecast: the forecast
+        :param expires_at: the time, in UTC, when the forecast expires
+        """
+        entry = (expires_at, forecast.copy())
+        with self._lock:
+            self._add(key, entry)
+
+        if self.path is not None:
+            self._write(key, entry)
+
+    def _add(self, key: Tuple, entry: Tuple[datetime, pd.DataFrame]) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def _read(self, key: Tuple, now: datetime) -> Optional[Tuple[datetime, pd.DataFrame]]:
+        if self.path is None:
+            return None
+
+        file = self._file(key)
+        try:
+            with open(file, "rb") as f:
+                stored_key, expires_at, forecast = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return None
+
+        # the key is stored too, in case of a hash collision
+        if stored_key != key:
+            return None
+        if expires_at <= now:
+            try:
+                os.remove(file)
+            except FileNotFoundError:
+                pass
+            return None
+
+        return expires_at, forecast
+
+    def _write(self, key: Tuple, entry: Tuple[datetime, pd.DataFrame]) -> None:
+        # write to a temporary file first, so readers never see a partly written result
+        with tempfile.NamedTemporaryFile(dir=self.path, suffix=".tmp", delete=False) as f:
+            pickle.dump((key, *entry), f)
+        os.replace(f.name, self._file(key))
+
+        # listing the directory is slow with many results, so it is only checked now and then
+        self._writes += 1
+        if self._writes % DISK_PRUNE_INTERVAL == 0:
+            self._prune_disk()
+
+    def _prune_disk(self) -> None:
+        files = [
+            os.path.join(self.path, name)
+            for name in os.listdir(self.path)
+            if name.endswith(".pkl")
+        ]
+        if len(files) <= self.max_disk_size:
+            return
+
+        # remove the oldest results first
+        files.sort(key=lambda file: os.path.getmtime(file))
+        for file in files[:len(files) - self.max_disk_size]:
+            try:
+                os.remove(file)
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> dict:
+        """
+        Get the hits, misses and size of the cache
+        """
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / requests if requests else 0.0,
+                "size": len(self._entries),
+            }
+
+    def clear(self) -> None:
+        """
+        Remove all the results, from memory and disk, and reset the counters
+        """
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+            if self.path is not None:
+                for name in os.listdir(self.path):
+                    if name.endswith(".pkl"):
+                        os.remove(os.path.join(self.path, name))
+
+
+_cache: Optional[ForecastCache] = None
+_cache_configured = False
+
+
+def get_forecast_cache() -> Optional[ForecastCache]:
+    """
+    Get the forecast cache used by `run_forecast`
+
+    :return: the cache, or None if there is no cache configured
+    """
+    global _cache, _cache_configured
+
+    if not _cache_configured:
+        max_size = int(os.getenv("QUARTZ_SOLAR_FORECAST_RESULT_CACHE_SIZE", 0))
+        path = os.getenv("QUARTZ_SOLAR_FORECAST_RESULT_CACHE_DIR")
+        if max_size > 0 or path:
+            _cache = ForecastCache(max_size=max_size or DEFAULT_MAX_SIZE, path=path)
+        _cache_configured = True
+
+    return _cache
+
+
+def set_forecast_cache(cache: Optional[ForecastCache]) -> None:
+    """
+    Set the forecast cache used by `run_forecast`
+
+    :param cache: the cache, or None to stop using a cache
+    """
+    global _cache, _cache_configured
+
+    _cache = cache
+    _cache_configured = True
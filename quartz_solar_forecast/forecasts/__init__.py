@@ -8,4 +8,11 @@ It is trained on 25,000 PV sites with over 5 years of PV history, which is avail
 """
 from .v1 import forecast_v1
 from .v1_tilt_orientation import forecast_v1_tilt_orientation
-from .v2 import TryolabsSolarPowerPredictor
+from .v2 import TryolabsSolarPowerPredictor, get_predictor, set_predictor
+from .registry import (
+    bind_data_sources,
+    get_model,
+    get_model_stats,
+    preload_models,
+    register_model,
+)
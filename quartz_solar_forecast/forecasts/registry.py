@@ -0,0 +1,207 @@
+"""
+Model registry
+
+Each model is loaded lazily, at most once per process, and the same object is then shared
+between calls and threads. Models can also be loaded up front with `preload_models`, for
+example when an API worker starts.
+
+The shared models must not be mutated. The psp models need their data sources set before
+predicting, which is done on a per-call copy with `bind_data_sources`.
+"""
+import copy
+import logging
+import os
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from psp.serialization import load_model
+
+from quartz_solar_forecast.metrics import observe
+
+from .constants import MODEL_FILE
+
+log = logging.getLogger(__name__)
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+
+
+@dataclass
+class ModelInfo:
+    """Statistics about a loaded model"""
+
+    name: str
+    load_time_s: float
+    size_bytes: int
+
+
+def _psp_path(version: str) -> str:
+    return f"{dir_path}/../models/model-{version}.pkl"
+
+
+def _psp_loader(version: str) -> Callable[[], Any]:
+    def load():
+        return load_model(_psp_path(version))
+
+    return load
+
+
+def _xgb_loader():
+    # imported here to avoid a circular import, v2 uses this registry
+    from .v2 import TryolabsSolarPowerPredictor
+
+    return TryolabsSolarPowerPredictor()._read_model()
+
+
+_loaders: Dict[str, Callable[[], Any]] = {
+    "0.3.0": _psp_loader("0.3.0"),
+    "0.4.0": _psp_loader("0.4.0"),
+    "xgb": _xgb_loader,
+}
+# the files the models are loaded from, to know their size
+_paths: Dict[str, str] = {
+    "0.3.0": _psp_path("0.3.0"),
+    "0.4.0": _psp_path("0.4.0"),
+    "xgb": f"{dir_path}/../models/{MODEL_FILE}",
+}
+_models: Dict[str, Any] = {}
+_model_info: Dict[str, ModelInfo] = {}
+_load_locks: Dict[str, threading.Lock] = {}
+_lock = threading.Lock()
+
+
+def _model_size_bytes(name: str, model: Any) -> int:
+    """
+    Approximate the memory used by a model
+
+    The models are mostly made of numpy arrays (psp) or a serialized booster (xgb), so the size
+    of the file they were loaded from is a good estimate of the memory they hold. Models without
+    a file are given the shallow size of the object.
+    """
+    path = _paths.get(name)
+    if path is not None and os.path.isfile(path):
+        return os.path.getsize(path)
+    return sys.getsizeof(model)
+
+
+def register_model(name: str, loader: Callable[[], Any], path: Optional[str] = None) -> None:
+    """
+    Register a model loader under a name
+
+    :param name: the name of the model, e.g. "0.4.0"
+    :param loader: function with no arguments that loads and returns the model
+    :param path: optional file the model is loaded from, used for its size in the statistics
+    """
+    with _lock:
+        _loaders[name] = loader
+        if path is not None:
+            _paths[name] = path
+
+
+def get_model(
+    name: str, loader: Optional[Callable[[], Any]] = None, path: Optional[str] = None
+) -> Any:
+    """
+    Get a model, loading it if this is the first time it is requested in this process
+
+    :param name: the name of the model. Either "0.3.0", "0.4.0", "xgb" or a registered name
+    :param loader: optional loader, used to register the model if the name is not known yet
+    :param path: optional file the loader reads the model from, see `register_model`
+    :return: the shared model object
+    """
+    model = _models.get(name)
+    if model is not None:
+        return model
+
+    with _lock:
+        if name not in _loaders:
+            if loader is None:
+                raise ValueError(
+                    f"Unknown model: {name}. Choose from {', '.join(sorted(_loaders))}"
+                )
+            _loaders[name] = loader
+            if path is not None:
+                _paths[name] = path
+        load_lock = _load_locks.setdefault(name, threading.Lock())
+
+    # only one thread loads a given model, the others wait for it
+    with load_lock:
+        model = _models.get(name)
+        if model is not None:
+            return model
+
+        log.info(f"Loading model {name}")
+        start = time.perf_counter()
+        model = _loaders[name]()
+        load_time_s = time.perf_counter() - start
+        observe("model_load", load_time_s)
+
+        info = ModelInfo(
+            name=name, load_time_s=load_time_s, size_bytes=_model_size_bytes(name, model)
+        )
+        log.info(
+            f"Loaded model {name} in {info.load_time_s:.2f} seconds, "
+            f"size {info.size_bytes / 1e6:.1f} MB"
+        )
+
+        with _lock:
+            _model_info[name] = info
+            _models[name] = model
+
+    return model
+
+
+def bind_data_sources(model: Any, **data_sources: Any) -> Any:
+    """
+    Get a copy of a psp model with its data sources set
+
+    `set_data_sources` stores the data sources on the model, so calling it on the shared model
+    would race with other threads using it. The copy is shallow, so the fitted regressor and
+    the rest of the model are still shared, and making it is cheap.
+
+    :param model: the shared psp model
+    :param data_sources: keyword arguments for `model.set_data_sources`, e.g. pv_data_source
+        and nwp_data_sources
+    :return: a copy of the model, bound to the data sources, which is only used by this call
+    """
+    bound_model = copy.copy(model)
+    bound_model.set_data_sources(**data_sources)
+    return bound_model
+
+
+def preload_models(names: Optional[Iterable[str]] = None) -> Dict[str, ModelInfo]:
+    """
+    Load models now, rather than on the first forecast
+
+    :param names: the models to load. Defaults to the psp models "0.3.0" and "0.4.0".
+        The xgb model is not loaded by default, as it may need to be downloaded first.
+    :return: the statistics of the loaded models
+    """
+    if names is None:
+        names = ["0.3.0", "0.4.0"]
+
+    for name in names:
+        get_model(name)
+
+    return {name: _model_info[name] for name in names}
+
+
+def get_model_stats() -> Dict[str, ModelInfo]:
+    """
+    Get the load time and size of all the models loaded so far
+
+    :return: dictionary of model name to ModelInfo
+    """
+    with _lock:
+        return dict(_model_info)
+
+
+def clear_models() -> None:
+    """
+    Forget all loaded models, they will be loaded again on the next call
+    """
+    with _lock:
+        _models.clear()
+        _model_info.clear()
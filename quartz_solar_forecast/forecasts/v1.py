@@ -1,12 +1,10 @@
 import pandas as pd
 import xarray as xr
-import os
 from psp.data_sources.nwp import NwpDataSource
 from psp.data_sources.pv import NetcdfPvDataSource
-from psp.serialization import load_model
 from psp.typings import X
 
-dir_path = os.path.dirname(os.path.realpath(__file__))
+from .registry import bind_data_sources, get_model
 
 
 def forecast_v1(nwp_source:str, nwp_xr:xr.Dataset, pv_xr:xr.Dataset, ts:pd.Timestamp, model=None):
@@ -17,7 +15,7 @@ def forecast_v1(nwp_source:str, nwp_xr:xr.Dataset, pv_xr:xr.Dataset, ts:pd.Times
     """
 
     if model is None:
-        model = load_model(f"{dir_path}/../models/model-0.3.0.pkl")
+        model = get_model("0.3.0")
 
     # format pv and nwp data
     pv_data_source = NetcdfPvDataSource(
@@ -29,7 +27,10 @@ def forecast_v1(nwp_source:str, nwp_xr:xr.Dataset, pv_xr:xr.Dataset, ts:pd.Times
     )
     # make NwpDataSource
     nwp = NwpDataSource(nwp_xr, value_name=nwp_source)
-    model.set_data_sources(pv_data_source=pv_data_source, nwp_data_sources={nwp_source: nwp})
+    # the model may be shared with other threads, so the data sources are set on a copy
+    model = bind_data_sources(
+        model, pv_data_source=pv_data_source, nwp_data_sources={nwp_source: nwp}
+    )
 
     # make prediction.
     # Note pv_id=1 is arbitrary, but the pv_xr must have this in it.
@@ -1,12 +1,17 @@
+from typing import Dict, List, Union
+
+import numpy as np
 import pandas as pd
 import xarray as xr
-import os
 from psp.data_sources.nwp import NwpDataSource
 from psp.data_sources.pv import NetcdfPvDataSource
-from psp.serialization import load_model
-from psp.typings import X
+from psp.models.regressors.decision_trees import SklearnRegressor
+from psp.typings import Features, X
+from psp.utils.batches import batch_features
+
+from quartz_solar_forecast.metrics import timed
 
-dir_path = os.path.dirname(os.path.realpath(__file__))
+from .registry import bind_data_sources, get_model
 
 
 def forecast_v1_tilt_orientation(nwp_source:str, nwp_xr:xr.Dataset, pv_xr:xr.Dataset, ts:pd.Timestamp, model=None):
@@ -17,7 +22,7 @@ def forecast_v1_tilt_orientation(nwp_source:str, nwp_xr:xr.Dataset, pv_xr:xr.Dat
     """
 
     if model is None:
-        model = load_model(f"{dir_path}/../models/model-0.4.0.pkl")
+        model = get_model("0.4.0")
 
     # format pv and nwp data
     pv_data_source = NetcdfPvDataSource(
@@ -29,15 +34,137 @@ def forecast_v1_tilt_orientation(nwp_source:str, nwp_xr:xr.Dataset, pv_xr:xr.Dat
     )
     # make NwpDataSource
     nwp = NwpDataSource(nwp_xr, value_name=nwp_source)
-    model.set_data_sources(pv_data_source=pv_data_source, nwp_data_sources={nwp_source: nwp})
+    # the model may be shared with other threads, so the data sources are set on a copy
+    model = bind_data_sources(
+        model, pv_data_source=pv_data_source, nwp_data_sources={nwp_source: nwp}
+    )
 
     # make prediction.
     # Note pv_id=1 is arbitrary, but the pv_xr must have this in it.
     x = X(pv_id="1", ts=ts)
-    pred = model.predict(x)
+    with timed("model_predict"):
+        pred = model.predict(x)
 
     # format into timerange and put into pd dataframe
-    times = pd.date_range(start=x.ts, periods=len(pred.powers), freq="15min")
-    pred_df = pd.DataFrame({"power_kw": pred.powers}, index=times)
+    with timed("postprocess"):
+        times = pd.date_range(start=x.ts, periods=len(pred.powers), freq="15min")
+        pred_df = pd.DataFrame({"power_kw": pred.powers}, index=times)
+
+    return pred_df
+
+
+@timed("model_predict")
+def _predict_features(model, xs: List[X], features: List[Features]) -> np.ndarray:
+    """
+    Run the regressor of a psp model on many sets of features at once
+
+    This does the same as `model.predict_from_features` for each set of features, but with one
+    call to the underlying sklearn regressor. It uses the internals of the SklearnRegressor of
+    pv-site-prediction, which is pinned in pyproject.toml, and the parity with `model.predict`
+    is tested. Other regressors are run with `model.predict_from_features` for each set.
+
+    :return: array of shape (len(features), number of horizons)
+    """
+    regressor = getattr(model, "_regressor", None)
+    if not isinstance(regressor, SklearnRegressor):
+        return np.stack([model.predict_from_features(x, f).powers for x, f in zip(xs, features)])
+
+    batch = batch_features(features)
+    matrix, _ = regressor._prepare_features(batch, is_training=False)
+    pred = regressor._regressor.predict(matrix).reshape(len(features), -1)
+
+    # as SklearnRegressor.predict does for one set of features
+    if regressor._normalize_targets:
+        return pred * batch["_capacity"] * batch["_poa_global"]
+    else:
+        return pred * ((batch["poa_global"] > 0) * 1.0)
+
+
+def forecast_v1_tilt_orientation_batch(
+    nwp_source: str,
+    nwp_xrs: Dict[str, xr.Dataset],
+    pv_xr: xr.Dataset,
+    ts: Union[pd.Timestamp, List[pd.Timestamp]],
+    model=None,
+    batch_size: int = 1000,
+) -> pd.DataFrame:
+    """
+    Run the forecast for many PV sites, and optionally many timestamps, at once
+
+    Features are made for every (pv_id, ts) pair and the regressor is then run on them in
+    batches, rather than once per forecast.
+
+    :param nwp_source: the nwp data source. Either "gfs", "icon" or "ukmo"
+    :param nwp_xrs: dictionary of pv_id to the nwp data for that site. Sites which share the
+        same dataset object also share one NwpDataSource
+    :param pv_xr: PV data with all the pv_ids in it
+    :param ts: the timestamp, or list of timestamps, to forecast from
+    :param model: the model to use, defaults to the shared 0.4.0 model
+    :param batch_size: the number of forecasts passed to the regressor at once
+    :return: dataframe with columns pv_id, ts, time and power_kw. There is one row per pv_id,
+        ts and 15 minute forecast horizon
+    """
+
+    if model is None:
+        model = get_model("0.4.0")
+
+    if isinstance(ts, (list, tuple, pd.DatetimeIndex)):
+        timestamps = list(ts)
+    else:
+        timestamps = [ts]
+
+    pv_data_source = NetcdfPvDataSource(
+        pv_xr,
+        id_dim_name="pv_id",
+        timestamp_dim_name="timestamp",
+        rename={"generation_kw": "power", "kwp": "capacity"},
+        ignore_pv_ids=[],
+    )
+
+    # group the pv ids by nwp dataset, so each dataset is only wrapped once
+    groups = {}
+    for pv_id, nwp_xr in nwp_xrs.items():
+        groups.setdefault(id(nwp_xr), (nwp_xr, []))[1].append(str(pv_id))
+
+    xs = []
+    powers = []
+    batch_xs = []
+    features = []
+    for nwp_xr, pv_ids in groups.values():
+        nwp = NwpDataSource(nwp_xr, value_name=nwp_source)
+        group_model = bind_data_sources(
+            model, pv_data_source=pv_data_source, nwp_data_sources={nwp_source: nwp}
+        )
+
+        for pv_id in pv_ids:
+            for t in timestamps:
+                x = X(pv_id=pv_id, ts=t)
+                xs.append(x)
+                batch_xs.append(x)
+                features.append(group_model.get_features(x))
+
+                # predict as we go, so we never hold the features of all the sites
+                if len(features) == batch_size:
+                    powers.append(_predict_features(model, batch_xs, features))
+                    batch_xs = []
+                    features = []
+
+    if len(features) > 0:
+        powers.append(_predict_features(model, batch_xs, features))
+
+    powers = np.concatenate(powers, axis=0)
+    n_horizons = powers.shape[1]
+
+    # format into one long dataframe
+    init_times = pd.DatetimeIndex([x.ts for x in xs])
+    steps = pd.to_timedelta(np.arange(n_horizons) * 15, unit="min")
+    pred_df = pd.DataFrame(
+        {
+            "pv_id": np.repeat([x.pv_id for x in xs], n_horizons),
+            "ts": np.repeat(init_times, n_horizons),
+            "time": (init_times.values[:, None] + steps.values[None, :]).ravel(),
+            "power_kw": powers.ravel(),
+        }
+    )
 
     return pred_df
@@ -1,16 +1,21 @@
 import datetime
+import numpy as np
 import pandas as pd
 import zipfile
 import os.path
 import shutil
 import logging
+import threading
+from typing import List, Optional
 
 from huggingface_hub import hf_hub_download
+from quartz_solar_forecast.metrics import timed
 from quartz_solar_forecast.weather import WeatherService
 
 from xgboost.sklearn import XGBRegressor
 
 from . import constants
+from .registry import get_model
 import quartz_solar_forecast
 
 logger = logging.getLogger(__name__)
@@ -37,6 +42,33 @@ class TryolabsSolarPowerPredictor:
         Predicts solar power output for the given parameters.
     """
     DATE_COLUMN = "date"
+    # the site column of each panel feature
+    PANEL_FEATURES = {
+        "latitude_rounded": "latitude",
+        "longitude_rounded": "longitude",
+        "orientation": "orientation",
+        "tilt": "tilt",
+        "kwp": "kwp",
+    }
+    # the date attribute of each date feature
+    DATE_FEATURES = {"date_month": "month", "date_day": "day", "date_hour": "hour"}
+    # the features made by `clean`, for models which were not trained with feature names
+    FEATURES = list(PANEL_FEATURES) + [
+        "temperature_2m",
+        "relative_humidity_2m",
+        "dew_point_2m",
+        "precipitation",
+        "surface_pressure",
+        "cloud_cover",
+        "cloud_cover_low",
+        "cloud_cover_mid",
+        "cloud_cover_high",
+        "wind_speed_10m",
+        "wind_direction_10m",
+        "is_day",
+        "direct_radiation",
+        "diffuse_radiation",
+    ] + list(DATE_FEATURES)
     download_dir = os.path.dirname(quartz_solar_forecast.__file__) + "/models"
 
     def _download_model(self, filename: str, repo_id: str, file_path: str) -> str:
@@ -111,6 +143,32 @@ class TryolabsSolarPowerPredictor:
         XGBRegressor
             The loaded XGBoost model ready for making predictions.
         """
+        # the model is loaded once per process and shared, see forecasts/registry.py
+        name = "xgb" if model_file == constants.MODEL_FILE else model_file
+        loaded_model = get_model(
+            name,
+            loader=lambda: self._read_model(model_file, repo_id, file_path),
+            path=os.path.join(self.download_dir, model_file),
+        )
+        self.model = loaded_model
+        return loaded_model
+
+    def _read_model(
+        self,
+        model_file: str = constants.MODEL_FILE,
+        repo_id: str = "openclimatefix/open-source-quartz-solar-forecast",
+        file_path: str = "models/v2/model_10_202405.ubj.zip"
+    ) -> XGBRegressor:
+        """
+        Downloads and decompresses the XGBoost model if necessary, and reads it from disk.
+
+        Parameters are the same as for `load_model`.
+
+        Returns:
+        --------
+        XGBRegressor
+            A newly loaded XGBoost model.
+        """
         # Use the project directory
         zipfile_model = os.path.join(self.download_dir, model_file + ".zip")
     
@@ -126,7 +184,6 @@ class TryolabsSolarPowerPredictor:
         logger.info("Loading model...")
         loaded_model = XGBRegressor()
         loaded_model.load_model(model_path)
-        self.model = loaded_model
         return loaded_model
         
     def get_data(
@@ -161,9 +218,21 @@ class TryolabsSolarPowerPredictor:
         pd.DataFrame
             Prepared weather data with additional solar panel parameters.
         """
-        start_date_datetime = datetime.datetime.strptime(start_date, "%Y-%m-%d")
-        end_date_datetime = start_date_datetime + datetime.timedelta(days=2)
-        end_date = end_date_datetime.strftime("%Y-%m-%d")
+        weather_data = self._get_weather(latitude, longitude, start_date)
+
+        return self._add_panel_columns(weather_data, latitude, longitude, kwp, orientation, tilt)
+
+    def _get_weather(
+        self, latitude: float, longitude: float, start_date: str, end_date: Optional[str] = None
+    ) -> pd.DataFrame:
+        """
+        Fetches hourly weather data from start_date to end_date for the given location, in one
+        request. By default, two days from start_date are fetched.
+        """
+        if end_date is None:
+            start_date_datetime = datetime.datetime.strptime(start_date, "%Y-%m-%d")
+            end_date_datetime = start_date_datetime + datetime.timedelta(days=2)
+            end_date = end_date_datetime.strftime("%Y-%m-%d")
 
         weather_service = WeatherService()
 
@@ -171,6 +240,20 @@ class TryolabsSolarPowerPredictor:
             latitude, longitude, start_date, end_date
         )
 
+        return weather_data
+
+    def _add_panel_columns(
+        self,
+        weather_data: pd.DataFrame,
+        latitude: float,
+        longitude: float,
+        kwp: float,
+        orientation: float,
+        tilt: float,
+    ) -> pd.DataFrame:
+        """
+        Adds the solar panel parameters to the weather data, in the column order of the model.
+        """
         PANEL_COLUMNS = [
             "latitude_rounded",
             "longitude_rounded",
@@ -223,6 +306,77 @@ class TryolabsSolarPowerPredictor:
 
         return df
 
+    @property
+    def feature_names(self) -> List[str]:
+        """
+        The features of the model, in the order it expects them.
+        """
+        feature_names = self.model.get_booster().feature_names
+        return feature_names if feature_names is not None else self.FEATURES
+
+    def build_features(
+        self, site_weather: List[pd.DataFrame], sites: pd.DataFrame, day_only: bool = False
+    ) -> np.ndarray:
+        """
+        Builds the feature matrix of many sites, as `clean` does for one site, without making
+        intermediate DataFrames.
+
+        The features are written into one float32 matrix, in the order of the model, so it can
+        be predicted in place. The weather features are put together once per location.
+
+        Parameters
+        ----------
+        site_weather : List[pd.DataFrame]
+            The weather data of each site, as returned by `_get_weather`. Sites at the same
+            location can share the same DataFrame, which is not modified.
+        sites : pd.DataFrame
+            One row per site, with columns latitude, longitude, kwp, orientation and tilt.
+        day_only : bool
+            Only keep the rows where `is_day` is 1, as the output is 0 at night.
+
+        Returns
+        -------
+        np.ndarray
+            The features, with the rows of each site one after the other.
+        """
+        feature_names = self.feature_names
+        panel_index = [i for i, name in enumerate(feature_names) if name in self.PANEL_FEATURES]
+        weather_index = [
+            i for i, name in enumerate(feature_names) if name not in self.PANEL_FEATURES
+        ]
+
+        # the weather features of each location
+        blocks = {}
+        for data in site_weather:
+            if id(data) in blocks:
+                continue
+            rows = data[data["is_day"].values != 0] if day_only else data
+            dates = pd.DatetimeIndex(rows[self.DATE_COLUMN])
+
+            block = np.empty((len(rows), len(weather_index)), dtype=np.float32)
+            for j, i in enumerate(weather_index):
+                name = feature_names[i]
+                if name in self.DATE_FEATURES:
+                    block[:, j] = getattr(dates, self.DATE_FEATURES[name])
+                else:
+                    block[:, j] = rows[name].values
+            blocks[id(data)] = block
+
+        site_blocks = [blocks[id(data)] for data in site_weather]
+        lengths = [len(block) for block in site_blocks]
+        features = np.empty((sum(lengths), len(feature_names)), dtype=np.float32)
+
+        for i in panel_index:
+            site_column = self.PANEL_FEATURES[feature_names[i]]
+            features[:, i] = np.repeat(sites[site_column].values, lengths)
+
+        start = 0
+        for block in site_blocks:
+            features[start : start + len(block), weather_index] = block
+            start += len(block)
+
+        return features
+
     def predict_power_output(
         self,
         latitude: float,
@@ -231,6 +385,7 @@ class TryolabsSolarPowerPredictor:
         kwp: float,
         orientation: float = 180,
         tilt: float = 30,
+        end_date: Optional[str] = None,
     ) -> pd.DataFrame:
         """
         Predicts solar power output for the specified parameters.
@@ -249,6 +404,8 @@ class TryolabsSolarPowerPredictor:
             Orientation angle of the solar panel system in degrees.
         tilt : float
             Tilt angle of the solar panel system in degrees.
+        end_date : str, optional
+            End date in 'YYYY-MM-DD' format, included. Defaults to two days after start_date.
 
         Returns
         -------
@@ -256,16 +413,142 @@ class TryolabsSolarPowerPredictor:
             DataFrame containing timestamps and predicted power output in kW for every 15 minutes.
         """
 
-        data = self.get_data(latitude, longitude, start_date, kwp, orientation, tilt)
-        #if data is not None:
-        cleaned_data = self.clean(data)
-        predictions = self.model.predict(cleaned_data.drop(columns=[self.DATE_COLUMN]))
-        predictions_df = pd.DataFrame(predictions, columns=["prediction"])
-        final_data = cleaned_data.join(predictions_df)
-        # set night predictions to 0
-        final_data.loc[final_data["is_day"] == 0, "prediction"] = 0
+        sites = pd.DataFrame(
+            {
+                "latitude": [latitude],
+                "longitude": [longitude],
+                "kwp": [kwp],
+                "orientation": [orientation],
+                "tilt": [tilt],
+            }
+        )
+        df = self.predict_power_output_batch(sites, start_date, end_date)
+        return df[[self.DATE_COLUMN, "power_kw"]]
+
+    def predict_power_output_batch(
+        self, sites: pd.DataFrame, start_date: str, end_date: Optional[str] = None
+    ) -> pd.DataFrame:
+        """
+        Predicts solar power output for many sites with a single call to the model.
+
+        The weather data is fetched once per unique location, and the feature rows of all the
+        sites are put into one matrix.
+
+        Parameters
+        ----------
+        sites : pd.DataFrame
+            One row per site, with columns latitude, longitude, kwp, orientation and tilt.
+        start_date : str
+            Start date in 'YYYY-MM-DD' format.
+        end_date : str, optional
+            End date in 'YYYY-MM-DD' format, included. Defaults to two days after start_date.
+
+        Returns
+        -------
+        pd.DataFrame
+            DataFrame with columns site (the index label of the site in `sites`), date and
+            power_kw.
+        """
+        weather = {}
+        site_weather = []
+        for latitude, longitude in zip(sites["latitude"], sites["longitude"]):
+            if (latitude, longitude) not in weather:
+                weather[(latitude, longitude)] = self._get_weather(
+                    latitude, longitude, start_date, end_date
+                )
+            site_weather.append(weather[(latitude, longitude)])
+
+        lengths = [len(data) for data in site_weather]
+        is_day = np.concatenate([data["is_day"].values for data in site_weather]) != 0
+
+        # the output is 0 at night, so only the day rows go through the model
+        with timed("features"):
+            features = self.build_features(site_weather, sites, day_only=True)
+        predictions = np.zeros(len(is_day), dtype=np.float32)
+        if len(features) > 0:
+            with timed("model_predict"):
+                # a numpy matrix is predicted in place by the booster, without making a DMatrix.
+                # NumPy and compiled evaluators of the trees were slower, see benchmarks/README.md
+                predictions[is_day] = self.model.predict(features, validate_features=False)
+
         # set negative output to 0
-        final_data.loc[final_data["prediction"] < 0, "prediction"] = 0
-        df = final_data[[self.DATE_COLUMN, "prediction"]]
-        df = df.rename(columns={"prediction": "power_kw"})
+        predictions[predictions < 0] = 0
+
+        df = pd.DataFrame(
+            {
+                "site": np.repeat(sites.index.values, lengths),
+                self.DATE_COLUMN: np.concatenate(
+                    [data[self.DATE_COLUMN].values for data in site_weather]
+                ),
+                "power_kw": predictions,
+            }
+        )
         return df
+
+    def predict_power_output_sites(
+        self, sites: pd.DataFrame, start_date: str, end_date: Optional[str] = None
+    ) -> List[pd.DataFrame]:
+        """
+        Predicts solar power output for many sites with a single call to the model, and splits
+        the predictions back per site.
+
+        Parameters
+        ----------
+        sites : pd.DataFrame
+            One row per site, with columns latitude, longitude, kwp, orientation and tilt.
+        start_date : str
+            Start date in 'YYYY-MM-DD' format.
+        end_date : str, optional
+            End date in 'YYYY-MM-DD' format, included. Defaults to two days after start_date.
+
+        Returns
+        -------
+        List[pd.DataFrame]
+            The predictions of each site, in the order of `sites`, as returned by
+            `predict_power_output`.
+        """
+        df = self.predict_power_output_batch(sites.reset_index(drop=True), start_date, end_date)
+
+        # the rows of each site are contiguous, in the order of the sites
+        ends = np.searchsorted(df["site"].values, np.arange(len(sites)), side="right")
+        starts = np.concatenate([[0], ends[:-1]])
+
+        return [
+            df.iloc[start:end][[self.DATE_COLUMN, "power_kw"]].reset_index(drop=True)
+            for start, end in zip(starts, ends)
+        ]
+
+
+_predictor: Optional[TryolabsSolarPowerPredictor] = None
+_predictor_lock = threading.Lock()
+
+
+def get_predictor() -> TryolabsSolarPowerPredictor:
+    """
+    Get the predictor shared by all the xgb forecasts in this process, with its model loaded
+
+    The predictor holds no state between calls apart from the model, so it is safe to use from
+    many threads.
+    """
+    global _predictor
+
+    with _predictor_lock:
+        if _predictor is None:
+            predictor = TryolabsSolarPowerPredictor()
+            predictor.load_model()
+            _predictor = predictor
+
+    return _predictor
+
+
+def set_predictor(predictor: Optional[TryolabsSolarPowerPredictor]) -> None:
+    """
+    Set the predictor shared by the xgb forecasts, e.g. to use another model
+
+    :param predictor: the predictor, with its model loaded, or None to load the default one
+        on the next forecast
+    """
+    global _predictor
+
+    with _predictor_lock:
+        _predictor = predictor
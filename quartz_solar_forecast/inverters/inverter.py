@@ -1,4 +1,5 @@
 import abc
+import asyncio
 from typing import Optional
 
 import pandas as pd
@@ -12,3 +13,13 @@ class AbstractInverter(abc.ABC):
     @abc.abstractmethod
     def get_data(self, ts: pd.Timestamp) -> Optional[pd.DataFrame]:
         raise NotImplementedError
+
+    async def get_data_async(self, ts: pd.Timestamp, session=None) -> Optional[pd.DataFrame]:
+        """
+        Get the live data without blocking the event loop.
+
+        By default `get_data` is run in the default executor. Inverters with an async API
+        override this, and can use the given aiohttp session.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.get_data, ts)
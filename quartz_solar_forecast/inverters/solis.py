@@ -53,6 +53,13 @@ class SolisInverter(AbstractInverter):
             print(f"Error retrieving Solis data: {str(e)}")
             return None
 
+    async def get_data_async(self, ts: pd.Timestamp, session: Optional[ClientSession] = None) -> Optional[pd.DataFrame]:
+        try:
+            return await get_solis_data(self.__settings, session)
+        except Exception as e:
+            print(f"Error retrieving Solis data: {str(e)}")
+            return None
+
 class SoliscloudAPI():
     """Class with functions for reading data from the Soliscloud Portal."""
 
@@ -337,77 +344,84 @@ class SolisData:
         
         return processed_df
 
-    async def get_solis_data(self) -> pd.DataFrame:
+    async def get_solis_data(self, session: Optional[ClientSession] = None) -> pd.DataFrame:
         """
         Get live PV generation data from Solis API for the last 7 days
+        :param session: aiohttp session to use, if None a new session is made for this call
         :return: DataFrame with timestamp and power_kw columns
         """
+        if session is not None:
+            return await self._get_solis_data(session)
+
         async with ClientSession() as websession:
-            soliscloud = SoliscloudAPI(self.domain, websession)
-            
-            inverter_list = await self.get_inverter_list(soliscloud)
-            if not inverter_list:
-                raise ValueError("No inverters found")
-
-            end_time = datetime.now(timezone.utc)
-            start_time = end_time - timedelta(days=7)
-            
-            data_list = []
-            
-            for inverter in inverter_list:
-                inverter_sn = inverter['sn']
-                for day in range(7):
-                    current_date = (end_time - timedelta(days=day)).strftime('%Y-%m-%d')
-                    try:
-                        inverter_day_data = await soliscloud.inverter_day(
-                            self.api_key,
-                            self.api_secret,
-                            currency='USD',
-                            time=current_date,
-                            time_zone=0,
-                            inverter_sn=inverter_sn
-                        )
-                        
-                        # Check if inverter_day_data is a list of dictionaries
-                        if isinstance(inverter_day_data, list) and all(isinstance(item, dict) for item in inverter_day_data):
-                            for data_point in inverter_day_data:
-                                timestamp = datetime.fromtimestamp(int(data_point['dataTimestamp']) / 1000, tz=timezone.utc)
-                                if start_time <= timestamp <= end_time:
-                                    data_list.append({
-                                        "timestamp": timestamp.strftime('%Y-%m-%d %H:%M:%S'),
-                                        "power_kw": float(data_point['pac']) / 1000,  # Convert W to kW
-                                        "inverter_sn": inverter_sn
-                                    })
-                        else:
-                            print(f"Unexpected data format for inverter {inverter_sn} on {current_date}")
-                            print(f"Received data: {inverter_day_data}")
+            return await self._get_solis_data(websession)
+
+    async def _get_solis_data(self, websession: ClientSession) -> pd.DataFrame:
+        soliscloud = SoliscloudAPI(self.domain, websession)
+        
+        inverter_list = await self.get_inverter_list(soliscloud)
+        if not inverter_list:
+            raise ValueError("No inverters found")
+
+        end_time = datetime.now(timezone.utc)
+        start_time = end_time - timedelta(days=7)
+        
+        data_list = []
+        
+        for inverter in inverter_list:
+            inverter_sn = inverter['sn']
+            for day in range(7):
+                current_date = (end_time - timedelta(days=day)).strftime('%Y-%m-%d')
+                try:
+                    inverter_day_data = await soliscloud.inverter_day(
+                        self.api_key,
+                        self.api_secret,
+                        currency='USD',
+                        time=current_date,
+                        time_zone=0,
+                        inverter_sn=inverter_sn
+                    )
                     
-                    except Exception as e:
-                        print(f"Error fetching data for inverter {inverter_sn} on {current_date}: {e}")
+                    # Check if inverter_day_data is a list of dictionaries
+                    if isinstance(inverter_day_data, list) and all(isinstance(item, dict) for item in inverter_day_data):
+                        for data_point in inverter_day_data:
+                            timestamp = datetime.fromtimestamp(int(data_point['dataTimestamp']) / 1000, tz=timezone.utc)
+                            if start_time <= timestamp <= end_time:
+                                data_list.append({
+                                    "timestamp": timestamp.strftime('%Y-%m-%d %H:%M:%S'),
+                                    "power_kw": float(data_point['pac']) / 1000,  # Convert W to kW
+                                    "inverter_sn": inverter_sn
+                                })
+                    else:
+                        print(f"Unexpected data format for inverter {inverter_sn} on {current_date}")
                         print(f"Received data: {inverter_day_data}")
-                    
-                    # Avoid rate limiting
-                    await asyncio.sleep(0.5)  # 2 times/sec limit
-            
-            # Convert the list to a DataFrame
-            live_generation_kw = pd.DataFrame(data_list)
-            
-            if live_generation_kw.empty:
-                return pd.DataFrame(columns=["timestamp", "power_kw"])
-
-            # Convert to datetime
-            live_generation_kw["timestamp"] = pd.to_datetime(live_generation_kw["timestamp"])
-            
-            # Sort by timestamp
-            live_generation_kw = live_generation_kw.sort_values("timestamp")
-            
-            # Process the data to match the desired format
-            processed_df = self.process_solis_data(live_generation_kw)
-            processed_df = processed_df.reset_index(drop=True)
-            
-            return processed_df
-
-
-async def get_solis_data(settings: SolisSettings):
+                
+                except Exception as e:
+                    print(f"Error fetching data for inverter {inverter_sn} on {current_date}: {e}")
+                    print(f"Received data: {inverter_day_data}")
+                
+                # Avoid rate limiting
+                await asyncio.sleep(0.5)  # 2 times/sec limit
+        
+        # Convert the list to a DataFrame
+        live_generation_kw = pd.DataFrame(data_list)
+        
+        if live_generation_kw.empty:
+            return pd.DataFrame(columns=["timestamp", "power_kw"])
+
+        # Convert to datetime
+        live_generation_kw["timestamp"] = pd.to_datetime(live_generation_kw["timestamp"])
+        
+        # Sort by timestamp
+        live_generation_kw = live_generation_kw.sort_values("timestamp")
+        
+        # Process the data to match the desired format
+        processed_df = self.process_solis_data(live_generation_kw)
+        processed_df = processed_df.reset_index(drop=True)
+        
+        return processed_df
+
+
+async def get_solis_data(settings: SolisSettings, session: Optional[ClientSession] = None):
     solis_data = SolisData(settings)
-    return await solis_data.get_solis_data()
+    return await solis_data.get_solis_data(session)
@@ -0,0 +1,323 @@
+"""
+In-process metrics of the forecasts
+
+The time of each stage of a forecast is recorded in a histogram, and the HTTP calls, bytes
+and cache hits in counters:
+
+- nwp_http, visibility_http: the Open-Meteo requests
+- inverter_fetch: getting the live data from the inverter
+- xarray: making the nwp and pv datasets
+- features: building the feature matrix of the xgb model
+- model_load: loading a model, once per process
+- model_predict: running the model
+- postprocess: formatting and scaling the predictions
+- run_forecast: the whole forecast
+
+The metrics are kept per process. `render_prometheus` gives them in the Prometheus text format,
+which the API serves on /metrics.
+
+When QUARTZ_SOLAR_FORECAST_METRICS_DIR is set, as `api/serve.py` does for its workers, each
+process also writes its metrics to a file in that directory every FLUSH_INTERVAL_S seconds, and
+`aggregate` adds up the files of all the processes, as the multiprocess mode of
+prometheus_client does. The files of the processes which have exited are kept, so the counters
+never go down.
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Tuple
+
+# histogram buckets, in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+PREFIX = "quartz_solar_forecast"
+
+# how often the metrics of a process are written to the metrics directory, in seconds
+FLUSH_INTERVAL_S = float(os.getenv("QUARTZ_SOLAR_FORECAST_METRICS_FLUSH_INTERVAL", 1))
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count of observed values"""
+
+    def __init__(self, buckets: Tuple[float, ...] = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimate a quantile from the buckets, as Prometheus' histogram_quantile does
+        """
+        if self.count == 0:
+            return float("nan")
+
+        rank = q * self.count
+        lower_bound, lower_count = 0.0, 0
+        for bound, count in zip(self.buckets, self.counts):
+            if count >= rank:
+                if count == lower_count:
+                    return bound
+                return lower_bound + (bound - lower_bound) * (rank - lower_count) / (
+                    count - lower_count
+                )
+            lower_bound, lower_count = bound, count
+
+        # in the +Inf bucket
+        return self.buckets[-1]
+
+
+class MetricsRegistry:
+    """
+    Counters and stage duration histograms, safe to update from many threads
+    """
+
+    def __init__(self):
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        self._lock = threading.Lock()
+        self._changed = False
+        self._flusher_pid: Optional[int] = None
+
+    def inc(self, name: str, value: float = 1, **labels: str) -> None:
+        """
+        Add to a counter
+
+        :param name: the name of the counter, e.g. "http_requests_total"
+        :param value: the amount to add
+        :param labels: the labels of the counter, e.g. kind="nwp"
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+            self._changed = True
+        self._start_flusher()
+
+    def observe(self, stage: str, seconds: float) -> None:
+        """
+        Record the duration of a stage
+
+        :param stage: the name of the stage, e.g. "nwp_http"
+        :param seconds: how long the stage took
+        """
+        key = ("stage_duration_seconds", (("stage", stage),))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+            self._changed = True
+        self._start_flusher()
+
+    @contextmanager
+    def timed(self, stage: str) -> Iterator[None]:
+        """
+        Time a block of code, or a function when used as a decorator, as a stage
+
+        The time is recorded even if the block raises.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def get_stats(self) -> Dict[str, dict]:
+        """
+        Get the count, mean, p50 and p99 duration of each stage, and the value of each counter
+
+        :return: dictionary with "stages", of stage name to statistics, and "counters", of
+            counter name and labels to value
+        """
+        with self._lock:
+            stages = {
+                dict(labels)["stage"]: {
+                    "count": histogram.count,
+                    "mean": histogram.sum / histogram.count,
+                    "p50": histogram.quantile(0.5),
+                    "p99": histogram.quantile(0.99),
+                }
+                for (_, labels), histogram in self._histograms.items()
+            }
+            counters = {
+                name + _format_labels(labels): value
+                for (name, labels), value in self._counters.items()
+            }
+        return {"stages": stages, "counters": counters}
+
+    def render_prometheus(self) -> str:
+        """
+        Get all the metrics in the Prometheus text exposition format
+        """
+        lines = []
+        with self._lock:
+            for name in sorted({name for name, _ in self._counters}):
+                lines.append(f"# TYPE {PREFIX}_{name} counter")
+                for (counter_name, labels), value in sorted(self._counters.items()):
+                    if counter_name == name:
+                        lines.append(f"{PREFIX}_{name}{_format_labels(labels)} {value}")
+
+            for name in sorted({name for name, _ in self._histograms}):
+                lines.append(f"# TYPE {PREFIX}_{name} histogram")
+                for (histogram_name, labels), histogram in sorted(self._histograms.items()):
+                    if histogram_name != name:
+                        continue
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        bucket_labels = labels + (("le", str(bound)),)
+                        lines.append(f"{PREFIX}_{name}_bucket{_format_labels(bucket_labels)} {count}")
+                    bucket_labels = labels + (("le", "+Inf"),)
+                    lines.append(
+                        f"{PREFIX}_{name}_bucket{_format_labels(bucket_labels)} {histogram.count}"
+                    )
+                    lines.append(f"{PREFIX}_{name}_sum{_format_labels(labels)} {histogram.sum}")
+                    lines.append(f"{PREFIX}_{name}_count{_format_labels(labels)} {histogram.count}")
+
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        """
+        Remove all the metrics
+        """
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def snapshot(self) -> dict:
+        """
+        Get all the metrics as a json-serializable dictionary, see `merge`
+        """
+        with self._lock:
+            return {
+                "counters": [
+                    [name, list(labels), value] for (name, labels), value in self._counters.items()
+                ],
+                "histograms": [
+                    [name, list(labels), list(h.buckets), h.counts, h.sum, h.count]
+                    for (name, labels), h in self._histograms.items()
+                ],
+            }
+
+    def merge(self, snapshot: dict) -> None:
+        """
+        Add the metrics of a snapshot, e.g. of another process, to these
+        """
+        with self._lock:
+            for name, labels, value in snapshot["counters"]:
+                key = (name, tuple(tuple(label) for label in labels))
+                self._counters[key] = self._counters.get(key, 0) + value
+            for name, labels, buckets, counts, total, count in snapshot["histograms"]:
+                key = (name, tuple(tuple(label) for label in labels))
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    histogram = self._histograms[key] = Histogram(tuple(buckets))
+                histogram.counts = [a + b for a, b in zip(histogram.counts, counts)]
+                histogram.sum += total
+                histogram.count += count
+
+    def write_snapshot(self, directory: str, name: Optional[str] = None) -> None:
+        """
+        Write the metrics to a file in a directory, replacing the last one of this process
+
+        :param directory: the metrics directory
+        :param name: the name of the file, defaults to the pid of the process
+        """
+        self._changed = False
+        path = os.path.join(directory, f"{name or os.getpid()}.json")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp_path, path)
+
+    def aggregate(self, directory: Optional[str] = None) -> "MetricsRegistry":
+        """
+        Get the metrics of all the processes writing to a metrics directory
+
+        :param directory: the metrics directory, defaults to QUARTZ_SOLAR_FORECAST_METRICS_DIR
+        :return: these metrics if there is no directory, or else a new registry with the sum of
+            the metrics of this process and the files of the other processes
+        """
+        directory = directory or metrics_dir()
+        if directory is None:
+            return self
+
+        total = MetricsRegistry()
+        total.merge(self.snapshot())
+        own_file = f"{os.getpid()}.json"
+        for file_name in sorted(os.listdir(directory)):
+            if not file_name.endswith(".json") or file_name == own_file:
+                continue
+            try:
+                with open(os.path.join(directory, file_name)) as f:
+                    total.merge(json.load(f))
+            except (OSError, ValueError):
+                # e.g. removed while listing
+                continue
+        return total
+
+    def _start_flusher(self) -> None:
+        """Start writing the metrics of this process to the metrics directory, if there is one"""
+        if self._flusher_pid == os.getpid():
+            return
+        directory = metrics_dir()
+        if directory is None:
+            return
+
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+
+        def flush():
+            while True:
+                time.sleep(FLUSH_INTERVAL_S)
+                if self._changed:
+                    try:
+                        self.write_snapshot(directory)
+                    except OSError:
+                        pass
+
+        threading.Thread(target=flush, name="quartz-metrics", daemon=True).start()
+
+    def _after_fork(self) -> None:
+        """
+        Start again in a forked process
+
+        The lock may have been held by a thread of the parent. With a metrics directory, the
+        metrics of the parent are in its own file, so they are not counted again.
+        """
+        self._lock = threading.Lock()
+        if metrics_dir() is not None:
+            self.reset()
+        self._changed = False
+
+
+def metrics_dir() -> Optional[str]:
+    """Get the directory the processes write their metrics to, or None"""
+    return os.getenv("QUARTZ_SOLAR_FORECAST_METRICS_DIR") or None
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+# the registry of this process
+metrics = MetricsRegistry()
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=metrics._after_fork)
+
+inc = metrics.inc
+observe = metrics.observe
+timed = metrics.timed
@@ -0,0 +1,230 @@
+"""
+Local store of NWP data
+
+The hourly NWP data is kept on disk, per nwp source, model run and grid cell:
+
+    <path>/<nwp_source>/<run init time>/<latitude>_<longitude>.npy
+    <path>/<nwp_source>/<run init time>/<latitude>_<longitude>.time.npy
+
+Each cell holds a float32 array of shape (variables, times), so each variable is stored
+contiguously, and the times as int64 seconds since the epoch. Arrays are read memory-mapped,
+so a read only touches the rows it needs. Writing to a cell adds its times to the ones already
+stored.
+
+New runs are added as new directories, without rewriting the old ones, and runs which have not
+been written to for the retention period are removed when a new run is written.
+
+The store is used by `get_nwp` when the QUARTZ_SOLAR_FORECAST_NWP_STORE environment variable is
+set to a directory, or after `set_nwp_store` is called.
+"""
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+log = logging.getLogger(__name__)
+
+RUN_FORMAT = "%Y%m%dT%H%M"
+DEFAULT_RETENTION_DAYS = int(os.getenv("QUARTZ_SOLAR_FORECAST_NWP_STORE_RETENTION_DAYS", 30))
+
+
+def _to_utc(time: datetime) -> datetime:
+    time = pd.Timestamp(time)
+    if time.tzinfo is None:
+        return time.tz_localize("UTC").to_pydatetime()
+    return time.tz_convert("UTC").to_pydatetime()
+
+
+class NwpStore:
+    """
+    NWP data on disk, keyed by nwp source, model run and grid cell
+    """
+
+    def __init__(self, path: str, retention: timedelta = timedelta(days=DEFAULT_RETENTION_DAYS)):
+        """
+        :param path: the directory of the store, it is made if it does not exist
+        :param retention: how long to keep each model run for, after it was last written to
+        """
+        self.path = path
+        self.retention = retention
+        self._lock = threading.Lock()
+
+        os.makedirs(path, exist_ok=True)
+
+    def _run_dir(self, nwp_source: str, run: datetime) -> str:
+        return os.path.join(self.path, nwp_source, _to_utc(run).strftime(RUN_FORMAT))
+
+    @staticmethod
+    def _cell_name(location: Tuple[float, float]) -> str:
+        latitude, longitude = location
+        return f"{latitude:.6f}_{longitude:.6f}"
+
+    def runs(self, nwp_source: str) -> List[datetime]:
+        """
+        Get the init times of the runs in the store for a source, oldest first
+        """
+        source_dir = os.path.join(self.path, nwp_source)
+        if not os.path.isdir(source_dir):
+            return []
+
+        runs = []
+        for name in os.listdir(source_dir):
+            try:
+                runs.append(datetime.strptime(name, RUN_FORMAT).replace(tzinfo=timezone.utc))
+            except ValueError:
+                continue
+        return sorted(runs)
+
+    def write(
+        self,
+        nwp_source: str,
+        run: datetime,
+        location: Tuple[float, float],
+        times: pd.DatetimeIndex,
+        values: np.ndarray,
+    ) -> None:
+        """
+        Add the data of one grid cell for a model run
+
+        The times are merged with the ones already stored for this cell and run, and the new
+        values replace the stored ones at the same times.
+
+        :param nwp_source: the nwp source, e.g. "icon"
+        :param run: the init time of the model run
+        :param location: the (latitude, longitude) of the grid cell
+        :param times: the hourly times of the data
+        :param values: array of shape (times, variables)
+        """
+        run_dir = self._run_dir(nwp_source, run)
+        new_run = not os.path.isdir(run_dir)
+        os.makedirs(run_dir, exist_ok=True)
+
+        cell = os.path.join(run_dir, self._cell_name(location))
+        seconds = times.values.astype("datetime64[s]").astype(np.int64)
+        columns = np.ascontiguousarray(np.asarray(values, dtype=np.float32).T)
+
+        with self._lock:
+            try:
+                stored_seconds = np.load(cell + ".time.npy")
+                stored_columns = np.load(cell + ".npy")
+            except (FileNotFoundError, ValueError):
+                stored_seconds = None
+
+            if stored_seconds is not None and len(stored_columns) == len(columns):
+                merged_seconds = np.union1d(stored_seconds, seconds)
+                merged = np.full((len(columns), len(merged_seconds)), np.nan, dtype=np.float32)
+                merged[:, np.searchsorted(merged_seconds, stored_seconds)] = stored_columns
+                merged[:, np.searchsorted(merged_seconds, seconds)] = columns
+                seconds, columns = merged_seconds, merged
+
+            # write to temporary files first, so readers never see a partly written cell
+            for suffix, array in [(".time.npy", seconds), (".npy", columns)]:
+                with tempfile.NamedTemporaryFile(dir=run_dir, suffix=".tmp", delete=False) as f:
+                    np.save(f, array)
+                os.replace(f.name, cell + suffix)
+
+        if new_run:
+            self.prune()
+
+    def read(
+        self,
+        nwp_source: str,
+        run: datetime,
+        location: Tuple[float, float],
+        start: datetime,
+        end: datetime,
+    ) -> Optional[np.ndarray]:
+        """
+        Read the data of one grid cell for a model run
+
+        :param nwp_source: the nwp source, e.g. "icon"
+        :param run: the init time of the model run
+        :param location: the (latitude, longitude) of the grid cell
+        :param start: the first time to read
+        :param end: the last time to read, included
+        :return: float64 array of shape (times, variables), the same type as the data from
+            Open-Meteo is kept in, or None if the store does not have all the hours from start
+            to end
+        """
+        cell = os.path.join(self._run_dir(nwp_source, run), self._cell_name(location))
+
+        try:
+            seconds = np.load(cell + ".time.npy", mmap_mode="r")
+            columns = np.load(cell + ".npy", mmap_mode="r")
+        except (FileNotFoundError, ValueError):
+            return None
+
+        start_s = pd.Timestamp(start).to_datetime64().astype("datetime64[s]").astype(np.int64)
+        end_s = pd.Timestamp(end).to_datetime64().astype("datetime64[s]").astype(np.int64)
+        i_start, i_end = np.searchsorted(seconds, [start_s, end_s])
+        if i_end >= len(seconds) or seconds[i_start] != start_s or seconds[i_end] != end_s:
+            return None
+        # merged writes can leave gaps between the stored times
+        if seconds[i_end] - seconds[i_start] != (i_end - i_start) * 3600:
+            return None
+
+        return columns[:, i_start:i_end + 1].T.astype(np.float64)
+
+    def prune(self, now: Optional[datetime] = None) -> None:
+        """
+        Remove the model runs which have not been written to for the retention period
+
+        Runs are pruned by when they were written rather than by their init time, as data for
+        past days is kept under the run it came from, see `quartz_solar_forecast.data`.
+
+        :param now: the current time, defaults to now
+        """
+        if now is None:
+            now = datetime.now(timezone.utc)
+        cutoff = _to_utc(now) - self.retention
+
+        with self._lock:
+            for nwp_source in os.listdir(self.path):
+                for run in self.runs(nwp_source):
+                    run_dir = self._run_dir(nwp_source, run)
+                    try:
+                        written = datetime.fromtimestamp(os.path.getmtime(run_dir), timezone.utc)
+                    except FileNotFoundError:
+                        continue
+                    if written < cutoff:
+                        log.info(f"Removing {nwp_source} run {run} from the nwp store")
+                        shutil.rmtree(run_dir, ignore_errors=True)
+
+
+_store: Optional[NwpStore] = None
+_store_configured = False
+
+
+def get_nwp_store() -> Optional[NwpStore]:
+    """
+    Get the NWP store used by `get_nwp`
+
+    :return: the store, or None if there is no store configured
+    """
+    global _store, _store_configured
+
+    if not _store_configured:
+        path = os.getenv("QUARTZ_SOLAR_FORECAST_NWP_STORE")
+        if path:
+            _store = NwpStore(path)
+        _store_configured = True
+
+    return _store
+
+
+def set_nwp_store(store: Optional[NwpStore]) -> None:
+    """
+    Set the NWP store used by `get_nwp`
+
+    :param store: the store, or None to stop using a store
+    """
+    global _store, _store_configured
+
+    _store = store
+    _store_configured = True
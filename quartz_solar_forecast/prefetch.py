@@ -0,0 +1,170 @@
+"""
+Prefetch the NWP data of known sites when new model runs are published
+
+When the NwpPrefetcher is running, the weather of its sites is fetched into the local nwp store
+as soon as each new run is available, so `get_nwp` for those sites is a local read rather than
+a request to Open-Meteo.
+
+Times are naive UTC, as the API uses, so the prefetched days are the ones the forecasts read.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+import pandas as pd
+
+from quartz_solar_forecast.data import MAX_LOCATIONS_PER_REQUEST, get_nwp_batch, get_nwp_store
+from quartz_solar_forecast.nwp_store import NwpStore
+from quartz_solar_forecast.pydantic_models import PVSite
+from quartz_solar_forecast.weather.client import latest_run
+
+log = logging.getLogger(__name__)
+
+
+class NwpPrefetcher:
+    """
+    Fetch the weather of a list of sites into the nwp store whenever a new run is available
+    """
+
+    def __init__(
+        self,
+        sites: Union[List[PVSite], pd.DataFrame],
+        nwp_sources: Iterable[str] = ("icon",),
+        max_workers: int = 4,
+        chunk_size: int = MAX_LOCATIONS_PER_REQUEST,
+        poll_interval_s: float = 60,
+        store: Optional[NwpStore] = None,
+        snap_to_grid: bool = False,
+    ):
+        """
+        :param sites: the PV sites, or a dataframe with latitude and longitude columns
+        :param nwp_sources: the nwp sources to prefetch
+        :param max_workers: the maximum number of requests to Open-Meteo at once
+        :param chunk_size: the maximum number of sites in one request
+        :param poll_interval_s: how often the background thread checks for new runs
+        :param store: the nwp store, defaults to the one used by `get_nwp`
+        :param snap_to_grid: whether the sites are snapped to a grid, see `get_nwp_batch`. This
+            must be the same as for the forecasts that read the store, e.g. False for `get_nwp`
+            and the default `run_forecast_batch`, or they do not find the prefetched data
+        """
+        if isinstance(sites, pd.DataFrame):
+            sites = [
+                PVSite(latitude=latitude, longitude=longitude, capacity_kwp=1)
+                for latitude, longitude in zip(sites["latitude"], sites["longitude"])
+            ]
+
+        store = store or get_nwp_store()
+        if store is None:
+            raise ValueError(
+                "The prefetcher needs a local nwp store, "
+                "set QUARTZ_SOLAR_FORECAST_NWP_STORE or call set_nwp_store"
+            )
+        if store is not get_nwp_store():
+            log.warning("The prefetcher store is not the store used by get_nwp")
+
+        # only the location matters for the weather
+        locations = {(site.latitude, site.longitude): site for site in sites}
+        self.sites = list(locations.values())
+        self.nwp_sources = list(nwp_sources)
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.poll_interval_s = poll_interval_s
+        self.store = store
+        self.snap_to_grid = snap_to_grid
+
+        # the latest run and day prefetched for each nwp source
+        self._prefetched: Dict[str, Tuple[datetime, date]] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def prefetch(self, nwp_source: str, ts: Optional[datetime] = None) -> None:
+        """
+        Fetch the weather of all the sites for one nwp source
+
+        :param nwp_source: the nwp source, e.g. "icon"
+        :param ts: the forecast time, in UTC, defaults to now. The weather is fetched for the
+            same days as `get_nwp` would for this time
+        """
+        if ts is None:
+            ts = _utc_now()
+
+        chunks = [
+            self.sites[i:i + self.chunk_size] for i in range(0, len(self.sites), self.chunk_size)
+        ]
+        log.info(f"Prefetching {nwp_source} nwp data for {len(self.sites)} sites")
+
+        # the sites are fetched at the locations the forecasts read from the store
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [
+                executor.submit(
+                    get_nwp_batch,
+                    chunk,
+                    ts,
+                    nwp_source,
+                    self.chunk_size,
+                    snap_to_grid=self.snap_to_grid,
+                )
+                for chunk in chunks
+            ]
+            for future in futures:
+                try:
+                    future.result()
+                except Exception as e:
+                    log.error(f"Failed to prefetch {nwp_source} nwp data: {e}")
+
+    def run_pending(self, now: Optional[datetime] = None) -> List[str]:
+        """
+        Prefetch the nwp sources which have a new run, or a new day, since the last prefetch
+
+        :param now: the current time, in UTC, defaults to now
+        :return: the nwp sources which were prefetched
+        """
+        if now is None:
+            now = _utc_now()
+
+        prefetched = []
+        for nwp_source in self.nwp_sources:
+            key = (latest_run(nwp_source, now), now.date())
+            if self._prefetched.get(nwp_source) == key:
+                continue
+
+            self.prefetch(nwp_source, now)
+            self._prefetched[nwp_source] = key
+            prefetched.append(nwp_source)
+
+        return prefetched
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.run_pending()
+            except Exception as e:
+                log.error(f"Error in the nwp prefetcher: {e}")
+            self._stop.wait(self.poll_interval_s)
+
+    def start(self) -> None:
+        """
+        Start prefetching in a background thread
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="nwp-prefetcher", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop the background thread
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+def _utc_now() -> datetime:
+    # naive, as the timestamps of the API
+    return datetime.now(timezone.utc).replace(tzinfo=None)
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import Annotated, List, Literal, Optional
 
 from quartz_solar_forecast.inverters.enphase import EnphaseInverter, EnphaseSettings
 from quartz_solar_forecast.inverters.givenergy import GivEnergySettings, GivEnergyInverter
@@ -59,5 +59,32 @@ class ForecastRequest(BaseModel):
     site: PVSite
     timestamp: Optional[str] = None
 
+class ForecastsRequest(BaseModel):
+    sites: Optional[List[PVSite]] = Field(default=None, description="the PV sites")
+    site_file: Optional[str] = Field(
+        default=None, description="the id of an uploaded csv file of sites, instead of sites"
+    )
+    timestamp: Optional[str] = None
+
+class SweepRequest(BaseModel):
+    site: PVSite
+    tilts: Optional[List[Annotated[float, Field(ge=0, le=90)]]] = Field(
+        default=None,
+        min_length=1,
+        description="the tilts to try [degrees], defaults to the tilt of the site",
+    )
+    orientations: Optional[List[Annotated[float, Field(ge=0, le=360)]]] = Field(
+        default=None,
+        min_length=1,
+        description="the orientations to try [degrees], defaults to the orientation of the site",
+    )
+    capacities_kwp: Optional[List[Annotated[float, Field(ge=0)]]] = Field(
+        default=None,
+        min_length=1,
+        description="the capacities to try [kwp], defaults to the capacity of the site",
+    )
+    model: Literal["gb", "xgb"] = Field(default="gb", description="the model, either gb or xgb")
+    timestamp: Optional[str] = None
+
 class TokenRequest(BaseModel):
     redirect_url: str
\ No newline at end of file
@@ -1,6 +1,7 @@
 import os
 import pandas as pd
-from datetime import datetime, timedelta
+from datetime import datetime
+from quartz_solar_forecast.backtest import run_backtest
 from quartz_solar_forecast.forecast import run_forecast
 from quartz_solar_forecast.pydantic_models import PVSite
 
@@ -12,19 +13,20 @@ def generate_all_forecasts(
     latitude: float,
     longitude: float,
     capacity_kwp: float,
+    output_file: str = None,
 ) -> pd.DataFrame:
+    """
+    Generates forecasts for every init time from start to end, every init_time_freq hours.
 
-    all_forecasts = pd.DataFrame()
+    If output_file is given, the forecasts are written to it as they are made, and nothing is
+    returned.
+    """
 
-    init_time = start
-    while init_time <= end:
-        print(f"Running forecast for initialization time: {init_time}")
-        predictions_df = forecast_for_site(
-            latitude, longitude, capacity_kwp, init_time=init_time
-        )
-        predictions_df["forecast_init_time"] = init_time
-        all_forecasts = pd.concat([all_forecasts, predictions_df])
-        init_time += timedelta(hours=init_time_freq)
+    # the weather for all the init times is fetched once, and the model is run in batches
+    site = PVSite(latitude=latitude, longitude=longitude, capacity_kwp=capacity_kwp)
+    all_forecasts = run_backtest(
+        site, start, end, freq=pd.Timedelta(hours=init_time_freq), output_file=output_file
+    )
 
     return all_forecasts
 
@@ -69,15 +71,13 @@ def write_out_forecasts(
     start_date = start.date()
     end = datetime.strptime(end_datetime, "%Y-%m-%d %H:%M:%S")
     end_date = end.date()
-    all_forecasts = generate_all_forecasts(
-        init_time_freq, start, end, latitude, longitude, capacity_kwp
-    )
 
     output_dir = os.path.join(os.getcwd(), "csv_forecasts")
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
     output_file_name = f"forecast_{site_name}_{start_date}_{end_date}.csv"
     output_file_path = os.path.join(output_dir, output_file_name)
-    all_forecasts.to_csv(output_file_path, index=False)
+    generate_all_forecasts(
+        init_time_freq, start, end, latitude, longitude, capacity_kwp, output_file=output_file_path
+    )
     print(f"Forecasts saved to {output_file_path}")
-
@@ -0,0 +1,420 @@
+"""
+Shared HTTP client for the Open-Meteo API
+
+All the weather requests go through one cached, connection-pooled session, so TCP/TLS
+connections are kept alive between calls and the sqlite cache is only opened once per process.
+
+A cached response expires when the next run of the NWP model it came from is available on
+Open-Meteo. Repeated forecasts then use the cache until there is new data, and each new run is
+fetched once.
+
+There is also a shared aiohttp session, for the async forecasts. Its responses are kept in
+memory, keyed by url and parameters, with the same expiry.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, List, NamedTuple, Optional, Tuple
+from urllib.parse import parse_qs, urlencode, urlparse
+
+import aiohttp
+import openmeteo_requests
+import requests_cache
+from openmeteo_requests.Client import OpenMeteoRequestsError
+from openmeteo_sdk.WeatherApiResponse import WeatherApiResponse
+from requests.adapters import HTTPAdapter
+from urllib3 import Retry
+
+from quartz_solar_forecast.metrics import inc
+
+log = logging.getLogger(__name__)
+
+CACHE_NAME = ".cache"
+RETRIES = 5
+BACKOFF_FACTOR = 0.2
+# the responses with these statuses are retried, 429 and 503 after the Retry-After header if any
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# how often the expired responses are deleted from the sqlite cache, in seconds
+PURGE_INTERVAL_S = float(os.getenv("QUARTZ_SOLAR_FORECAST_CACHE_PURGE_INTERVAL", 3600))
+POOL_SIZE = int(os.getenv("QUARTZ_SOLAR_FORECAST_HTTP_POOL_SIZE", 32))
+# the number of responses of the async requests kept in memory
+ASYNC_CACHE_SIZE = int(os.getenv("QUARTZ_SOLAR_FORECAST_ASYNC_CACHE_SIZE", 256))
+
+OPEN_METEO_URL = "https://api.open-meteo.com"
+OPEN_METEO_ARCHIVE_URL = "https://archive-api.open-meteo.com"
+
+
+class RunSchedule(NamedTuple):
+    """How often a model is run, and how long after the run time the data is available"""
+
+    cadence: timedelta
+    delay: timedelta
+
+
+# approximate update schedules of the data behind each Open-Meteo endpoint
+NWP_RUN_SCHEDULE = {
+    # the seamless ICON model includes ICON-D2 and ICON-EU, which run every 3 hours
+    "icon": RunSchedule(cadence=timedelta(hours=3), delay=timedelta(hours=2)),
+    "gfs": RunSchedule(cadence=timedelta(hours=6), delay=timedelta(hours=4)),
+    # the seamless UKMO model includes the UK 2km model, which runs every hour
+    "ukmo": RunSchedule(cadence=timedelta(hours=1), delay=timedelta(hours=1)),
+    # the default forecast API mixes the best models for each location
+    "best_match": RunSchedule(cadence=timedelta(hours=1), delay=timedelta(hours=1)),
+    # the reanalysis data is updated daily
+    "archive": RunSchedule(cadence=timedelta(days=1), delay=timedelta(0)),
+}
+
+
+def open_meteo_url(archive: bool = False) -> str:
+    """
+    Get the base url of the Open-Meteo API
+
+    The url is set with QUARTZ_SOLAR_FORECAST_OPEN_METEO_URL, e.g. to use a self-hosted
+    Open-Meteo server or a fake one, and the url of the Historical Weather API with
+    QUARTZ_SOLAR_FORECAST_OPEN_METEO_ARCHIVE_URL. If only the first is set, it is used for both,
+    as a self-hosted server has all the endpoints.
+
+    :param archive: if True, get the url of the Historical Weather API
+    :return: the url, without a trailing slash, e.g. "https://api.open-meteo.com"
+    """
+    url = os.getenv("QUARTZ_SOLAR_FORECAST_OPEN_METEO_URL")
+    if archive:
+        archive_url = os.getenv("QUARTZ_SOLAR_FORECAST_OPEN_METEO_ARCHIVE_URL")
+        url = archive_url or url or OPEN_METEO_ARCHIVE_URL
+    return (url or OPEN_METEO_URL).rstrip("/")
+
+
+def get_nwp_schedule_name(url: str, params: Optional[dict] = None) -> str:
+    """
+    Get which model an Open-Meteo request is for, from its url and parameters
+
+    :param url: the request url, which may include a query string
+    :param params: the request parameters
+    :return: the name of the schedule in NWP_RUN_SCHEDULE
+    """
+    parsed = urlparse(url)
+    endpoint = parsed.path.rstrip("/").split("/")[-1]
+    if parsed.netloc.startswith("archive-api") or endpoint == "archive":
+        return "archive"
+
+    if endpoint == "dwd-icon":
+        return "icon"
+    if endpoint == "gfs":
+        return "gfs"
+
+    models = parse_qs(parsed.query).get("models", [])
+    if params is not None and "models" in params:
+        models.append(str(params["models"]))
+    if any("ukmo" in model for model in models):
+        return "ukmo"
+
+    return "best_match"
+
+
+def latest_run(name: str, now: Optional[datetime] = None) -> datetime:
+    """
+    Get the init time of the latest run of a model that has been published
+
+    :param name: the name of the schedule in NWP_RUN_SCHEDULE, e.g. "icon"
+    :param now: the current time, defaults to now in UTC
+    :return: the init time of the run, in UTC
+    """
+    if now is None:
+        now = datetime.now(timezone.utc)
+    elif now.tzinfo is None:
+        now = now.replace(tzinfo=timezone.utc)
+
+    schedule = NWP_RUN_SCHEDULE[name]
+
+    epoch = datetime(1970, 1, 1, tzinfo=timezone.utc)
+    return epoch + ((now - schedule.delay - epoch) // schedule.cadence) * schedule.cadence
+
+
+def next_run(name: str, now: Optional[datetime] = None) -> datetime:
+    """
+    Get the time when the next run of a model is available
+
+    :param name: the name of the schedule in NWP_RUN_SCHEDULE, e.g. "icon"
+    :param now: the current time, defaults to now in UTC
+    :return: time, in UTC, at which data from the latest run is out of date
+    """
+    schedule = NWP_RUN_SCHEDULE[name]
+
+    # the run after the latest one that has been published
+    return latest_run(name, now) + schedule.cadence + schedule.delay
+
+
+def next_run_available(
+    url: str, params: Optional[dict] = None, now: Optional[datetime] = None
+) -> datetime:
+    """
+    Get the time when the next run of the model behind a request is available
+
+    :param url: the request url
+    :param params: the request parameters
+    :param now: the current time, defaults to now in UTC
+    :return: time, in UTC, at which the cached response should expire
+    """
+    return next_run(get_nwp_schedule_name(url, params), now)
+
+
+class OpenMeteoSession(requests_cache.CachedSession):
+    """
+    Cached session where each response expires when the next NWP run is available
+
+    The expired responses are not replaced, as the url of each run is different, so they are
+    deleted from the cache every PURGE_INTERVAL_S seconds.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._purge_lock = threading.Lock()
+        self._last_purge = time.monotonic()
+
+    def purge_expired(self) -> None:
+        """Delete the expired responses from the cache"""
+        self.cache.delete(expired=True)
+
+    def _purge_if_due(self) -> None:
+        if time.monotonic() - self._last_purge < PURGE_INTERVAL_S:
+            return
+        # only one thread purges, the others go on with their requests
+        if not self._purge_lock.acquire(blocking=False):
+            return
+        try:
+            self._last_purge = time.monotonic()
+            self.purge_expired()
+        except Exception as e:
+            log.warning(f"Could not delete the expired responses from the cache: {e}")
+        finally:
+            self._purge_lock.release()
+
+    def request(self, method: str, url: str, *args, expire_after: Any = None, **kwargs):
+        self._purge_if_due()
+        if expire_after is None:
+            expire_after = next_run_available(url, kwargs.get("params"))
+        response = super().request(method, url, *args, expire_after=expire_after, **kwargs)
+
+        host = urlparse(url).netloc
+        if getattr(response, "from_cache", False):
+            inc("cache_hits_total", cache="http")
+        else:
+            inc("cache_misses_total", cache="http")
+            inc("http_requests_total", host=host)
+            inc("http_response_bytes_total", len(response.content), host=host)
+
+        return response
+
+
+_session: Optional[OpenMeteoSession] = None
+_client: Optional[openmeteo_requests.Client] = None
+_lock = threading.Lock()
+
+
+def get_session() -> OpenMeteoSession:
+    """
+    Get the session shared by all the weather requests in this process
+
+    Failed requests are retried, and the connection pool is large enough for concurrent
+    forecasts to keep their connections open.
+    """
+    global _session
+
+    with _lock:
+        if _session is None:
+            session = OpenMeteoSession(CACHE_NAME)
+
+            retries = Retry(
+                total=RETRIES,
+                read=RETRIES,
+                connect=RETRIES,
+                backoff_factor=BACKOFF_FACTOR,
+                status_forcelist=RETRY_STATUSES,
+                allowed_methods=None,
+            )
+            adapter = HTTPAdapter(
+                max_retries=retries, pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE
+            )
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+
+            _session = session
+
+    return _session
+
+
+def _shared_cache_disabled() -> bool:
+    """
+    Check if the cache of the shared session is disabled, without making the session
+
+    Making the session opens its sqlite cache, which would block the event loop of the async
+    requests. A session which is not made yet cannot have its cache disabled.
+    """
+    session = _session
+    return session is not None and session.settings.disabled
+
+
+def get_openmeteo_client() -> openmeteo_requests.Client:
+    """
+    Get the Open-Meteo client shared by all the weather requests in this process
+
+    The client closes its session when it is deleted, so one client is kept for the process
+    rather than one per request.
+    """
+    global _client
+
+    session = get_session()
+    with _lock:
+        if _client is None:
+            _client = openmeteo_requests.Client(session=session)
+
+    return _client
+
+
+_async_session: Optional[aiohttp.ClientSession] = None
+_async_session_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+async def get_async_session() -> aiohttp.ClientSession:
+    """
+    Get the aiohttp session shared by the async weather and inverter requests
+
+    An aiohttp session belongs to one event loop, so a new session is made if the loop changes,
+    and the old one is closed.
+    """
+    global _async_session, _async_session_loop
+
+    loop = asyncio.get_running_loop()
+    if _async_session is None or _async_session.closed or _async_session_loop is not loop:
+        if _async_session is not None and not _async_session.closed:
+            if _async_session_loop.is_running():
+                # the old loop runs in another thread, the session is closed there
+                asyncio.run_coroutine_threadsafe(_async_session.close(), _async_session_loop)
+            else:
+                await _async_session.close()
+
+        _async_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=POOL_SIZE),
+            timeout=aiohttp.ClientTimeout(total=60),
+        )
+        _async_session_loop = loop
+
+    return _async_session
+
+
+async def close_async_session() -> None:
+    """
+    Close the shared aiohttp session, e.g. when the API shuts down
+    """
+    global _async_session
+
+    if _async_session is not None and not _async_session.closed:
+        await _async_session.close()
+    _async_session = None
+
+
+def decode_weather_api(data: bytes) -> List[WeatherApiResponse]:
+    """
+    Decode the flatbuffers body of an Open-Meteo response, which has one message per location
+    """
+    messages = []
+    pos = 0
+    while pos < len(data):
+        length = int.from_bytes(data[pos:pos + 4], byteorder="little")
+        messages.append(WeatherApiResponse.GetRootAs(data, pos + 4))
+        pos += length + 4
+    return messages
+
+
+# url with parameters -> (expiry time, response body), least recently used first
+_async_cache: "OrderedDict[str, Tuple[datetime, bytes]]" = OrderedDict()
+_async_cache_lock = threading.Lock()
+
+
+def _get_async_cache(key: str) -> Optional[bytes]:
+    now = datetime.now(timezone.utc)
+    with _async_cache_lock:
+        entry = _async_cache.get(key)
+        if entry is None or entry[0] <= now:
+            return None
+        _async_cache.move_to_end(key)
+        return entry[1]
+
+
+def _put_async_cache(key: str, data: bytes, expires_at: datetime) -> None:
+    now = datetime.now(timezone.utc)
+    with _async_cache_lock:
+        _async_cache[key] = (expires_at, data)
+        _async_cache.move_to_end(key)
+
+        # remove the expired responses, then the least recently used ones
+        for expired in [cached for cached, (expiry, _) in _async_cache.items() if expiry <= now]:
+            del _async_cache[expired]
+        while len(_async_cache) > ASYNC_CACHE_SIZE:
+            _async_cache.popitem(last=False)
+
+
+def clear_async_cache() -> None:
+    """
+    Remove all the responses cached by `weather_api_async`
+    """
+    with _async_cache_lock:
+        _async_cache.clear()
+
+
+async def weather_api_async(
+    session: aiohttp.ClientSession, url: str, params: dict
+) -> List[WeatherApiResponse]:
+    """
+    Get weather data from Open-Meteo on an aiohttp session
+
+    This does the same as `openmeteo_requests.Client.weather_api`, including the retries of
+    the shared session. Responses are cached in memory until the next NWP run is available,
+    as `OpenMeteoSession` does, and not while the cache of the shared session is disabled.
+
+    :param session: the aiohttp session
+    :param url: the url of the API
+    :param params: the request parameters. Lists are sent as repeated parameters
+    :return: one response per location
+    """
+    query = [("format", "flatbuffers")]
+    for key, value in params.items():
+        for item in value if isinstance(value, list) else [value]:
+            query.append((key, str(item)))
+
+    use_cache = not _shared_cache_disabled()
+    cache_key = f"{url}?{urlencode(sorted(query))}"
+    if use_cache:
+        data = _get_async_cache(cache_key)
+        if data is not None:
+            inc("cache_hits_total", cache="http")
+            return decode_weather_api(data)
+        inc("cache_misses_total", cache="http")
+
+    for attempt in range(RETRIES + 1):
+        delay = BACKOFF_FACTOR * 2**attempt
+        try:
+            async with session.get(url, params=query) as response:
+                host = urlparse(url).netloc
+                inc("http_requests_total", host=host)
+                if response.status not in RETRY_STATUSES or attempt == RETRIES:
+                    if response.status in [400, 429]:
+                        raise OpenMeteoRequestsError(await response.json())
+                    response.raise_for_status()
+                    data = await response.read()
+                    inc("http_response_bytes_total", len(data), host=host)
+                    if use_cache:
+                        _put_async_cache(cache_key, data, next_run_available(url, params))
+                    return decode_weather_api(data)
+
+                retry_after = response.headers.get("Retry-After", "")
+                if retry_after.isdigit():
+                    delay = max(delay, float(retry_after))
+        except aiohttp.ClientConnectionError:
+            if attempt == RETRIES:
+                raise
+        await asyncio.sleep(delay)
@@ -1,11 +1,12 @@
 from datetime import datetime
 from typing import List
 
-import openmeteo_requests
 import pandas as pd
 import requests
-import requests_cache
-from retry_requests import retry
+
+from quartz_solar_forecast.metrics import timed
+
+from .client import get_openmeteo_client, open_meteo_url
 
 
 class WeatherService:
@@ -46,7 +47,8 @@ class WeatherService:
         str
             The URL for the OpenMeteo API.
         """
-        url = "https://api.open-meteo.com/v1/forecast?latitude={latitude}&longitude={longitude}&hourly={variables}&start_date={start_date}&end_date={end_date}&timezone=GMT".format(
+        url = "{base_url}/v1/forecast?latitude={latitude}&longitude={longitude}&hourly={variables}&start_date={start_date}&end_date={end_date}&timezone=GMT".format(
+            base_url=open_meteo_url(),
             latitude=latitude,
             longitude=longitude,
             variables=",".join(variables),
@@ -151,11 +153,10 @@ class WeatherService:
         ]
         url = self._build_url(latitude, longitude, start_date, end_date, variables)
 
-        cache_session = requests_cache.CachedSession(".cache", expire_after=-1)
-        retry_session = retry(cache_session, retries=5, backoff_factor=0.2)
         try:
-            openmeteo = openmeteo_requests.Client(session=retry_session)
-            response = openmeteo.weather_api(url, params={})
+            openmeteo = get_openmeteo_client()
+            with timed("nwp_http"):
+                response = openmeteo.weather_api(url, params={})
         except requests.exceptions.Timeout:
             raise TimeoutError(f"Request to OpenMeteo API timed out. URl - {url}")
 
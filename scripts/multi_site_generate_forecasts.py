@@ -1,4 +1,4 @@
-from quartz_solar_forecast.forecast import run_forecast
+from quartz_solar_forecast.forecast import run_forecast_batch
 from quartz_solar_forecast.pydantic_models import PVSite
 import pandas as pd
 
@@ -7,7 +7,7 @@ def generate_forecasts(sites_info, forecast_date):
     """Generate forecasts for multiple PV sites.
 
     This function takes a list of site information tuples and a forecast date as input. For each site, it creates a PVSite object,
-    runs the forecast using the `run_forecast` function from the `quartz_solar_forecast` module, and generates a DataFrame
+    runs the forecast for all the sites at once using the `run_forecast_batch` function from the `quartz_solar_forecast` module, and generates a DataFrame
     containing the site's latitude, longitude, capacity, and power forecast values. Finally, it concatenates all the site
     DataFrames into a single DataFrame and returns it.
 
@@ -24,16 +24,22 @@ def generate_forecasts(sites_info, forecast_date):
     """
     all_forecasts = []  # List to store DataFrames for each site
 
+    # Create PVSite objects for all the sites
+    sites = [
+        PVSite(latitude=latitude, longitude=longitude, capacity_kwp=capacity)
+        for _, latitude, longitude, capacity in sites_info
+    ]
+
+    # Run the forecast for all the sites at once
+    forecasts = run_forecast_batch(sites=sites, ts=forecast_date)
+
     # Loop through each site information
-    for site_info in sites_info:
+    for i, site_info in enumerate(sites_info):
         # Unpack site information from the tuple
         pv_id, latitude, longitude, capacity = site_info
 
-        # Create PVSite object for the site
-        site = PVSite(latitude=latitude, longitude=longitude, capacity_kwp=capacity)
-
-        # Run forecast for the site
-        forecast = run_forecast(site=site, ts=forecast_date)
+        # Select the forecast of this site
+        forecast = forecasts.loc[i]
 
         # Flatten forecast values to a 1D array
         forecast_values = forecast.values.flatten()
@@ -0,0 +1,196 @@
+import asyncio
+import gc
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from fastapi.testclient import TestClient
+
+import api.app.api as api
+import quartz_solar_forecast.forecast as forecast
+from api.app.api import app
+
+
+async def mock_run_forecast_async(
+    site, model="gb", ts=None, nwp_source="icon", session=None, with_no_live_pv=False
+):
+    """Forecast in a time that depends on the site, so the forecasts finish out of order"""
+    if site.capacity_kwp < 0.5:
+        raise ValueError("Site too small")
+    await asyncio.sleep(0.1 / site.capacity_kwp)
+
+    index = pd.date_range(ts, periods=192, freq="15min")
+    predictions = pd.DataFrame({"power_kw": np.full(192, site.capacity_kwp)}, index=index)
+    if with_no_live_pv:
+        predictions["power_kw_no_live_pv"] = predictions["power_kw"]
+    return predictions
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    monkeypatch.setattr(forecast, "run_forecast_async", mock_run_forecast_async)
+    monkeypatch.setattr(api, "SITE_FILE_DIR", str(tmp_path))
+    # the models are not needed, and warming them up in the background slows the forecasts
+    monkeypatch.setattr(api, "WARM_UP_MODELS", [])
+    # the forecasts finish tens of milliseconds apart, and a full collection of all the objects
+    # loaded so far could take longer and finish several at once, in any order
+    gc.collect()
+    gc.freeze()
+    try:
+        with TestClient(app) as client:
+            yield client
+    finally:
+        gc.unfreeze()
+
+
+def read_lines(response):
+    return [json.loads(line) for line in response.iter_lines() if line]
+
+
+def test_forecasts(client):
+    sites = [
+        {"latitude": 51.75, "longitude": -1.25, "capacity_kwp": capacity_kwp}
+        for capacity_kwp in [1, 4, 2]
+    ]
+    sites[1]["inverter_type"] = "solis"
+
+    with client.stream(
+        "POST", "/forecasts/", json={"sites": sites, "timestamp": "2024-06-01 12:00:00"}
+    ) as response:
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/x-ndjson"
+        lines = read_lines(response)
+
+    # the fastest forecasts come first
+    assert [line["index"] for line in lines] == [1, 2, 0]
+    for line in lines:
+        assert line["timestamp"] == "2024-06-01 12:00:00"
+        assert line["site"]["capacity_kwp"] == sites[line["index"]]["capacity_kwp"]
+        assert len(line["predictions"]["power_kw"]) == 192
+    assert "power_kw_no_live_pv" in lines[0]["predictions"]
+    assert "power_kw_no_live_pv" not in lines[1]["predictions"]
+
+
+def test_forecasts_nan(client, monkeypatch):
+    async def run_forecast_async(*args, **kwargs):
+        predictions = await mock_run_forecast_async(*args, **kwargs)
+        predictions.iloc[0] = np.nan
+        return predictions
+
+    monkeypatch.setattr(forecast, "run_forecast_async", run_forecast_async)
+    site = {"latitude": 51.75, "longitude": -1.25, "capacity_kwp": 1}
+
+    with client.stream(
+        "POST", "/forecasts/", json={"sites": [site], "timestamp": "2024-06-01 12:00:00"}
+    ) as response:
+        lines = read_lines(response)
+
+    values = list(lines[0]["predictions"]["power_kw"].values())
+    assert values[0] is None
+    assert values[1] == 1
+
+
+def test_forecasts_site_file(client, tmp_path):
+    csv = "latitude,longitude,capacity_kwp,inverter_type\n"
+    csv += "".join(f"51.75,-1.25,{1 + i / 10},\n" for i in range(20))
+    csv += "51.75,-1.25,0.1,solis\n"
+    # an invalid row
+    csv += "95,-1.25,1,\n"
+
+    response = client.post("/site_files/", content=csv, headers={"content-type": "text/csv"})
+    site_file = response.json()["site_file"]
+
+    response = client.post(
+        "/forecasts/", json={"site_file": site_file, "timestamp": "2024-06-01 12:00:00"}
+    )
+    lines = read_lines(response)
+
+    assert sorted(line["index"] for line in lines) == list(range(22))
+    failed = sorted([line for line in lines if "error" in line], key=lambda line: line["index"])
+    assert [line["index"] for line in failed] == [20, 21]
+    assert failed[0]["error"] == "Site too small"
+    assert failed[1]["site"] is None
+    assert "latitude" in failed[1]["error"]
+
+    # the site file is removed once it has been forecast
+    assert list(tmp_path.iterdir()) == []
+    response = client.post("/forecasts/", json={"site_file": site_file})
+    assert response.status_code == 404
+
+
+def test_forecasts_site_file_closed(client, monkeypatch, tmp_path):
+    # whether the site file still exists when it is closed
+    closed = []
+
+    async def read_sites_csv_async(path, errors="raise"):
+        try:
+            async for site in forecast.read_sites_csv_async(path, errors=errors):
+                yield site
+        finally:
+            closed.append(os.path.exists(path))
+
+    async def run_forecast_stream(sites, **kwargs):
+        # stops after the first site, as when the client stops reading
+        site = await sites.__anext__()
+        yield 0, site, await mock_run_forecast_async(site, ts=kwargs["ts"])
+
+    monkeypatch.setattr(api, "read_sites_csv_async", read_sites_csv_async)
+    monkeypatch.setattr(api, "run_forecast_stream", run_forecast_stream)
+    csv = "latitude,longitude,capacity_kwp\n" + "51.75,-1.25,1\n" * 10
+    response = client.post("/site_files/", content=csv, headers={"content-type": "text/csv"})
+
+    response = client.post(
+        "/forecasts/", json={"site_file": response.json()["site_file"], "timestamp": "2024-06-01"}
+    )
+
+    assert len(read_lines(response)) == 1
+    # closed before it is removed, rather than whenever it is garbage collected
+    assert closed == [True]
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_site_file_too_large(client, monkeypatch, tmp_path):
+    monkeypatch.setattr(api, "MAX_SITE_FILE_BYTES", 100)
+    csv = "latitude,longitude,capacity_kwp\n" + "51.75,-1.25,1\n" * 10
+
+    response = client.post("/site_files/", content=csv, headers={"content-type": "text/csv"})
+
+    assert response.status_code == 413
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_forecasts_bad_request(client):
+    site = {"latitude": 51.75, "longitude": -1.25, "capacity_kwp": 1}
+
+    assert client.post("/forecasts/", json={}).status_code == 400
+    response = client.post("/forecasts/", json={"sites": [site], "site_file": "0" * 32})
+    assert response.status_code == 400
+    assert client.post("/forecasts/", json={"site_file": "../secrets"}).status_code == 400
+    assert client.post("/forecasts/", json={"site_file": "0" * 32}).status_code == 404
+
+
+def test_run_forecast_stream_concurrency(monkeypatch):
+    running = []
+    max_running = []
+
+    async def run_forecast_async(site, *args, **kwargs):
+        running.append(site)
+        max_running.append(len(running))
+        await asyncio.sleep(0.01)
+        running.remove(site)
+        return pd.DataFrame()
+
+    monkeypatch.setattr(forecast, "run_forecast_async", run_forecast_async)
+    sites = (
+        forecast.PVSite(latitude=51.75, longitude=-1.25, capacity_kwp=1) for _ in range(50)
+    )
+
+    async def run():
+        return [result async for result in forecast.run_forecast_stream(sites, max_concurrency=4)]
+
+    results = asyncio.run(run())
+
+    assert len(results) == 50
+    assert max(max_running) == 4
@@ -0,0 +1,153 @@
+
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+from fastapi.testclient import TestClient
+
+import api.app.api as api
+from api.app.api import app
+from api.app.formats import choose_format, columnar_predictions, compress, encode_forecast
+
+INDEX = pd.date_range("2024-06-01 12:00", periods=192, freq="15min")
+
+
+async def mock_run_forecast_async(site, ts=None, with_no_live_pv=False, **kwargs):
+    predictions = pd.DataFrame({"power_kw": np.linspace(0, 1, 192)}, index=INDEX)
+    if with_no_live_pv:
+        predictions["power_kw_no_live_pv"] = predictions["power_kw"] / 2
+    return predictions
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(api, "run_forecast_async", mock_run_forecast_async)
+    return TestClient(app)
+
+
+@pytest.fixture
+def body():
+    return {
+        "site": {"latitude": 51.75, "longitude": -1.25, "capacity_kwp": 1.25},
+        "timestamp": "2024-06-01 12:00:00",
+    }
+
+
+def test_choose_format():
+    assert choose_format(None, None) == "json"
+    assert choose_format(None, "*/*") == "json"
+    assert choose_format(None, "application/msgpack, application/json;q=0.9") == "msgpack"
+    assert choose_format("arrow", "application/msgpack") == "arrow"
+    assert choose_format(None, "application/msgpack;q=0, application/json") == "json"
+    assert choose_format(None, "application/json;q=0.5, application/msgpack") == "msgpack"
+
+
+def test_columnar_predictions():
+    predictions = pd.DataFrame({"power_kw": [1.0, np.nan, 3.0]}, index=INDEX[:3])
+
+    assert columnar_predictions(predictions) == {
+        "start": "2024-06-01T12:00:00",
+        "freq": "15min",
+        "values": {"power_kw": [1.0, None, 3.0]},
+    }
+
+
+def test_json_nan():
+    predictions = pd.DataFrame({"power_kw": [1.0, np.nan]}, index=INDEX[:2])
+
+    for response_format in ["json", "columnar"]:
+        body = encode_forecast("2024-06-01 12:00:00", predictions, response_format)
+        assert b"NaN" not in body
+
+    values = json.loads(encode_forecast("2024-06-01 12:00:00", predictions, "json"))
+    assert list(values["predictions"]["power_kw"].values()) == [1.0, None]
+
+
+def test_compress():
+    body = b"0" * 1000
+
+    assert compress(body, "gzip")[1] == "gzip"
+    assert compress(body, "gzip;q=0") == (body, None)
+    assert compress(body, "gzip; q=0.0, identity") == (body, None)
+    assert compress(body[:10], "gzip") == (body[:10], None)
+
+
+def test_json(client, body):
+    response = client.post("/forecast/", json=body)
+
+    assert response.headers["content-type"] == "application/json"
+    assert len(response.json()["predictions"]["power_kw"]) == 192
+
+
+def test_columnar(client, body):
+    response = client.post("/forecast/?format=columnar", json=body)
+    response_body = response.json()
+
+    assert response_body["timestamp"] == "2024-06-01 12:00:00"
+    assert response_body["start"] == "2024-06-01T12:00:00"
+    assert response_body["freq"] == "15min"
+    np.testing.assert_allclose(response_body["values"]["power_kw"], np.linspace(0, 1, 192))
+
+
+def test_msgpack(client, body):
+    msgpack = pytest.importorskip("msgpack")
+    body["site"]["inverter_type"] = "solis"
+    response = client.post("/forecast/", json=body, headers={"accept": "application/msgpack"})
+    response_body = msgpack.unpackb(response.content)
+
+    assert response.headers["content-type"] == "application/msgpack"
+    assert response_body["start"] == "2024-06-01T12:00:00"
+    np.testing.assert_allclose(
+        response_body["values"]["power_kw_no_live_pv"], np.linspace(0, 0.5, 192), rtol=1e-6
+    )
+
+
+def test_arrow(client, body):
+    pa = pytest.importorskip("pyarrow")
+    response = client.post("/forecast/?format=arrow", json=body)
+    table = pa.ipc.open_stream(response.content).read_all()
+
+    assert table.schema.metadata[b"timestamp"] == b"2024-06-01 12:00:00"
+    assert table.column_names == ["time", "power_kw"]
+    assert list(table["time"].to_pandas()) == list(INDEX)
+    np.testing.assert_allclose(table["power_kw"].to_numpy(), np.linspace(0, 1, 192), rtol=1e-6)
+
+
+def test_gzip(client, body):
+    response = client.post(
+        "/forecast/?format=columnar", json=body, headers={"accept-encoding": "gzip"}
+    )
+
+    # the test client decompresses the body
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.json()["freq"] == "15min"
+
+
+def test_forecast_no_live_default_tilt_and_orientation(monkeypatch, body):
+    calls = []
+
+    async def run_forecast_async(site, ts=None, with_no_live_pv=False, **kwargs):
+        calls.append((site.tilt, site.orientation, site.inverter_type, with_no_live_pv))
+        return await mock_run_forecast_async(site, ts, with_no_live_pv, **kwargs)
+
+    monkeypatch.setattr(api, "run_forecast_async", run_forecast_async)
+    client = TestClient(app)
+
+    # without an inverter, the site is forecast with the default tilt and orientation
+    body["site"].update({"tilt": 10, "orientation": 90})
+    response = client.post("/forecast/", json=body)
+    assert list(response.json()["predictions"]) == ["power_kw"]
+    assert calls == [(35, 180, None, False)]
+
+    # with an inverter, the forecasts with and without live pv are made in one pass, for any
+    # tilt and orientation
+    calls.clear()
+    body["site"]["inverter_type"] = "solis"
+    response = client.post("/forecast/", json=body)
+    assert set(response.json()["predictions"]) == {"power_kw", "power_kw_no_live_pv"}
+    assert calls == [(10, 90, "solis", True)]
+
+
+def test_unknown_format(client, body):
+    assert client.post("/forecast/?format=xml", json=body).status_code == 400
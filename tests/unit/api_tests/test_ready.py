@@ -0,0 +1,36 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import api.app.api as api
+import quartz_solar_forecast.forecast as forecast
+from api.app.api import app
+from quartz_solar_forecast.forecast import is_warm, warm_up
+
+
+def test_warm_up():
+    warm_up(["gb"])
+    assert is_warm()
+
+    with pytest.raises(ValueError):
+        warm_up(["other"])
+
+
+def test_ready(monkeypatch):
+    client = TestClient(app)
+
+    monkeypatch.setattr(api, "is_warm", lambda: False)
+    assert client.get("/ready").status_code == 503
+
+    monkeypatch.setattr(api, "is_warm", lambda: True)
+    assert client.get("/ready").json() == {"ready": True}
+
+
+def test_ready_after_startup(monkeypatch):
+    monkeypatch.setattr(forecast, "_warm", False)
+    monkeypatch.setattr(api, "WARM_UP_MODELS", ["gb"])
+
+    # the warm up runs in the background, and is waited for when the app shuts down
+    with TestClient(app):
+        pass
+
+    assert is_warm()
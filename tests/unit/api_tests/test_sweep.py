@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+from fastapi.testclient import TestClient
+
+import api.app.api as api
+from api.app.api import app
+from benchmarks.fake_open_meteo import serve_in_thread
+from quartz_solar_forecast.weather.client import get_session
+
+SITE = {"latitude": 51.75, "longitude": -1.25, "capacity_kwp": 2}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    with serve_in_thread() as url:
+        monkeypatch.setenv("QUARTZ_SOLAR_FORECAST_OPEN_METEO_URL", url)
+        with get_session().cache_disabled(), TestClient(app) as client:
+            yield client
+
+
+def test_forecast_sweep(client):
+    ts = (pd.Timestamp.now().floor("h") - pd.Timedelta(days=1)).isoformat()
+    body = {"site": SITE, "tilts": [20, 40], "orientations": [90, 180, 270], "timestamp": ts}
+
+    response = client.post("/forecast/sweep/", json=body)
+
+    assert response.status_code == 200
+    sweep = response.json()
+    assert len(sweep["candidates"]) == 6
+    assert sweep["candidates"][1] == {"tilt": 20, "orientation": 180, "capacity_kwp": 2}
+    assert len(sweep["power_kw"]) == 6
+    assert all(len(values) == len(sweep["times"]) for values in sweep["power_kw"])
+
+
+def test_forecast_sweep_nan(client, monkeypatch):
+    def run_forecast_sweep(site, **kwargs):
+        return xr.DataArray(
+            np.array([[1.0, np.nan]]),
+            dims=("candidate", "time"),
+            coords={
+                "candidate": [0],
+                "time": pd.date_range("2024-06-01", periods=2, freq="15min"),
+                "tilt": ("candidate", [35.0]),
+                "orientation": ("candidate", [180.0]),
+                "capacity_kwp": ("candidate", [2.0]),
+            },
+        )
+
+    monkeypatch.setattr(api, "run_forecast_sweep", run_forecast_sweep)
+
+    response = client.post("/forecast/sweep/", json={"site": SITE})
+
+    assert response.status_code == 200
+    assert response.json()["power_kw"] == [[1.0, None]]
+
+
+def test_forecast_sweep_bad_request(client, monkeypatch):
+    monkeypatch.setattr(api, "MAX_SWEEP_CANDIDATES", 10)
+
+    response = client.post("/forecast/sweep/", json={"site": SITE, "tilts": list(range(11))})
+    assert response.status_code == 400
+
+    response = client.post("/forecast/sweep/", json={"site": SITE, "tilts": [100]})
+    assert response.status_code == 422
+
+    response = client.post("/forecast/sweep/", json={"site": SITE, "orientations": []})
+    assert response.status_code == 422
+
+    response = client.post("/forecast/sweep/", json={"site": SITE, "model": "other"})
+    assert response.status_code == 422
@@ -0,0 +1,259 @@
+import asyncio
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import quartz_solar_forecast.data as data
+from quartz_solar_forecast.data import (
+    NWP_VARIABLES,
+    NwpStore,
+    get_grid_cells,
+    get_nwp,
+    get_nwp_batch,
+    get_nwp_values,
+    set_nwp_store,
+)
+from quartz_solar_forecast.pydantic_models import PVSite
+from quartz_solar_forecast.weather.client import latest_run
+
+
+class FakeVariable:
+    def __init__(self, values):
+        self.values = values
+
+    def ValuesAsNumpy(self):
+        return self.values
+
+
+class FakeHourly:
+    def __init__(self, start, values):
+        self.start = start
+        self.values = values
+
+    def Time(self):
+        return int(self.start.timestamp())
+
+    def TimeEnd(self):
+        return int(self.start.timestamp()) + 3600 * self.values.shape[1]
+
+    def Interval(self):
+        return 3600
+
+    def Variables(self, idx):
+        return FakeVariable(self.values[idx])
+
+
+class FakeResponse:
+    def __init__(self, hourly):
+        self.hourly = hourly
+
+    def Hourly(self):
+        return self.hourly
+
+
+class FakeOpenMeteoClient:
+    """Returns one response per location, with values made from the location and variable"""
+
+    def __init__(self):
+        self.requests = []
+
+    def weather_api(self, url, params):
+        self.requests.append((url, params))
+
+        variables = params["hourly"]
+        if isinstance(variables, str):
+            variables = [variables]
+        start = pd.Timestamp(params["start_date"])
+        n_hours = 24 * ((pd.Timestamp(params["end_date"]) - start).days + 1)
+
+        responses = []
+        for latitude, longitude in zip(
+            params["latitude"].split(","), params["longitude"].split(",")
+        ):
+            values = np.array(
+                [
+                    float(latitude) + float(longitude) + list(NWP_VARIABLES).index(v)
+                    + np.arange(n_hours, dtype=np.float32)
+                    for v in variables
+                ],
+                dtype=np.float32,
+            )
+            responses.append(FakeResponse(FakeHourly(start, values)))
+        return responses
+
+
+@pytest.fixture
+def fake_client(monkeypatch):
+    client = FakeOpenMeteoClient()
+    monkeypatch.setattr(data, "get_openmeteo_client", lambda: client)
+    return client
+
+
+@pytest.mark.parametrize("nwp_source", ["icon", "gfs", "ukmo"])
+def test_get_nwp_batch(fake_client, nwp_source):
+    ts = pd.Timestamp(datetime.now()).floor("h")
+    sites = [
+        PVSite(latitude=51.0 + i / 10, longitude=-1.0 - i / 10, capacity_kwp=1) for i in range(5)
+    ]
+
+    nwp_xrs = get_nwp_batch(sites, ts, nwp_source=nwp_source, chunk_size=2, snap_to_grid=False)
+
+    # 3 chunks, and gfs has visibility in the main request
+    assert len(fake_client.requests) == (3 if nwp_source == "gfs" else 6)
+    assert len(nwp_xrs) == 5
+
+    fake_client.requests = []
+    for site, nwp_xr in zip(sites, nwp_xrs):
+        expected = get_nwp(site, ts, nwp_source=nwp_source)
+        assert nwp_xr.x.values[0] == site.longitude
+        assert nwp_xr.y.values[0] == site.latitude
+        assert list(nwp_xr.variable.values) == list(NWP_VARIABLES.values())
+        assert len(nwp_xr.step) == 8 * 24
+        np.testing.assert_array_equal(nwp_xr[nwp_source].values, expected[nwp_source].values)
+
+    # one or two requests per site when fetched one at a time
+    assert len(fake_client.requests) == (5 if nwp_source == "gfs" else 10)
+
+
+def test_get_nwp_batch_historical(fake_client):
+    sites = [PVSite(latitude=51.0, longitude=-1.0, capacity_kwp=1)] * 3
+
+    nwp_xrs = get_nwp_batch(sites, datetime(2020, 6, 1, 12), nwp_source="icon")
+
+    assert len(fake_client.requests) == 1
+    assert "archive-api" in fake_client.requests[0][0]
+    for nwp_xr in nwp_xrs:
+        assert (nwp_xr["icon"].sel(variable="vis").values == 24000.0).all()
+
+
+def test_get_nwp_values_response_times(fake_client, monkeypatch):
+    weather_api = fake_client.weather_api
+
+    def weather_api_later_start(url, params):
+        # responses which start an hour later than asked
+        responses = weather_api(url, params)
+        for response in responses:
+            response.hourly.start += pd.Timedelta(hours=1)
+            response.hourly.values = response.hourly.values[:, :-1]
+        return responses
+
+    monkeypatch.setattr(fake_client, "weather_api", weather_api_later_start)
+
+    times, values = get_nwp_values([(51.0, -1.0)], "2024-06-01", "2024-06-01", nwp_source="gfs")
+
+    assert len(times) == 24
+    assert np.isnan(values[0, 0]).all()
+    # the value of the first hour of the response is at its own time
+    assert values[0, 1, 0] == np.float32(51.0 - 1.0)
+
+
+def test_get_nwp_values_missing_response(fake_client, monkeypatch):
+    weather_api = fake_client.weather_api
+    monkeypatch.setattr(fake_client, "weather_api", lambda url, params: weather_api(url, params)[1:])
+
+    with pytest.raises(ValueError, match="2 locations"):
+        get_nwp_values([(51.0, -1.0), (52.0, -1.0)], "2024-06-01", "2024-06-01", nwp_source="gfs")
+
+
+def test_get_grid_cells():
+    locations = [(51.7551, -1.2541), (51.7573, -1.2562), (51.80, -1.25), (51.7551, -1.2541)]
+
+    cells, site_cells = get_grid_cells(locations, spacing=0.02)
+    assert len(cells) == 2
+    assert list(site_cells) == [0, 0, 1, 0]
+    assert cells[0] == (51.76, -1.26)
+
+    # without a spacing, only identical locations are grouped
+    cells, site_cells = get_grid_cells(locations)
+    assert len(cells) == 3
+    assert site_cells[0] == site_cells[3]
+
+
+def test_get_nwp_batch_dedup(fake_client):
+    ts = pd.Timestamp(datetime.now()).floor("h")
+    # sites a few hundred metres apart, and one further away
+    sites = [
+        PVSite(latitude=51.7551, longitude=-1.2541, capacity_kwp=1),
+        PVSite(latitude=51.7573, longitude=-1.2562, capacity_kwp=1),
+        PVSite(latitude=51.7551, longitude=-1.2541, capacity_kwp=2),
+        PVSite(latitude=52.5, longitude=-1.25, capacity_kwp=1),
+    ]
+
+    nwp_xrs = get_nwp_batch(sites, ts, nwp_source="gfs", snap_to_grid=True)
+
+    # one request, for 2 grid cells
+    assert len(fake_client.requests) == 1
+    assert len(fake_client.requests[0][1]["latitude"].split(",")) == 2
+
+    # sites in the same cell have the same data, but keep their own coordinates
+    np.testing.assert_array_equal(nwp_xrs[0]["gfs"].values, nwp_xrs[1]["gfs"].values)
+    assert nwp_xrs[1].y.values[0] == 51.7573
+    assert nwp_xrs[0] is nwp_xrs[2]
+    assert not np.array_equal(nwp_xrs[0]["gfs"].values, nwp_xrs[3]["gfs"].values)
+
+    # by default only the sites at the same location share their data
+    fake_client.requests = []
+    nwp_xrs = get_nwp_batch(sites, ts, nwp_source="gfs")
+    assert len(fake_client.requests[0][1]["latitude"].split(",")) == 3
+    assert nwp_xrs[0] is nwp_xrs[2]
+    assert nwp_xrs[0] is not nwp_xrs[1]
+
+
+def test_get_nwp_batch_store(fake_client, tmp_path):
+    ts = pd.Timestamp(datetime.now()).floor("h")
+    sites = [PVSite(latitude=51.0 + i / 10, longitude=-1.0, capacity_kwp=1) for i in range(3)]
+
+    set_nwp_store(NwpStore(str(tmp_path)))
+    try:
+        expected = get_nwp_batch(sites[:2], ts, nwp_source="icon")
+        assert len(fake_client.requests) == 2
+
+        # the first two sites are read from the store, only the third one is fetched
+        fake_client.requests = []
+        nwp_xrs = get_nwp_batch(sites, ts, nwp_source="icon")
+        assert len(fake_client.requests) == 2
+        assert len(fake_client.requests[0][1]["latitude"].split(",")) == 1
+
+        for nwp_xr, expected_xr in zip(nwp_xrs, expected):
+            np.testing.assert_array_equal(nwp_xr["icon"].values, expected_xr["icon"].values)
+
+        fake_client.requests = []
+        get_nwp_batch(sites, ts, nwp_source="icon")
+        assert len(fake_client.requests) == 0
+    finally:
+        set_nwp_store(None)
+
+
+@pytest.mark.parametrize("nwp_source", ["icon", "gfs"])
+def test_get_nwp_async(fake_client, monkeypatch, nwp_source):
+    async def weather_api_async(session, url, params):
+        return fake_client.weather_api(url, params=params)
+
+    monkeypatch.setattr(data, "weather_api_async", weather_api_async)
+    ts = pd.Timestamp(datetime.now()).floor("h")
+    site = PVSite(latitude=51.0, longitude=-1.0, capacity_kwp=1)
+
+    nwp_xr = asyncio.run(data.get_nwp_async(site, ts, nwp_source=nwp_source, session=object()))
+    expected = get_nwp(site, ts, nwp_source=nwp_source)
+
+    np.testing.assert_array_equal(nwp_xr[nwp_source].values, expected[nwp_source].values)
+    np.testing.assert_array_equal(nwp_xr.step.values, expected.step.values)
+
+
+def test_store_run():
+    now = datetime.now(timezone.utc)
+
+    # data up to the future comes from the latest run
+    times = pd.date_range(pd.Timestamp(now.date()), periods=8 * 24, freq="h")
+    assert data._store_run("icon", times) == latest_run("icon")
+
+    # past data is kept under the run published when it ends, so new runs do not change it
+    times -= pd.Timedelta(days=30)
+    run = data._store_run("icon", times)
+    assert run == latest_run("icon", times[-1].tz_localize("UTC") + pd.Timedelta(hours=2))
+    assert run < latest_run("icon")
+
+    # the archive by the last day of the data
+    assert data._store_run("archive", times) == times[-1].normalize().tz_localize("UTC")
@@ -0,0 +1,67 @@
+import os
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+
+from quartz_solar_forecast.nwp_store import NwpStore
+
+
+def test_nwp_store_write_read(tmp_path):
+    store = NwpStore(str(tmp_path))
+    run = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    times = pd.date_range(run.date(), periods=48, freq="h")
+    values = np.random.rand(48, 9)
+
+    store.write("icon", run, (51.75, -1.25), times, values)
+
+    data = store.read("icon", run, (51.75, -1.25), times[10], times[20])
+    assert data.dtype == np.float64
+    assert data.shape == (11, 9)
+    np.testing.assert_allclose(data, values[10:21], rtol=1e-6)
+
+    # missing cells, runs and times
+    assert store.read("icon", run, (52.0, -1.25), times[0], times[-1]) is None
+    assert store.read("gfs", run, (51.75, -1.25), times[0], times[-1]) is None
+    assert store.read("icon", run, (51.75, -1.25), times[0], times[-1] + timedelta(hours=1)) is None
+    assert store.runs("icon") == [run]
+
+
+def test_nwp_store_merge(tmp_path):
+    store = NwpStore(str(tmp_path))
+    run = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    times = pd.date_range(run.date(), periods=72, freq="h")
+    values = np.random.rand(72, 9)
+
+    # overlapping ranges are merged, the newer values win
+    store.write("icon", run, (51.75, -1.25), times[:48], np.zeros((48, 9)))
+    store.write("icon", run, (51.75, -1.25), times[24:], values[24:])
+
+    data = store.read("icon", run, (51.75, -1.25), times[0], times[-1])
+    np.testing.assert_array_equal(data[:24], 0)
+    np.testing.assert_allclose(data[24:], values[24:], rtol=1e-6)
+
+    # a range with a gap is not read
+    store.write("gfs", run, (51.75, -1.25), times[:24], values[:24])
+    store.write("gfs", run, (51.75, -1.25), times[48:], values[48:])
+    assert store.read("gfs", run, (51.75, -1.25), times[0], times[23]) is not None
+    assert store.read("gfs", run, (51.75, -1.25), times[0], times[-1]) is None
+
+
+def test_nwp_store_prune(tmp_path):
+    store = NwpStore(str(tmp_path), retention=timedelta(days=2))
+    today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    times = pd.date_range(today, periods=24, freq="h")
+
+    # runs which have not been written to for the retention are removed when a new run is
+    # written, whatever their init time
+    runs = [today - timedelta(days=days) for days in [100, 5, 3, 1]]
+    for run, written_days_ago in zip(runs, [0, 5, 3, 1]):
+        store.write("gfs", run, (51.75, -1.25), times, np.zeros((24, 9)))
+        written = (today - timedelta(days=written_days_ago)).timestamp()
+        os.utime(store._run_dir("gfs", run), (written, written))
+    store.write("gfs", today, (51.75, -1.25), times, np.zeros((24, 9)))
+    assert store.runs("gfs") == [runs[0], runs[3], today]
+
+    store.prune(now=today + timedelta(days=1, hours=12))
+    assert store.runs("gfs") == [runs[0], today]
@@ -0,0 +1,109 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from quartz_solar_forecast.data import format_nwp_data, process_pv_data
+from quartz_solar_forecast.forecasts import forecast_v1_tilt_orientation, registry
+from quartz_solar_forecast.forecasts.registry import get_model, get_model_stats, register_model
+from quartz_solar_forecast.pydantic_models import PVSite
+
+
+@pytest.fixture
+def clean_registry(monkeypatch):
+    """Models registered by a test are forgotten after it"""
+    monkeypatch.setattr(registry, "_loaders", dict(registry._loaders))
+    monkeypatch.setattr(registry, "_paths", dict(registry._paths))
+    yield
+    registry.clear_models()
+
+
+def test_get_model_loads_once(clean_registry):
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return {"weights": list(range(1000))}
+
+    register_model("test_model", loader)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        models = list(executor.map(lambda _: get_model("test_model"), range(32)))
+
+    assert len(calls) == 1
+    assert all(model is models[0] for model in models)
+
+    stats = get_model_stats()["test_model"]
+    assert stats.load_time_s >= 0
+    assert stats.size_bytes > 0
+
+
+def test_get_model_size_from_path(clean_registry, tmp_path):
+    path = tmp_path / "model.bin"
+    path.write_bytes(b"0" * 1234)
+
+    register_model("test_model", lambda: "model", path=str(path))
+    get_model("test_model")
+
+    assert get_model_stats()["test_model"].size_bytes == 1234
+
+
+def test_get_model_psp():
+    model = get_model("0.4.0")
+    assert get_model("0.4.0") is model
+    stats = get_model_stats()["0.4.0"]
+    assert stats.size_bytes == os.path.getsize(registry._paths["0.4.0"])
+
+
+def test_get_model_unknown(clean_registry):
+    with pytest.raises(ValueError):
+        get_model("not_a_model")
+
+    # an unknown model can be registered by passing a loader
+    assert get_model("not_a_model", loader=lambda: "model") == "model"
+
+    registry.clear_models()
+    assert get_model_stats() == {}
+
+
+def test_concurrent_forecasts_share_model():
+    model = get_model("0.4.0")
+    ts = pd.Timestamp("2024-06-01 12:00")
+    site = PVSite(latitude=51.75, longitude=-1.25, capacity_kwp=1.25)
+    pv_xr = process_pv_data(None, ts, site)
+
+    # different weather for each forecast
+    times = pd.date_range("2024-06-01", periods=24 * 8, freq="h")
+    sun = np.clip(np.sin((times.hour.values - 6) / 12 * np.pi), 0, None)
+    nwp_xrs = []
+    for i in range(8):
+        df = pd.DataFrame(
+            {
+                "t": np.full(len(times), 15.0),
+                "prate": np.zeros(len(times)),
+                "lcc": np.full(len(times), 10.0 * i),
+                "mcc": np.full(len(times), 10.0),
+                "hcc": np.full(len(times), 5.0),
+                "si10": np.full(len(times), 3.0),
+                "dswrf": 100 * (i + 1) * sun,
+                "dlwrf": 300 * sun,
+                "vis": np.full(len(times), 24000.0),
+            },
+            index=times,
+        )
+        nwp_xrs.append(format_nwp_data(df, "icon", site))
+
+    def run(nwp_xr):
+        return forecast_v1_tilt_orientation("icon", nwp_xr, pv_xr, ts, model=model)
+
+    expected = [run(nwp_xr) for nwp_xr in nwp_xrs]
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(run, nwp_xrs * 4))
+
+    for i, result in enumerate(results):
+        pd.testing.assert_frame_equal(result, expected[i % len(nwp_xrs)])
+
+    # the shared model is never bound to any data
+    assert getattr(model, "_pv_data_source", None) is None
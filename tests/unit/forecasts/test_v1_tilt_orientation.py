@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+
+from quartz_solar_forecast.data import format_nwp_data, process_pv_data, process_pv_data_batch
+from quartz_solar_forecast.forecasts.v1_tilt_orientation import (
+    forecast_v1_tilt_orientation,
+    forecast_v1_tilt_orientation_batch,
+)
+from quartz_solar_forecast.pydantic_models import PVSite
+
+SITES = [
+    PVSite(latitude=51.75, longitude=-1.25, capacity_kwp=1.25),
+    PVSite(latitude=51.75, longitude=-1.25, capacity_kwp=3, tilt=20, orientation=120),
+    PVSite(latitude=53.5, longitude=-2.0, capacity_kwp=4, tilt=40, orientation=220),
+]
+
+
+def make_nwp(site: PVSite, ts: pd.Timestamp):
+    start = ts.normalize()
+    times = pd.date_range(start, start + pd.Timedelta(days=7), freq="h", inclusive="left")
+    sun = np.clip(np.sin((times.hour.values - 6) / 12 * np.pi), 0, None)
+    df = pd.DataFrame(
+        {
+            "t": 10 + site.latitude / 10 + 5 * sun,
+            "prate": np.zeros(len(times)),
+            "lcc": np.full(len(times), 20.0),
+            "mcc": np.full(len(times), 10.0),
+            "hcc": np.full(len(times), 5.0),
+            "si10": np.full(len(times), 3.0),
+            "dswrf": 600 * sun * (1 + site.longitude / 100),
+            "dlwrf": 400 * sun,
+            "vis": np.full(len(times), 24000.0),
+        },
+        index=times,
+    )
+    return format_nwp_data(df, "icon", site)
+
+
+def test_batch_same_as_model_predict():
+    """The batched regressor call gives the same forecasts as psp's model.predict"""
+    ts = pd.Timestamp("2024-06-01 09:00")
+    live = pd.DataFrame(
+        {"timestamp": pd.date_range(ts - pd.Timedelta(hours=1), ts, freq="15min"), "power_kw": 0.8}
+    )
+    lives = [None, live, None]
+    pv_ids = [str(i) for i in range(len(SITES))]
+
+    nwp_xrs = {pv_id: make_nwp(site, ts) for pv_id, site in zip(pv_ids, SITES)}
+    pv_xr = process_pv_data_batch(lives, ts, SITES, pv_ids)
+    predictions = forecast_v1_tilt_orientation_batch("icon", nwp_xrs, pv_xr, ts, batch_size=2)
+
+    for pv_id, site, live_generation in zip(pv_ids, SITES, lives):
+        expected = forecast_v1_tilt_orientation(
+            "icon", nwp_xrs[pv_id], process_pv_data(live_generation, ts, site), ts
+        )
+        np.testing.assert_allclose(
+            predictions[predictions["pv_id"] == pv_id]["power_kw"].values,
+            expected["power_kw"].values,
+            rtol=1e-10,
+        )
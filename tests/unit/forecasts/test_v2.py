@@ -0,0 +1,220 @@
+import numpy as np
+import pandas as pd
+import pytest
+from xgboost.sklearn import XGBRegressor
+
+from benchmarks.fake_open_meteo import FakeOpenMeteo, serve_in_thread
+from quartz_solar_forecast.forecast import (
+    predict_tryolabs,
+    predict_tryolabs_batch,
+    predict_tryolabs_range,
+    predict_tryolabs_with_no_live_pv,
+    run_forecast_sweep,
+)
+from quartz_solar_forecast.forecasts.v2 import TryolabsSolarPowerPredictor, set_predictor
+from quartz_solar_forecast.pydantic_models import PVSite
+from quartz_solar_forecast.weather.client import get_session
+
+SITES = [
+    PVSite(latitude=51.75, longitude=-1.25, capacity_kwp=4, tilt=30, orientation=180),
+    PVSite(latitude=51.75, longitude=-1.25, capacity_kwp=2, tilt=10, orientation=90),
+    PVSite(latitude=40.0, longitude=-3.7, capacity_kwp=10, tilt=35, orientation=200),
+]
+
+
+@pytest.fixture
+def predictor(monkeypatch):
+    """A predictor with a small model trained on synthetic weather, from a fake Open-Meteo"""
+    with serve_in_thread(FakeOpenMeteo(source="synthetic")) as url:
+        monkeypatch.setenv("QUARTZ_SOLAR_FORECAST_OPEN_METEO_URL", url)
+        with get_session().cache_disabled():
+            predictor = TryolabsSolarPowerPredictor()
+            start_date = pd.Timestamp.now().strftime("%Y-%m-%d")
+            data = predictor.clean(predictor.get_data(51.75, -1.25, start_date, 4))
+            features = data.drop(columns=[predictor.DATE_COLUMN])
+
+            predictor.model = XGBRegressor(n_estimators=5, max_depth=3)
+            predictor.model.fit(features, features["direct_radiation"] * features["kwp"] / 1000)
+
+            set_predictor(predictor)
+            yield predictor
+            set_predictor(None)
+
+
+def _sites_df(sites):
+    return pd.DataFrame(
+        {
+            "latitude": [site.latitude for site in sites],
+            "longitude": [site.longitude for site in sites],
+            "kwp": [site.capacity_kwp for site in sites],
+            "orientation": [site.orientation for site in sites],
+            "tilt": [site.tilt for site in sites],
+        }
+    )
+
+
+def test_predict_power_output_sites(predictor):
+    start_date = pd.Timestamp.now().strftime("%Y-%m-%d")
+
+    per_site = predictor.predict_power_output_sites(_sites_df(SITES), start_date)
+
+    assert len(per_site) == len(SITES)
+    for site, predictions in zip(SITES, per_site):
+        expected = predictor.predict_power_output(
+            site.latitude, site.longitude, start_date, site.capacity_kwp, site.orientation, site.tilt
+        )
+        pd.testing.assert_frame_equal(predictions, expected)
+        assert (predictions["power_kw"] >= 0).all()
+        assert predictions["power_kw"].max() > 0
+
+
+def test_predict_tryolabs_shared_predictor(predictor, monkeypatch):
+    monkeypatch.setattr(
+        TryolabsSolarPowerPredictor,
+        "load_model",
+        lambda self, *args, **kwargs: pytest.fail("the shared model should be reused"),
+    )
+    ts = pd.Timestamp.now().floor("h")
+
+    single = predict_tryolabs(SITES[2], ts)
+    batch = predict_tryolabs_batch(SITES, ["a", "b", "c"], ts)
+
+    assert len(single) == 48
+    assert set(batch.index.get_level_values("site_id")) == {"a", "b", "c"}
+    np.testing.assert_allclose(
+        batch.loc["c"]["power_kw"].values, single["power_kw"].values, rtol=1e-6
+    )
+
+
+def test_build_features(predictor):
+    start_date = pd.Timestamp.now().strftime("%Y-%m-%d")
+    sites = _sites_df(SITES)
+    site_weather = [
+        predictor._get_weather(site.latitude, site.longitude, start_date) for site in SITES
+    ]
+
+    features = predictor.build_features(site_weather, sites)
+
+    assert features.dtype == np.float32
+    assert features.flags["C_CONTIGUOUS"]
+    assert features.shape == (sum(len(data) for data in site_weather), len(predictor.FEATURES))
+
+    # the same features and predictions as the DataFrames of get_data and clean
+    start = 0
+    for site, data in zip(SITES, site_weather):
+        expected = predictor.clean(
+            predictor._add_panel_columns(
+                data.copy(), site.latitude, site.longitude, site.capacity_kwp, site.orientation, site.tilt
+            )
+        ).drop(columns=[predictor.DATE_COLUMN])
+        assert list(expected.columns) == predictor.feature_names
+
+        block = features[start : start + len(data)]
+        np.testing.assert_array_equal(block, expected.values.astype(np.float32))
+        np.testing.assert_array_equal(
+            predictor.model.predict(block, validate_features=False), predictor.model.predict(expected)
+        )
+        start += len(data)
+
+
+def test_night_rows_are_not_predicted(predictor, monkeypatch):
+    start_date = pd.Timestamp.now().strftime("%Y-%m-%d")
+    sites = _sites_df(SITES)
+    site_weather = [
+        predictor._get_weather(site.latitude, site.longitude, start_date) for site in SITES
+    ]
+    is_day = np.concatenate([data["is_day"].values for data in site_weather]) != 0
+    assert 0 < is_day.sum() < len(is_day)
+
+    # all the rows through the model, and the night ones set to 0
+    expected = predictor.model.predict(
+        predictor.build_features(site_weather, sites), validate_features=False
+    )
+    expected[~is_day] = 0
+    expected[expected < 0] = 0
+
+    predicted_rows = []
+    predict = predictor.model.predict
+
+    def counting_predict(features, **kwargs):
+        predicted_rows.append(len(features))
+        return predict(features, **kwargs)
+
+    monkeypatch.setattr(predictor.model, "predict", counting_predict)
+    predictions = predictor.predict_power_output_batch(sites, start_date)
+
+    assert predicted_rows == [is_day.sum()]
+    np.testing.assert_array_equal(predictions["power_kw"].values, expected)
+
+
+def test_predict_tryolabs_range(predictor, monkeypatch):
+    start = pd.Timestamp.now().floor("D") - pd.Timedelta(days=3)
+    end = start + pd.Timedelta(days=6)
+    requests = []
+    get_weather = predictor._get_weather
+    monkeypatch.setattr(
+        predictor, "_get_weather", lambda *args: requests.append(args) or get_weather(*args)
+    )
+
+    predictions = predict_tryolabs_range(SITES[0], start, end)
+
+    assert len(requests) == 1
+    assert predictions.index[0] == start
+    assert predictions.index[-1] == end - pd.Timedelta(hours=1)
+    assert len(predictions) == 6 * 24
+
+    # the same as the 48 hour forecasts
+    for day in range(0, 6, 2):
+        ts = start + pd.Timedelta(days=day)
+        pd.testing.assert_frame_equal(
+            predictions.loc[ts : ts + pd.Timedelta(hours=47)], predict_tryolabs(SITES[0], ts)
+        )
+
+
+def test_predict_tryolabs_range_init_times(predictor):
+    start = pd.Timestamp.now().floor("D") - pd.Timedelta(days=2)
+    init_times = [start + pd.Timedelta(hours=hours) for hours in (0, 6, 30)]
+
+    predictions = predict_tryolabs_range(SITES[0], init_times=init_times)
+
+    assert list(predictions.index.get_level_values("init_time").unique()) == init_times
+    for init_time in init_times:
+        expected = predict_tryolabs(SITES[0], init_time)
+        np.testing.assert_array_equal(
+            predictions.loc[init_time]["power_kw"].values, expected["power_kw"].values
+        )
+        assert predictions.loc[init_time].index[0] == init_time
+
+    # the range clips the forecasts
+    clipped = predict_tryolabs_range(
+        SITES[0], end=start + pd.Timedelta(hours=36), init_times=init_times
+    )
+    assert len(clipped.loc[init_times[2]]) == 6
+
+
+def test_run_forecast_sweep_xgb(predictor):
+    ts = pd.Timestamp.now().floor("h")
+
+    cube = run_forecast_sweep(
+        SITES[0], tilts=[10, 30], orientations=[90, 180, 270], ts=ts, model="xgb"
+    )
+
+    assert cube.sizes == {"candidate": 6, "time": 48}
+    expected = predict_tryolabs(SITES[0].model_copy(update={"tilt": 10, "orientation": 270}), ts)
+    np.testing.assert_array_equal(cube.sel(candidate=2).values, expected["power_kw"].values)
+
+
+def test_predict_tryolabs_with_no_live_pv(predictor):
+    ts = pd.Timestamp.now().floor("h")
+    site = SITES[1]
+
+    predictions = predict_tryolabs_with_no_live_pv(site, ts)
+
+    # the forecast without live pv is for the default tilt and orientation, as with the gb model
+    expected = predict_tryolabs(site.model_copy(update={"tilt": 35, "orientation": 180}), ts)
+    np.testing.assert_array_equal(
+        predictions["power_kw"].values, predict_tryolabs(site, ts)["power_kw"].values
+    )
+    np.testing.assert_array_equal(
+        predictions["power_kw_no_live_pv"].values, expected["power_kw"].values
+    )
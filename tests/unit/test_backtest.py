@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+
+import quartz_solar_forecast.backtest as backtest
+import quartz_solar_forecast.forecast as forecast
+from quartz_solar_forecast.backtest import run_backtest
+from quartz_solar_forecast.data import format_nwp_data
+from quartz_solar_forecast.forecast import run_forecast
+from quartz_solar_forecast.pydantic_models import PVSite
+
+nwp_calls = []
+
+
+def mock_get_nwp_df(site, start, end, nwp_source="icon", historical=False):
+    """Make fake hourly NWP data, from the start day to the end day included"""
+    nwp_calls.append((start, end))
+    times = pd.date_range(
+        pd.Timestamp(start), pd.Timestamp(end) + pd.Timedelta(days=1), freq="h", inclusive="left"
+    )
+    hour = times.hour.values
+    sun = np.clip(np.sin((hour - 6) / 12 * np.pi), 0, None)
+    day = times.dayofyear.values
+    return pd.DataFrame(
+        {
+            "t": 10 + 5 * sun,
+            "prate": np.zeros(len(times)),
+            "lcc": 10.0 * (day % 5),
+            "mcc": np.full(len(times), 10.0),
+            "hcc": np.full(len(times), 5.0),
+            "si10": np.full(len(times), 3.0),
+            "dswrf": 600 * sun * (1 + (day % 3) / 10),
+            "dlwrf": 400 * sun,
+            "vis": np.full(len(times), 24000.0),
+        },
+        index=times,
+    ).astype("float64")
+
+
+def mock_get_nwp(site, ts, nwp_source="icon"):
+    start = ts.date()
+    df = mock_get_nwp_df(site, start, start + pd.Timedelta(days=7), nwp_source)
+    return format_nwp_data(df, nwp_source, site)
+
+
+def test_run_backtest(monkeypatch, tmp_path):
+    monkeypatch.setattr(backtest, "get_nwp_df", mock_get_nwp_df)
+    monkeypatch.setattr(forecast, "get_nwp", mock_get_nwp)
+
+    site = PVSite(latitude=51.75, longitude=-1.25, capacity_kwp=1.25)
+    start = pd.Timestamp.now().floor("D") - pd.Timedelta(days=10)
+    end = start + pd.Timedelta(days=2)
+
+    nwp_calls.clear()
+    results = run_backtest(site, start, end, freq="6h", chunk_size=4)
+
+    # one nwp fetch for all the init times
+    assert len(nwp_calls) == 1
+    assert results["forecast_init_time"].nunique() == 9
+    assert len(results) == 9 * 192
+
+    # the backtest gives the same results as running the forecast for each init time
+    for init_time in [start, start + pd.Timedelta(hours=18), end]:
+        expected = run_forecast(site=site.model_copy(), ts=init_time.to_pydatetime())
+        result = results[results["forecast_init_time"] == init_time]
+        np.testing.assert_allclose(result["power_kw"].values, expected["power_kw"].values)
+
+    # stream the results to a file
+    output_file = str(tmp_path / "backtest.csv")
+    assert run_backtest(site, start, end, freq="6h", output_file=output_file, chunk_size=4) is None
+    results_csv = pd.read_csv(output_file)
+    assert len(results_csv) == len(results)
@@ -0,0 +1,112 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.replay import (
+    FixtureNotFoundError,
+    move_to_request,
+    open_meteo_fixtures,
+    request_key,
+    synthesize_response,
+)
+from benchmarks.run import compare, run_benchmarks
+from quartz_solar_forecast.data import get_nwp
+from quartz_solar_forecast.pydantic_models import PVSite
+from quartz_solar_forecast.weather.client import decode_weather_api
+
+
+def test_request_key():
+    params = {
+        "latitude": "51.75",
+        "longitude": "-1.25",
+        "start_date": "2024-06-01",
+        "end_date": "2024-06-08",
+        "hourly": ["temperature_2m", "precipitation"],
+    }
+    key = request_key("https://api.open-meteo.com/v1/dwd-icon", params)
+
+    assert key == "/v1/dwd-icon?hourly=temperature_2m,precipitation&latitude=51.75&longitude=-1.25"
+    # the same request as a url, on other dates
+    url = (
+        "https://api.open-meteo.com/v1/dwd-icon?format=flatbuffers&latitude=51.75&longitude=-1.25"
+        "&start_date=2025-01-01&end_date=2025-01-08&hourly=temperature_2m&hourly=precipitation"
+    )
+    assert request_key(url) == key
+
+
+def test_synthesize_response():
+    url = "https://api.open-meteo.com/v1/forecast"
+    params = {
+        "latitude": "51.75,40.0",
+        "longitude": "-1.25,-3.7",
+        "start_date": "2024-06-01",
+        "end_date": "2024-06-02",
+        "hourly": ["shortwave_radiation", "is_day"],
+    }
+
+    responses = decode_weather_api(synthesize_response(url, params))
+
+    assert len(responses) == 2
+    hourly = responses[1].Hourly()
+    assert hourly.Time() == pd.Timestamp("2024-06-01", tz="UTC").timestamp()
+    assert hourly.Interval() == 3600
+    radiation = hourly.Variables(0).ValuesAsNumpy()
+    is_day = hourly.Variables(1).ValuesAsNumpy()
+    assert len(radiation) == 48
+    np.testing.assert_array_equal(radiation > 0, is_day == 1)
+    # the same request gets the same response
+    assert synthesize_response(url, params) == synthesize_response(url, params)
+
+
+def test_move_to_request():
+    url = (
+        "https://api.open-meteo.com/v1/forecast?latitude=51.75,40.0&longitude=-1.25,-3.7"
+        "&start_date=2024-06-01&end_date=2024-06-02&hourly=shortwave_radiation"
+    )
+    body = synthesize_response(url)
+
+    moved = decode_weather_api(move_to_request(body, url.replace("06-01", "07-15")))
+
+    assert len(moved) == 2
+    for message, original in zip(moved, decode_weather_api(body)):
+        hourly = message.Hourly()
+        assert hourly.Time() == pd.Timestamp("2024-07-15", tz="UTC").timestamp()
+        assert hourly.TimeEnd() - hourly.Time() == 48 * 3600
+        np.testing.assert_array_equal(
+            hourly.Variables(0).ValuesAsNumpy(), original.Hourly().Variables(0).ValuesAsNumpy()
+        )
+
+
+def test_replay_missing_fixture(tmp_path):
+    site = PVSite(latitude=51.75, longitude=-1.25, capacity_kwp=1)
+
+    with open_meteo_fixtures(directory=str(tmp_path)):
+        with pytest.raises(FixtureNotFoundError):
+            get_nwp(site, pd.Timestamp("2024-06-01 12:00"))
+
+
+def test_run_benchmarks():
+    results = run_benchmarks(["get_nwp", "process_pv_data"], iterations=3, warmup=0)
+
+    assert set(results) == {"get_nwp", "process_pv_data"}
+    for result in results.values():
+        assert result["iterations"] == 3
+        assert result["throughput"] > 0
+        assert 0 < result["p50_ms"] <= result["p99_ms"]
+        assert result["peak_memory_mb"] > 0
+
+
+def test_compare():
+    baseline = {
+        "get_nwp": {"p50_ms": 10.0, "p99_ms": 20.0, "peak_memory_mb": 1.0},
+        "predict_power_output": {"skipped": "no model"},
+    }
+    results = {
+        "get_nwp": {"p50_ms": 12.0, "p99_ms": 30.0, "peak_memory_mb": 1.0},
+        "predict_power_output": {"p50_ms": 1.0, "p99_ms": 1.0, "peak_memory_mb": 1.0},
+    }
+
+    regressions = compare(results, baseline, tolerance=0.25)
+
+    assert len(regressions) == 1
+    assert regressions[0].startswith("get_nwp p99_ms")
@@ -0,0 +1,92 @@
+import asyncio
+import time
+
+import aiohttp
+import numpy as np
+import pandas as pd
+import pytest
+import requests
+
+from benchmarks.fake_open_meteo import FakeOpenMeteo, serve_in_thread
+from quartz_solar_forecast.data import get_nwp, get_nwp_async
+from quartz_solar_forecast.pydantic_models import PVSite
+from quartz_solar_forecast.weather.client import get_session
+
+SITE = PVSite(latitude=51.75, longitude=-1.25, capacity_kwp=1)
+
+PARAMS = {
+    "latitude": "51.75",
+    "longitude": "-1.25",
+    "start_date": "2024-06-01",
+    "end_date": "2024-06-02",
+    "hourly": "shortwave_radiation",
+    "format": "flatbuffers",
+}
+
+
+@pytest.fixture
+def url(monkeypatch):
+    with serve_in_thread() as url:
+        monkeypatch.setenv("QUARTZ_SOLAR_FORECAST_OPEN_METEO_URL", url)
+        yield url
+
+
+def test_get_nwp(url):
+    ts = pd.Timestamp.now().floor("h")
+
+    with get_session().cache_disabled():
+        nwp = get_nwp(SITE, ts)
+
+    assert len(nwp.step) == 192
+    assert float(nwp["icon"].sel(variable="dswrf").max()) > 0
+    assert np.isfinite(nwp["icon"].values).all()
+
+
+def test_get_nwp_historical(url):
+    with get_session().cache_disabled():
+        nwp = get_nwp(SITE, pd.Timestamp("2024-06-01 12:00"))
+
+    assert float(nwp["icon"].sel(variable="dswrf").max()) > 0
+
+
+def test_get_nwp_async(url):
+    async def run():
+        async with aiohttp.ClientSession() as session:
+            return await get_nwp_async(SITE, pd.Timestamp.now().floor("h"), session=session)
+
+    nwp = asyncio.run(run())
+
+    assert float(nwp["icon"].sel(variable="dswrf").max()) > 0
+
+
+def test_injected_errors():
+    fake = FakeOpenMeteo(error_rate=0.5, rate_limit_rate=0.25, seed=0)
+
+    with serve_in_thread(fake) as url:
+        statuses = [
+            requests.get(f"{url}/v1/forecast", params=PARAMS).status_code for _ in range(100)
+        ]
+
+    assert 30 < statuses.count(500) < 70
+    assert 10 < statuses.count(429) < 40
+    assert statuses.count(200) == 100 - fake.errors
+    assert fake.requests == 100
+
+
+def test_latency():
+    with serve_in_thread(FakeOpenMeteo(latency_ms=200)) as url:
+        start = time.perf_counter()
+        response = requests.get(f"{url}/v1/forecast", params=PARAMS)
+
+    assert response.status_code == 200
+    assert time.perf_counter() - start >= 0.2
+
+
+def test_bad_requests(tmp_path):
+    with serve_in_thread(FakeOpenMeteo(source="fixtures", directory=str(tmp_path))) as url:
+        response = requests.get(f"{url}/v1/forecast", params=PARAMS)
+        assert response.status_code == 400
+        assert response.json()["error"]
+
+        response = requests.get(f"{url}/v1/forecast", params={**PARAMS, "format": "json"})
+        assert response.status_code == 400
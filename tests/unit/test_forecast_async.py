@@ -0,0 +1,150 @@
+import asyncio
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import quartz_solar_forecast.forecast as forecast
+from quartz_solar_forecast.data import format_nwp_data, process_pv_data
+from quartz_solar_forecast.forecast import predict_ocf, run_forecast_async
+from quartz_solar_forecast.inverters.inverter import AbstractInverter
+from quartz_solar_forecast.metrics import MetricsRegistry
+from quartz_solar_forecast.pydantic_models import PVSite
+
+DELAY_S = 0.5
+
+
+def make_nwp(site: PVSite, ts: datetime, nwp_source: str = "icon"):
+    """Make fake NWP data"""
+    start = pd.Timestamp(ts).normalize()
+    times = pd.date_range(start, start + pd.Timedelta(days=8), freq="h", inclusive="left")
+    sun = np.clip(np.sin((times.hour.values - 6) / 12 * np.pi), 0, None)
+    df = pd.DataFrame(
+        {
+            "t": 10 + 5 * sun,
+            "prate": np.zeros(len(times)),
+            "lcc": np.full(len(times), 20.0),
+            "mcc": np.full(len(times), 10.0),
+            "hcc": np.full(len(times), 5.0),
+            "si10": np.full(len(times), 3.0),
+            "dswrf": 600 * sun,
+            "dlwrf": 400 * sun,
+            "vis": np.full(len(times), 24000.0),
+        },
+        index=times,
+    )
+    return format_nwp_data(df, nwp_source, site)
+
+
+def make_live_data(ts: pd.Timestamp) -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "timestamp": pd.date_range(ts - pd.Timedelta(hours=1), ts, freq="15min"),
+            "power_kw": 0.8,
+        }
+    )
+
+
+def make_pv(site: PVSite, ts: pd.Timestamp):
+    """Make fake live PV data"""
+    return process_pv_data(make_live_data(ts), ts, site)
+
+
+async def mock_get_nwp_async(site, ts, nwp_source="icon", session=None):
+    await asyncio.sleep(DELAY_S)
+    return make_nwp(site, ts, nwp_source)
+
+
+async def mock_make_pv_data_async(site, ts, session=None):
+    await asyncio.sleep(DELAY_S)
+    return make_pv(site, ts)
+
+
+@pytest.fixture
+def mock_data(monkeypatch):
+    monkeypatch.setattr(forecast, "get_nwp", make_nwp)
+    monkeypatch.setattr(forecast, "make_pv_data", make_pv)
+    monkeypatch.setattr(forecast, "get_nwp_async", mock_get_nwp_async)
+    monkeypatch.setattr(forecast, "make_pv_data_async", mock_make_pv_data_async)
+    monkeypatch.setattr(forecast, "write_sentry", lambda params: None)
+
+
+def test_run_forecast_async_same_as_sync(mock_data):
+    site = PVSite(latitude=51.75, longitude=-1.25, capacity_kwp=6)
+    ts = pd.Timestamp("2024-06-01 12:00")
+
+    expected = predict_ocf(site.model_copy(), ts=ts)
+    predictions = asyncio.run(run_forecast_async(site, ts=ts, session=object()))
+
+    pd.testing.assert_frame_equal(predictions, expected)
+
+
+def test_run_forecast_async_concurrent(mock_data):
+    sites = [
+        PVSite(latitude=51.75 + i / 10, longitude=-1.25, capacity_kwp=1.25) for i in range(4)
+    ]
+    ts = pd.Timestamp("2024-06-01 12:00")
+
+    async def run_all():
+        return await asyncio.gather(
+            *[run_forecast_async(site, ts=ts, session=object()) for site in sites]
+        )
+
+    # warm up, so the model is loaded
+    asyncio.run(run_forecast_async(sites[0], ts=ts, session=object()))
+
+    start = time.monotonic()
+    predictions = asyncio.run(run_all())
+    duration = time.monotonic() - start
+
+    assert len(predictions) == 4
+    assert duration < 3 * DELAY_S
+
+
+def test_run_forecast_async_pv_timeout(mock_data, monkeypatch):
+    monkeypatch.setattr(forecast, "PV_TIMEOUT_S", DELAY_S / 5)
+    site = PVSite(latitude=51.75, longitude=-1.25, capacity_kwp=1.25, inverter_type="solis")
+    ts = pd.Timestamp("2024-06-01 12:00")
+
+    predictions = asyncio.run(run_forecast_async(site, ts=ts, session=object()))
+
+    assert len(predictions) == 192
+
+
+def test_run_forecast_async_timed(mock_data, monkeypatch):
+    registry = MetricsRegistry()
+    monkeypatch.setattr(forecast, "timed", registry.timed)
+    site = PVSite(latitude=51.75, longitude=-1.25, capacity_kwp=1.25)
+
+    asyncio.run(run_forecast_async(site, ts=pd.Timestamp("2024-06-01 12:00"), session=object()))
+
+    # the whole forecast, with the nwp and pv fetches
+    stages = registry.get_stats()["stages"]
+    assert stages["run_forecast"]["count"] == 1
+    assert stages["run_forecast"]["mean"] >= DELAY_S
+
+
+def test_run_forecast_async_unsupported_model(mock_data):
+    site = PVSite(latitude=51.75, longitude=-1.25, capacity_kwp=1.25)
+
+    with pytest.raises(ValueError):
+        asyncio.run(run_forecast_async(site, model="other"))
+
+
+def test_run_forecast_async_with_no_live_pv(mock_data, monkeypatch):
+    class FakeInverter(AbstractInverter):
+        def get_data(self, ts):
+            return make_live_data(ts)
+
+    site = PVSite(latitude=51.75, longitude=-1.25, capacity_kwp=1.25)
+    ts = pd.Timestamp("2024-06-01 12:00")
+    monkeypatch.setattr(PVSite, "get_inverter", lambda self: FakeInverter())
+
+    predictions = asyncio.run(
+        run_forecast_async(site, ts=ts, session=object(), with_no_live_pv=True)
+    )
+
+    expected = predict_ocf(site.model_copy(), ts=ts, with_no_live_pv=True)
+    pd.testing.assert_frame_equal(predictions, expected)
@@ -0,0 +1,112 @@
+import threading
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import quartz_solar_forecast.data as data
+import quartz_solar_forecast.forecast as forecast
+from quartz_solar_forecast.data import format_nwp_data
+from quartz_solar_forecast.forecast import run_forecast, run_forecast_batch
+from quartz_solar_forecast.pydantic_models import PVSite
+
+
+def mock_get_nwp(site: PVSite, ts: datetime, nwp_source: str = "icon"):
+    """Make fake NWP data, which depends on the location of the site"""
+    start = pd.Timestamp(ts).normalize()
+    times = pd.date_range(start, start + pd.Timedelta(days=7), freq="h", inclusive="left")
+    hour = times.hour.values
+    sun = np.clip(np.sin((hour - 6) / 12 * np.pi), 0, None)
+    df = pd.DataFrame(
+        {
+            "t": 10 + site.latitude / 10 + 5 * sun,
+            "prate": np.zeros(len(times)),
+            "lcc": np.full(len(times), 20.0),
+            "mcc": np.full(len(times), 10.0),
+            "hcc": np.full(len(times), 5.0),
+            "si10": np.full(len(times), 3.0),
+            "dswrf": 600 * sun * (1 + site.longitude / 100),
+            "dlwrf": 400 * sun,
+            "vis": np.full(len(times), 24000.0),
+        },
+        index=times,
+    )
+    return format_nwp_data(df, nwp_source, site)
+
+
+def mock_get_nwp_batch(sites, ts: datetime, nwp_source: str = "icon", snap_to_grid=False):
+    return [mock_get_nwp(site, ts, nwp_source) for site in sites]
+
+
+def test_run_forecast_batch(monkeypatch):
+    monkeypatch.setattr(forecast, "get_nwp", mock_get_nwp)
+    monkeypatch.setattr(forecast, "get_nwp_batch", mock_get_nwp_batch)
+
+    ts = pd.Timestamp("2024-06-01 09:00")
+    sites = [
+        PVSite(latitude=51.75, longitude=-1.25, capacity_kwp=1.25),
+        PVSite(latitude=51.75, longitude=-1.25, capacity_kwp=3, tilt=20, orientation=120),
+        PVSite(latitude=53.5, longitude=-2.0, capacity_kwp=10),
+    ]
+
+    predictions = run_forecast_batch(sites=sites, ts=ts, model="gb")
+
+    assert list(predictions.index.names) == ["site_id", "time"]
+    assert len(predictions) == 3 * 192
+
+    for site_id, site in enumerate(sites):
+        expected = run_forecast(site=site.model_copy(), ts=ts, model="gb")
+        np.testing.assert_allclose(
+            predictions.loc[site_id]["power_kw"].values, expected["power_kw"].values
+        )
+
+
+def test_run_forecast_batch_dataframe(monkeypatch):
+    monkeypatch.setattr(forecast, "get_nwp", mock_get_nwp)
+    monkeypatch.setattr(forecast, "get_nwp_batch", mock_get_nwp_batch)
+
+    sites = pd.DataFrame(
+        {
+            "site_id": ["a", "b"],
+            "latitude": [51.75, 52.0],
+            "longitude": [-1.25, -1.5],
+            "capacity_kwp": [1.25, 1.5],
+        }
+    )
+
+    predictions = run_forecast_batch(sites=sites, ts="2024-06-01 09:00")
+
+    assert set(predictions.index.get_level_values("site_id")) == {"a", "b"}
+    assert (predictions["power_kw"] >= 0).all()
+
+
+@pytest.mark.parametrize("model", ["gb", "xgb"])
+def test_run_forecast_batch_no_sites(model):
+    predictions = run_forecast_batch(sites=[], ts="2024-06-01 09:00", model=model)
+
+    assert list(predictions.index.names) == ["site_id", "time"]
+    assert list(predictions.columns) == ["power_kw"]
+    assert len(predictions) == 0
+
+
+def test_run_forecast_batch_inverters_concurrently(monkeypatch):
+    monkeypatch.setattr(forecast, "get_nwp_batch", mock_get_nwp_batch)
+
+    # each fetch waits for the other, so fetching them one after the other fails
+    barrier = threading.Barrier(2, timeout=5)
+
+    def mock_get_live_generation(site, ts):
+        barrier.wait()
+        return None
+
+    monkeypatch.setattr(data, "get_live_generation", mock_get_live_generation)
+
+    sites = [
+        PVSite(latitude=51.75, longitude=-1.25, capacity_kwp=1.25, inverter_type="solis"),
+        PVSite(latitude=52.0, longitude=-1.5, capacity_kwp=1.5, inverter_type="enphase"),
+    ]
+
+    predictions = run_forecast_batch(sites=sites, ts="2024-06-01 09:00", model="gb")
+
+    assert len(predictions) == 2 * 192
@@ -0,0 +1,190 @@
+import os
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import quartz_solar_forecast.forecast as forecast
+import quartz_solar_forecast.forecast_cache as forecast_cache
+from quartz_solar_forecast.forecast import run_forecast
+from quartz_solar_forecast.forecast_cache import ForecastCache, forecast_bucket, forecast_expiry
+from quartz_solar_forecast.pydantic_models import PVSite
+
+
+def make_forecast(value: float = 1.0) -> pd.DataFrame:
+    index = pd.date_range("2024-06-01 12:00", periods=192, freq="15min")
+    return pd.DataFrame({"power_kw": np.full(192, value)}, index=index)
+
+
+@pytest.fixture
+def site():
+    return PVSite(latitude=51.75, longitude=-1.25, capacity_kwp=1.25)
+
+
+@pytest.fixture
+def later():
+    return datetime.now(timezone.utc) + timedelta(hours=1)
+
+
+def test_forecast_bucket():
+    ts = pd.Timestamp("2024-06-01 12:08")
+    assert forecast_bucket("gb", ts) == pd.Timestamp("2024-06-01 12:00")
+    assert forecast_bucket("gb", "2024-06-01 12:15:00.123456") == pd.Timestamp("2024-06-01 12:15")
+    assert forecast_bucket("xgb", ts) == pd.Timestamp("2024-06-01 12:00")
+    # the xgb model rounds to the nearest hour
+    assert forecast_bucket("xgb", "2024-06-01 12:40") == pd.Timestamp("2024-06-01 13:00")
+
+
+def test_forecast_expiry():
+    now = datetime(2024, 6, 1, 12, 30, tzinfo=timezone.utc)
+    # the 12:00 gfs run is available at 16:00
+    assert forecast_expiry("gb", "gfs", now) == datetime(2024, 6, 1, 16, tzinfo=timezone.utc)
+    assert forecast_expiry("xgb", "gfs", now) == datetime(2024, 6, 1, 13, tzinfo=timezone.utc)
+
+
+def test_make_key(site):
+    cache = ForecastCache()
+    ts = pd.Timestamp("2024-06-01 12:00")
+
+    nearby = site.model_copy(update={"latitude": 51.7501})
+    assert cache.make_key(site, "gb", ts, "icon") == cache.make_key(nearby, "gb", ts, "icon")
+
+    other = site.model_copy(update={"tilt": 20})
+    assert cache.make_key(site, "gb", ts, "icon") != cache.make_key(other, "gb", ts, "icon")
+    assert cache.make_key(site, "gb", ts, "icon") != cache.make_key(site, "gb", ts, "gfs")
+
+    # the nwp source is not used by the xgb model
+    assert cache.make_key(site, "xgb", ts, "icon") == cache.make_key(site, "xgb", ts, "gfs")
+
+
+def test_get_put(site, later):
+    cache = ForecastCache()
+    key = cache.make_key(site, "gb", pd.Timestamp("2024-06-01 12:00"), "icon")
+
+    assert cache.get(key) is None
+    cache.put(key, make_forecast(), later)
+    cached = cache.get(key)
+    pd.testing.assert_frame_equal(cached, make_forecast())
+
+    # changing the result does not change the cache
+    cached["power_kw"] = 0.0
+    pd.testing.assert_frame_equal(cache.get(key), make_forecast())
+
+    assert cache.stats() == {"hits": 2, "misses": 1, "hit_rate": 2 / 3, "size": 1}
+
+
+def test_expiry(site, later):
+    cache = ForecastCache()
+    key = cache.make_key(site, "gb", pd.Timestamp("2024-06-01 12:00"), "icon")
+
+    cache.put(key, make_forecast(), later)
+    assert cache.get(key, now=later - timedelta(minutes=1)) is not None
+    assert cache.get(key, now=later) is None
+    assert cache.stats()["size"] == 0
+
+
+def test_lru(site, later):
+    cache = ForecastCache(max_size=2)
+    keys = [
+        cache.make_key(site, "gb", pd.Timestamp("2024-06-01 12:00") + i * pd.Timedelta("15min"), "icon")
+        for i in range(3)
+    ]
+
+    cache.put(keys[0], make_forecast(0), later)
+    cache.put(keys[1], make_forecast(1), later)
+    # using the first result makes the second the least recently used
+    cache.get(keys[0])
+    cache.put(keys[2], make_forecast(2), later)
+
+    assert cache.get(keys[0]) is not None
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[2]) is not None
+
+
+def test_disk(tmp_path, site, later, monkeypatch):
+    monkeypatch.setattr(forecast_cache, "DISK_PRUNE_INTERVAL", 1)
+    cache = ForecastCache(path=str(tmp_path), max_disk_size=2)
+    keys = [
+        cache.make_key(site, "gb", pd.Timestamp("2024-06-01 12:00") + i * pd.Timedelta("15min"), "icon")
+        for i in range(3)
+    ]
+    for i, key in enumerate(keys):
+        cache.put(key, make_forecast(i), later)
+        # make sure the files have different modification times
+        os.utime(cache._file(key), (i, i))
+
+    assert len(os.listdir(tmp_path)) == 2
+
+    # another process sees the results on disk
+    other = ForecastCache(path=str(tmp_path))
+    assert other.get(keys[0]) is None
+    pd.testing.assert_frame_equal(other.get(keys[2]), make_forecast(2))
+    assert other.stats()["size"] == 1
+
+    other.clear()
+    assert os.listdir(tmp_path) == []
+
+
+def test_run_forecast_cache(monkeypatch, site):
+    calls = []
+
+    def mock_predict_ocf(site, model=None, ts=None, nwp_source="icon", with_no_live_pv=False):
+        calls.append(ts)
+        return make_forecast()
+
+    monkeypatch.setattr(forecast, "predict_ocf", mock_predict_ocf)
+    cache = ForecastCache()
+
+    first = run_forecast(site, ts="2024-06-01 12:05", cache=cache)
+    second = run_forecast(site, ts="2024-06-01 12:02:30.5", cache=cache)
+    run_forecast(site, ts="2024-06-01 12:20", cache=cache)
+    run_forecast(site, ts="2024-06-01 12:05", nwp_source="gfs", cache=cache)
+
+    pd.testing.assert_frame_equal(first, second)
+    # the models are run on the time of the cache key
+    assert calls == [
+        pd.Timestamp("2024-06-01 12:00"),
+        pd.Timestamp("2024-06-01 12:15"),
+        pd.Timestamp("2024-06-01 12:00"),
+    ]
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 3
+
+
+def test_run_forecast_no_cache_with_inverter(monkeypatch, site):
+    calls = []
+
+    def mock_predict_ocf(site, model=None, ts=None, nwp_source="icon", with_no_live_pv=False):
+        calls.append(ts)
+        return make_forecast()
+
+    monkeypatch.setattr(forecast, "predict_ocf", mock_predict_ocf)
+    cache = ForecastCache()
+    site.inverter_type = "solis"
+
+    # the live data changes, so the forecasts of a site with an inverter are not cached
+    run_forecast(site, ts="2024-06-01 12:05", cache=cache)
+    run_forecast(site, ts="2024-06-01 12:05", cache=cache)
+
+    assert len(calls) == 2
+    assert cache.stats()["misses"] == 0
+
+
+def test_run_forecast_cache_xgb(monkeypatch, site):
+    calls = []
+
+    def mock_predict_tryolabs(site, ts=None):
+        calls.append(ts)
+        return make_forecast()
+
+    monkeypatch.setattr(forecast, "predict_tryolabs", mock_predict_tryolabs)
+    cache = ForecastCache()
+
+    # the xgb model makes the same forecast for times rounded to the same hour
+    run_forecast(site, model="xgb", ts="2024-06-01 11:40", cache=cache)
+    run_forecast(site, model="xgb", ts="2024-06-01 12:20", cache=cache)
+    run_forecast(site, model="xgb", ts="2024-06-01 12:40", cache=cache)
+
+    assert calls == [pd.Timestamp("2024-06-01 12:00"), pd.Timestamp("2024-06-01 13:00")]
+    assert cache.stats()["hits"] == 1
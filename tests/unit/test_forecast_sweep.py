@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import quartz_solar_forecast.forecast as forecast
+from benchmarks.fake_open_meteo import FakeOpenMeteo, serve_in_thread
+from quartz_solar_forecast.forecast import run_forecast, run_forecast_sweep
+from quartz_solar_forecast.pydantic_models import PVSite
+from quartz_solar_forecast.weather.client import get_session
+
+SITE = PVSite(latitude=51.75, longitude=-1.25, capacity_kwp=2)
+TS = pd.Timestamp.now().floor("h") - pd.Timedelta(days=1)
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    fake = FakeOpenMeteo(source="synthetic")
+    with serve_in_thread(fake) as url:
+        monkeypatch.setenv("QUARTZ_SOLAR_FORECAST_OPEN_METEO_URL", url)
+        with get_session().cache_disabled():
+            yield fake
+
+
+def test_run_forecast_sweep(fake):
+    cube = run_forecast_sweep(
+        SITE, tilts=[10, 30, 50], orientations=[90, 180], capacities_kwp=[2, 6], ts=TS
+    )
+    # one request for the weather, and one for the visibility from gfs
+    assert fake.requests == 2
+
+    assert cube.dims == ("candidate", "time")
+    assert cube.sizes["candidate"] == 12
+    assert list(cube["tilt"].values[:4]) == [10, 10, 10, 10]
+    assert list(cube["orientation"].values[:4]) == [90, 90, 180, 180]
+    assert list(cube["capacity_kwp"].values[:4]) == [2, 6, 2, 6]
+    assert np.isfinite(cube.values).all()
+    assert float(cube.max()) > 0
+
+    # the same forecasts as for the sites one by one
+    sites = [
+        SITE.model_copy(update={"tilt": tilt, "orientation": orientation, "capacity_kwp": capacity})
+        for tilt, orientation, capacity in zip(
+            cube["tilt"].values, cube["orientation"].values, cube["capacity_kwp"].values
+        )
+    ]
+    for candidate in [0, 5, 11]:
+        expected = run_forecast(sites[candidate], ts=TS)
+        np.testing.assert_allclose(
+            cube.sel(candidate=candidate).values, expected["power_kw"].values, rtol=1e-5
+        )
+
+
+def test_run_forecast_sweep_candidates(fake):
+    candidates = pd.DataFrame({"tilt": [20, 40], "orientation": [135, 225]}, index=["a", "b"])
+
+    cube = run_forecast_sweep(SITE, candidates=candidates, ts=TS)
+
+    assert list(cube["candidate"].values) == [0, 1]
+    assert list(cube["capacity_kwp"].values) == [2, 2]
+    assert list(cube["orientation"].values) == [135, 225]
+
+
+def test_run_forecast_sweep_unknown_model():
+    with pytest.raises(ValueError):
+        run_forecast_sweep(SITE, model="not_a_model")
+
+
+def test_run_forecast_sweep_no_candidates():
+    with pytest.raises(ValueError):
+        run_forecast_sweep(SITE, tilts=[])
+
+
+def test_run_forecast_sweep_ts(monkeypatch):
+    calls = []
+
+    def mock_predict_ocf_batch(sites, site_ids, ts, nwp_source):
+        calls.append(ts)
+        return None
+
+    monkeypatch.setattr(forecast, "predict_ocf_batch", mock_predict_ocf_batch)
+
+    # the time is rounded down to 15 minutes, as in run_forecast
+    run_forecast_sweep(SITE, ts="2024-06-01 12:14:59")
+    before = pd.Timestamp.now()
+    run_forecast_sweep(SITE)
+
+    assert calls[0] == pd.Timestamp("2024-06-01 12:00")
+    assert calls[1] <= before
+    assert calls[1] == calls[1].floor("15min")
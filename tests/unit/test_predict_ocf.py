@@ -0,0 +1,159 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import quartz_solar_forecast.forecast as forecast
+from quartz_solar_forecast.data import format_nwp_data, process_pv_data
+from quartz_solar_forecast.forecast import fetch_nwp_and_pv, no_live_pv_site, predict_ocf
+from quartz_solar_forecast.pydantic_models import PVSite
+
+DELAY_S = 0.5
+
+
+def mock_get_nwp(site: PVSite, ts: datetime, nwp_source: str = "icon"):
+    """Make fake NWP data, after a delay"""
+    time.sleep(DELAY_S)
+
+    start = pd.Timestamp(ts).normalize()
+    times = pd.date_range(start, start + pd.Timedelta(days=8), freq="h", inclusive="left")
+    sun = np.clip(np.sin((times.hour.values - 6) / 12 * np.pi), 0, None)
+    df = pd.DataFrame(
+        {
+            "t": 10 + 5 * sun,
+            "prate": np.zeros(len(times)),
+            "lcc": np.full(len(times), 20.0),
+            "mcc": np.full(len(times), 10.0),
+            "hcc": np.full(len(times), 5.0),
+            "si10": np.full(len(times), 3.0),
+            "dswrf": 600 * sun,
+            "dlwrf": 400 * sun,
+            "vis": np.full(len(times), 24000.0),
+        },
+        index=times,
+    )
+    return format_nwp_data(df, nwp_source, site)
+
+
+def mock_make_pv_data(site: PVSite, ts: pd.Timestamp):
+    """Make fake live PV data, after a delay"""
+    time.sleep(DELAY_S)
+
+    live = pd.DataFrame(
+        {
+            "timestamp": pd.date_range(ts - pd.Timedelta(hours=1), ts, freq="15min"),
+            "power_kw": 0.8,
+        }
+    )
+    return process_pv_data(live, ts, site)
+
+
+@pytest.fixture
+def site():
+    return PVSite(latitude=51.75, longitude=-1.25, capacity_kwp=1.25)
+
+
+def test_predict_ocf_fetches_concurrently(monkeypatch, site):
+    monkeypatch.setattr(forecast, "get_nwp", mock_get_nwp)
+    monkeypatch.setattr(forecast, "make_pv_data", mock_make_pv_data)
+    ts = pd.Timestamp("2024-06-01 12:00")
+
+    # warm up, so the model is loaded
+    predict_ocf(site, ts=ts)
+
+    start = time.monotonic()
+    predictions = predict_ocf(site, ts=ts)
+    duration = time.monotonic() - start
+
+    assert len(predictions) == 192
+    assert duration < 2 * DELAY_S
+
+
+def test_predict_ocf_pv_timeout(monkeypatch, site):
+    monkeypatch.setattr(forecast, "get_nwp", mock_get_nwp)
+    monkeypatch.setattr(forecast, "make_pv_data", mock_make_pv_data)
+    ts = pd.Timestamp("2024-06-01 12:00")
+
+    with_live = predict_ocf(site, ts=ts)
+
+    # the live pv data is slower than the timeout, so the forecast runs without it
+    def slow_make_pv_data(site, ts):
+        time.sleep(2 * DELAY_S)
+        return mock_make_pv_data(site, ts)
+
+    monkeypatch.setattr(forecast, "make_pv_data", slow_make_pv_data)
+    monkeypatch.setattr(forecast, "PV_TIMEOUT_S", 2 * DELAY_S)
+    predictions = predict_ocf(site, ts=ts)
+
+    monkeypatch.setattr(forecast, "make_pv_data", lambda site, ts: process_pv_data(None, ts, site))
+    no_live = predict_ocf(site, ts=ts)
+
+    pd.testing.assert_frame_equal(predictions, no_live)
+    assert not np.allclose(predictions["power_kw"].values, with_live["power_kw"].values)
+
+
+def test_predict_ocf_nwp_timeout(monkeypatch, site):
+    monkeypatch.setattr(forecast, "get_nwp", mock_get_nwp)
+    monkeypatch.setattr(forecast, "NWP_TIMEOUT_S", DELAY_S / 5)
+
+    with pytest.raises(TimeoutError):
+        predict_ocf(site, ts=pd.Timestamp("2024-06-01 12:00"))
+
+
+def test_fetch_timeout_cancels_queued(monkeypatch):
+    # one thread, so the pv fetch waits in the queue behind the nwp fetch
+    monkeypatch.setattr(forecast, "_io_executor", ThreadPoolExecutor(max_workers=1))
+    monkeypatch.setattr(forecast, "NWP_TIMEOUT_S", DELAY_S / 5)
+    release = threading.Event()
+    pv_calls = []
+
+    with pytest.raises(TimeoutError):
+        fetch_nwp_and_pv(release.wait, lambda: pv_calls.append(1), lambda: None)
+
+    release.set()
+    forecast._io_executor.shutdown(wait=True)
+    assert pv_calls == []
+
+
+class FakeInverter:
+    def get_data(self, ts):
+        return pd.DataFrame(
+            {
+                "timestamp": pd.date_range(ts - pd.Timedelta(hours=1), ts, freq="15min"),
+                "power_kw": 0.8,
+            }
+        )
+
+
+@pytest.mark.parametrize(
+    "capacity_kwp, tilt, orientation", [(1.25, 35, 180), (6, 35, 180), (2, 20, 120)]
+)
+def test_predict_ocf_with_no_live_pv(monkeypatch, capacity_kwp, tilt, orientation):
+    site = PVSite(
+        latitude=51.75,
+        longitude=-1.25,
+        capacity_kwp=capacity_kwp,
+        tilt=tilt,
+        orientation=orientation,
+    )
+    monkeypatch.setattr(forecast, "get_nwp", mock_get_nwp)
+    monkeypatch.setattr(PVSite, "get_inverter", lambda self: FakeInverter())
+    ts = pd.Timestamp("2024-06-01 12:00")
+
+    predictions = predict_ocf(site.model_copy(), ts=ts, with_no_live_pv=True)
+
+    # the same as two separate forecasts
+    monkeypatch.setattr(forecast, "make_pv_data", mock_make_pv_data)
+    with_live = predict_ocf(site.model_copy(), ts=ts)
+    monkeypatch.setattr(forecast, "make_pv_data", lambda site, ts: process_pv_data(None, ts, site))
+    # the forecast without live pv is for the default tilt and orientation
+    no_live = predict_ocf(no_live_pv_site(site), ts=ts)
+
+    assert list(predictions.columns) == ["power_kw", "power_kw_no_live_pv"]
+    pd.testing.assert_index_equal(predictions.index, with_live.index)
+    np.testing.assert_allclose(predictions["power_kw"], with_live["power_kw"], rtol=1e-6)
+    np.testing.assert_allclose(predictions["power_kw_no_live_pv"], no_live["power_kw"], rtol=1e-6)
@@ -0,0 +1,88 @@
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+
+import quartz_solar_forecast.data as data
+from quartz_solar_forecast.data import NwpStore, get_nwp, set_nwp_store
+from quartz_solar_forecast.prefetch import NwpPrefetcher
+from quartz_solar_forecast.pydantic_models import PVSite
+
+
+class FakeVariable:
+    def __init__(self, values):
+        self.values = values
+
+    def ValuesAsNumpy(self):
+        return self.values
+
+
+class FakeResponse:
+    def __init__(self, start, values):
+        self.start = start
+        self.values = values
+
+    def Hourly(self):
+        return self
+
+    def Time(self):
+        return int(self.start.timestamp())
+
+    def TimeEnd(self):
+        return int(self.start.timestamp()) + 3600 * self.values.shape[1]
+
+    def Interval(self):
+        return 3600
+
+    def Variables(self, idx):
+        return FakeVariable(self.values[idx])
+
+
+class FakeOpenMeteoClient:
+    """Returns one response per location, the values are the latitude of the location"""
+
+    def __init__(self):
+        self.n_locations = []
+
+    def weather_api(self, url, params):
+        latitudes = [float(latitude) for latitude in params["latitude"].split(",")]
+        self.n_locations.append(len(latitudes))
+
+        variables = params["hourly"]
+        n_variables = 1 if isinstance(variables, str) else len(variables)
+        return [
+            FakeResponse(
+                pd.Timestamp(params["start_date"]),
+                np.full((n_variables, 8 * 24), latitude, dtype=np.float32),
+            )
+            for latitude in latitudes
+        ]
+
+
+def test_prefetcher(monkeypatch, tmp_path):
+    client = FakeOpenMeteoClient()
+    monkeypatch.setattr(data, "get_openmeteo_client", lambda: client)
+
+    sites = pd.DataFrame({"latitude": [51.0 + i / 100 for i in range(10)], "longitude": -1.0})
+    set_nwp_store(NwpStore(str(tmp_path)))
+    try:
+        prefetcher = NwpPrefetcher(sites, nwp_sources=["icon", "gfs"], chunk_size=4)
+
+        # naive UTC, as the API uses
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        assert prefetcher.run_pending(now) == ["icon", "gfs"]
+        # 3 chunks for each source, icon has a second request for visibility
+        assert sorted(client.n_locations) == [2, 2, 2, 4, 4, 4, 4, 4, 4]
+
+        # nothing to do until there is a new run, at the time given
+        assert prefetcher.run_pending(now) == []
+        assert "icon" in prefetcher.run_pending(now + timedelta(hours=3))
+
+        # get_nwp reads the prefetched data from the store
+        client.n_locations = []
+        site = PVSite(latitude=51.05, longitude=-1.0, capacity_kwp=1)
+        nwp_xr = get_nwp(site, pd.Timestamp(now).floor("15min"), nwp_source="gfs")
+        assert client.n_locations == []
+        assert (nwp_xr["gfs"].values == np.float32(51.05)).all()
+    finally:
+        set_nwp_store(None)
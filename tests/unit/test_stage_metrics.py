@@ -0,0 +1,92 @@
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from api.app.api import app
+from quartz_solar_forecast.metrics import Histogram, MetricsRegistry, metrics
+
+
+def test_histogram_quantile():
+    histogram = Histogram(buckets=(1.0, 2.0, 4.0))
+    for value in [0.5, 1.5, 1.5, 3.0]:
+        histogram.observe(value)
+
+    assert histogram.counts == [1, 3, 4]
+    assert histogram.quantile(0.5) == pytest.approx(1.5)
+    assert histogram.quantile(1.0) == 4.0
+    assert histogram.sum == pytest.approx(6.5)
+
+
+def test_timed():
+    registry = MetricsRegistry()
+
+    @registry.timed("model_predict")
+    def predict():
+        time.sleep(0.01)
+
+    predict()
+    predict()
+    with pytest.raises(ValueError):
+        with registry.timed("postprocess"):
+            raise ValueError()
+
+    stages = registry.get_stats()["stages"]
+    assert stages["model_predict"]["count"] == 2
+    assert stages["model_predict"]["mean"] >= 0.01
+    assert stages["postprocess"]["count"] == 1
+
+
+def test_render_prometheus():
+    registry = MetricsRegistry()
+    registry.inc("http_requests_total", host="api.open-meteo.com")
+    registry.inc("http_response_bytes_total", 1000, host="api.open-meteo.com")
+    registry.inc("http_requests_total", host="api.open-meteo.com")
+    registry.observe("nwp_http", 0.2)
+
+    assert registry.get_stats()["counters"] == {
+        'http_requests_total{host="api.open-meteo.com"}': 2,
+        'http_response_bytes_total{host="api.open-meteo.com"}': 1000,
+    }
+
+    lines = registry.render_prometheus().splitlines()
+    assert "# TYPE quartz_solar_forecast_http_requests_total counter" in lines
+    assert 'quartz_solar_forecast_http_requests_total{host="api.open-meteo.com"} 2' in lines
+    assert "# TYPE quartz_solar_forecast_stage_duration_seconds histogram" in lines
+    assert 'quartz_solar_forecast_stage_duration_seconds_bucket{stage="nwp_http",le="0.1"} 0' in lines
+    assert 'quartz_solar_forecast_stage_duration_seconds_bucket{stage="nwp_http",le="0.25"} 1' in lines
+    assert 'quartz_solar_forecast_stage_duration_seconds_bucket{stage="nwp_http",le="+Inf"} 1' in lines
+    assert 'quartz_solar_forecast_stage_duration_seconds_count{stage="nwp_http"} 1' in lines
+
+    registry.reset()
+    assert registry.render_prometheus() == "\n"
+
+
+def test_metrics_route():
+    metrics.observe("model_load", 1.5)
+
+    response = TestClient(app).get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'quartz_solar_forecast_stage_duration_seconds_count{stage="model_load"}' in response.text
+
+
+def test_aggregate(tmp_path):
+    worker = MetricsRegistry()
+    worker.inc("http_requests_total", host="api.open-meteo.com")
+    worker.observe("nwp_http", 0.2)
+    worker.write_snapshot(str(tmp_path), name="1")
+
+    registry = MetricsRegistry()
+    registry.inc("http_requests_total", 2, host="api.open-meteo.com")
+    registry.observe("nwp_http", 0.02)
+
+    assert registry.aggregate() is registry
+
+    total = registry.aggregate(str(tmp_path))
+    assert total.get_stats()["counters"] == {'http_requests_total{host="api.open-meteo.com"}': 3}
+    assert total.get_stats()["stages"]["nwp_http"]["count"] == 2
+    lines = total.render_prometheus().splitlines()
+    assert 'quartz_solar_forecast_stage_duration_seconds_bucket{stage="nwp_http",le="0.1"} 1' in lines
+    assert 'quartz_solar_forecast_stage_duration_seconds_bucket{stage="nwp_http",le="0.25"} 2' in lines
@@ -0,0 +1,196 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+
+from benchmarks.fake_open_meteo import FakeOpenMeteo, serve_in_thread
+import quartz_solar_forecast.weather.client as client
+from quartz_solar_forecast.weather.client import (
+    OpenMeteoSession,
+    clear_async_cache,
+    close_async_session,
+    get_async_session,
+    get_nwp_schedule_name,
+    get_openmeteo_client,
+    get_session,
+    next_run_available,
+    open_meteo_url,
+    weather_api_async,
+)
+
+
+def test_get_nwp_schedule_name():
+    assert get_nwp_schedule_name("https://api.open-meteo.com/v1/dwd-icon") == "icon"
+    assert get_nwp_schedule_name("https://api.open-meteo.com/v1/gfs") == "gfs"
+    assert (
+        get_nwp_schedule_name(
+            "https://api.open-meteo.com/v1/forecast", params={"models": "ukmo_seamless"}
+        )
+        == "ukmo"
+    )
+    assert get_nwp_schedule_name("https://archive-api.open-meteo.com/v1/archive") == "archive"
+    assert get_nwp_schedule_name("http://localhost:8080/v1/archive") == "archive"
+    assert (
+        get_nwp_schedule_name("https://api.open-meteo.com/v1/forecast?latitude=51&hourly=is_day")
+        == "best_match"
+    )
+
+
+def test_next_run_available():
+    now = datetime(2024, 6, 1, 10, 30, tzinfo=timezone.utc)
+
+    # the 06:00 icon run was published at 08:00, the 09:00 run is published at 11:00
+    expires = next_run_available("https://api.open-meteo.com/v1/dwd-icon", now=now)
+    assert expires == datetime(2024, 6, 1, 11, tzinfo=timezone.utc)
+
+    # the 06:00 gfs run is published at 10:00, the 12:00 run at 16:00
+    expires = next_run_available("https://api.open-meteo.com/v1/gfs", now=now)
+    assert expires == datetime(2024, 6, 1, 16, tzinfo=timezone.utc)
+
+    # just before a gfs run is published
+    now = datetime(2024, 6, 1, 9, 59)
+    expires = next_run_available("https://api.open-meteo.com/v1/gfs", now=now)
+    assert expires == datetime(2024, 6, 1, 10, tzinfo=timezone.utc)
+
+    expires = next_run_available("https://archive-api.open-meteo.com/v1/archive", now=now)
+    assert expires == datetime(2024, 6, 2, tzinfo=timezone.utc)
+
+
+def test_session_is_shared():
+    assert get_session() is get_session()
+    assert get_openmeteo_client() is get_openmeteo_client()
+    assert get_openmeteo_client().session is get_session()
+
+    adapter = get_session().get_adapter("https://api.open-meteo.com")
+    assert adapter.max_retries.total == 5
+    assert {429, 503} <= set(adapter.max_retries.status_forcelist)
+
+
+def test_session_purges_expired(monkeypatch):
+    params = {
+        "latitude": "51.75",
+        "longitude": "-1.25",
+        "start_date": "2024-06-01",
+        "end_date": "2024-06-02",
+        "hourly": "temperature_2m",
+        "format": "flatbuffers",
+    }
+    session = OpenMeteoSession("test", backend="memory")
+
+    with serve_in_thread(FakeOpenMeteo(source="synthetic")) as url:
+        session.get(f"{url}/v1/dwd-icon", params=params, expire_after=1)
+        time.sleep(1.1)
+
+        # not purged until the interval has passed
+        session.get(f"{url}/v1/gfs", params=params)
+        assert len(session.cache.responses) == 2
+
+        monkeypatch.setattr(client, "PURGE_INTERVAL_S", 0)
+        session.get(f"{url}/v1/gfs", params=params)
+        urls = [response.url for response in session.cache.responses.values()]
+        assert len(urls) == 1
+        assert "/v1/gfs" in urls[0]
+
+
+def test_open_meteo_url(monkeypatch):
+    monkeypatch.delenv("QUARTZ_SOLAR_FORECAST_OPEN_METEO_URL", raising=False)
+    monkeypatch.delenv("QUARTZ_SOLAR_FORECAST_OPEN_METEO_ARCHIVE_URL", raising=False)
+    assert open_meteo_url() == "https://api.open-meteo.com"
+    assert open_meteo_url(archive=True) == "https://archive-api.open-meteo.com"
+
+    # a self-hosted server has all the endpoints
+    monkeypatch.setenv("QUARTZ_SOLAR_FORECAST_OPEN_METEO_URL", "http://open-meteo-api:8080/")
+    assert open_meteo_url() == "http://open-meteo-api:8080"
+    assert open_meteo_url(archive=True) == "http://open-meteo-api:8080"
+
+    monkeypatch.setenv("QUARTZ_SOLAR_FORECAST_OPEN_METEO_ARCHIVE_URL", "http://archive:8080")
+    assert open_meteo_url(archive=True) == "http://archive:8080"
+
+
+def test_weather_api_async_cache():
+    fake = FakeOpenMeteo(source="synthetic")
+    params = {
+        "latitude": "51.75",
+        "longitude": "-1.25",
+        "start_date": "2024-06-01",
+        "end_date": "2024-06-02",
+        "hourly": ["shortwave_radiation", "temperature_2m"],
+    }
+
+    async def fetch(url):
+        session = await get_async_session()
+        return await weather_api_async(session, f"{url}/v1/dwd-icon", params)
+
+    clear_async_cache()
+    with serve_in_thread(fake) as url:
+        first = asyncio.run(fetch(url))
+        second = asyncio.run(fetch(url))
+        assert fake.requests == 1
+        assert (
+            first[0].Hourly().Variables(0).ValuesAsNumpy()
+            == second[0].Hourly().Variables(0).ValuesAsNumpy()
+        ).all()
+
+        with get_session().cache_disabled():
+            asyncio.run(fetch(url))
+        assert fake.requests == 2
+    clear_async_cache()
+
+
+def test_weather_api_async_does_not_make_session(monkeypatch):
+    # making the shared session opens its sqlite cache, which blocks the event loop
+    monkeypatch.setattr(client, "_session", None)
+    monkeypatch.setattr(client, "OpenMeteoSession", None)
+    fake = FakeOpenMeteo(source="synthetic")
+    params = {
+        "latitude": "51.75",
+        "longitude": "-1.25",
+        "start_date": "2024-06-01",
+        "end_date": "2024-06-02",
+        "hourly": ["temperature_2m"],
+    }
+
+    async def fetch(url):
+        session = await get_async_session()
+        return await weather_api_async(session, f"{url}/v1/dwd-icon", params)
+
+    clear_async_cache()
+    with serve_in_thread(fake) as url:
+        responses = asyncio.run(fetch(url))
+    clear_async_cache()
+
+    assert len(responses) == 1
+    assert client._session is None
+
+
+def test_weather_api_async_retries_rate_limit(monkeypatch):
+    monkeypatch.setattr(client, "BACKOFF_FACTOR", 0)
+    # with this seed, the first request is rate limited
+    fake = FakeOpenMeteo(source="synthetic", rate_limit_rate=0.5, seed=4)
+    params = {
+        "latitude": "51.75",
+        "longitude": "-1.25",
+        "start_date": "2024-06-01",
+        "end_date": "2024-06-02",
+        "hourly": ["temperature_2m"],
+    }
+
+    async def fetch(url):
+        session = await get_async_session()
+        return await weather_api_async(session, f"{url}/v1/dwd-icon", params)
+
+    with serve_in_thread(fake) as url, get_session().cache_disabled():
+        responses = asyncio.run(fetch(url))
+
+    assert fake.errors >= 1
+    assert fake.requests == fake.errors + 1
+    assert len(responses) == 1
+
+
+def test_async_session_closed_when_loop_changes():
+    first = asyncio.run(get_async_session())
+    second = asyncio.run(get_async_session())
+
+    assert first is not second
+    assert first.closed
+    assert not second.closed
+    asyncio.run(close_async_session())